@@ -20,6 +20,7 @@ from werkzeug.exceptions import HTTPException
 # Import application components
 from models import db, User
 from routes import register_blueprints
+from cli import register_commands
 from config import config
 
 # Initialize Flask-Login
@@ -68,6 +69,7 @@ def create_app(config_name=None):
     _register_blueprints(app)
     _register_error_handlers(app)
     _register_shell_context(app)
+    _register_cli_commands(app)
     
     # Add request hooks
     _register_request_hooks(app)
@@ -121,7 +123,11 @@ def _configure_rate_limiting(app):
         storage_uri=app.config.get('RATELIMIT_STORAGE_URL', 'memory://'),
         strategy='fixed-window'
     )
-    
+
+    # Import job progress is polled every few seconds; polling must not use up the default limits
+    from routes.import_export import get_import_job
+    limiter.exempt(get_import_job)
+
     app.logger.info(f"Rate limiting configured: {', '.join(default_limits)}")
 
 def _register_blueprints(app):
@@ -190,6 +196,10 @@ def _register_shell_context(app):
     def make_shell_context():
         return {'db': db}
 
+def _register_cli_commands(app):
+    """Register Flask CLI maintenance commands"""
+    register_commands(app)
+
 def _register_request_hooks(app):
     """Register request hooks like before_request and after_request"""
     @app.after_request
@@ -0,0 +1,6 @@
+"""
+Benchmarks for lab tracker backend
+
+Standalone scripts that seed a throwaway SQLite database and time hot paths.
+Run them from the backend directory, e.g. `python -m benchmarks.bench_dashboard`.
+"""
@@ -0,0 +1,122 @@
+"""
+Import clean/validate benchmark
+
+Writes a CSV of --rows usage records (mixed date formats, a few invalid rows),
+reads it in IMPORT_CHUNK_SIZE chunks and times the previous per-cell / per-row
+clean and validate code against ExcelProcessor.validate_chunk, checking that
+both return the same records and errors.  Reading the file is timed once and
+excluded from both.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_clean [--rows 1000000] [--chunk-size 5000] [--repeat 1]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from benchmarks.common import best_of
+
+
+def write_csv(path, row_count, seed=42):
+    """Usage rows in the template's columns, with varied date formats and ~1% invalid rows"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=730)
+    formats = ['%Y-%m-%d', '%Y.%m.%d', '%Y/%m/%d', '%Y.%m%d', '%m-%d-%Y']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('类型,产品名,数量及数量单位,存放地,CAS号,使用人,使用日期,使用量,余量,单位,备注\n')
+        for i in range(row_count):
+            day = start + timedelta(days=rng.randrange(730))
+            usage_date = day.strftime(formats[i % len(formats)])
+            user = f'用户{rng.randrange(50)}'
+            amount = round(rng.uniform(0.1, 5.0), 2)
+            roll = rng.random()
+            if roll < 0.004:
+                user = ''
+            elif roll < 0.007:
+                usage_date = '未知'
+            elif roll < 0.01:
+                amount = -amount
+            f.write(f'类型{i % 8},产品{rng.randrange(2000)},500g,柜{i % 20},,{user},{usage_date},{amount},0,g,\n')
+
+
+def validate_chunk_rowwise(df, first_row, date_cache=None):
+    """The previous pipeline: parse_date per cell, validate_record per row dict"""
+    from services.excel_processor import ExcelProcessor
+    from utils.date_parser import DateParser
+
+    df.index = range(first_row, first_row + len(df))
+    df = ExcelProcessor.normalize_column_names(df)
+    df = df.dropna(how='all')
+    for col in ['类型', '产品名', '数量及数量单位', '存放地', 'CAS号', '使用人', '单位', '备注']:
+        if col in df.columns:
+            df[col] = df[col].fillna('')
+    if '使用日期' in df.columns:
+        df['使用日期'] = df['使用日期'].apply(lambda x: DateParser.parse_date(str(x)) if pd.notna(x) else None)
+    for col in ['使用量', '余量']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    valid_records = []
+    errors = []
+    for row_number, record in zip(df.index, df.to_dict('records')):
+        is_valid, record_errors = ExcelProcessor.validate_record(record)
+        if is_valid:
+            valid_records.append(record)
+        else:
+            errors.append(f"Row {row_number}: {'; '.join(record_errors)}")
+    return valid_records, errors
+
+
+def run_pipeline(chunks, validate):
+    valid_records, errors = [], []
+    first_row = 2
+    date_cache = {}
+    for df in chunks:
+        chunk_valid, chunk_errors = validate(df.copy(), first_row, date_cache)
+        valid_records.extend(chunk_valid)
+        errors.extend(chunk_errors)
+        first_row += len(df)
+    return valid_records, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='data rows in the CSV')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows per chunk (IMPORT_CHUNK_SIZE)')
+    parser.add_argument('--repeat', type=int, default=1, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    from services.excel_processor import ExcelProcessor
+    from utils.table_reader import iter_frames
+
+    work_dir = tempfile.mkdtemp(prefix='lab_tracker_bench_')
+    try:
+        path = os.path.join(work_dir, 'usage.csv')
+        write_csv(path, args.rows)
+
+        start = time.perf_counter()
+        chunks = list(iter_frames(path, args.chunk_size))
+        read_seconds = time.perf_counter() - start
+        print(f"read {args.rows:,d} rows in {len(chunks)} chunks: {read_seconds:.2f}s")
+
+        results = {}
+        for name, validate in [('rowwise', validate_chunk_rowwise), ('vectorized', ExcelProcessor.validate_chunk)]:
+            elapsed, results[name] = best_of(lambda: run_pipeline(chunks, validate), args.repeat)
+            valid_records, errors = results[name]
+            print(f"{name:11s} {elapsed:8.2f}s {args.rows / elapsed:12,.0f} rows/s "
+                  f"({len(valid_records):,d} valid, {len(errors):,d} errors)")
+
+        assert results['rowwise'] == results['vectorized'], 'pipelines disagree'
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Columnar analytics cache benchmark
+
+Seeds a throwaway SQLite database, then times each analytics payload computed
+by the SQL implementation (over the daily rollup) and by the in-process NumPy
+snapshot, including the one-off snapshot build and a catch-up after writes.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_columnar [--rows 1000000] [--days 365]
+"""
+
+import argparse
+import time
+from datetime import date
+
+from benchmarks.common import best_of, create_benchmark_app, remove_benchmark_db, seed_usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='usage records to seed')
+    parser.add_argument('--days', type=int, default=365, help='analytics window in days')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    app, db_path = create_benchmark_app()
+    try:
+        run(args, db_path)
+    finally:
+        remove_benchmark_db(db_path)
+
+
+def run(args, db_path):
+    from models import Storage
+    from cli import _payloads_match
+    from routes.analytics import (
+        _compute_dashboard_stats, _compute_personnel_stats, _compute_product_stats, _compute_usage_trends
+    )
+    from services.columnar_usage import ColumnarAnalytics, columnar_usage_cache
+    from services.storage_service import StorageService
+    from services.usage_rollup import UsageRollupService
+
+    print(f"Seeding {args.rows:,} usage records into {db_path} ...")
+    seed_usage(args.rows)
+    UsageRollupService.rebuild()
+
+    start = time.perf_counter()
+    snapshot = columnar_usage_cache.snapshot()
+    print(f"snapshot build: {len(snapshot):,} rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    days = args.days
+    checks = [
+        ('dashboard', lambda: _compute_dashboard_stats(days), lambda: ColumnarAnalytics.dashboard_stats(days)),
+        ('personnel', lambda: _compute_personnel_stats(days), lambda: ColumnarAnalytics.personnel_stats(days)),
+        ('products', lambda: _compute_product_stats(days), lambda: ColumnarAnalytics.product_stats(days)),
+        ('trends/weekly', lambda: _compute_usage_trends('weekly', days),
+         lambda: ColumnarAnalytics.usage_trends('weekly', days)),
+    ]
+    print(f"{'payload':16s} {'sql ms':>10s} {'columnar ms':>12s}  parity")
+    for name, sql_impl, columnar_impl in checks:
+        sql_time, expected = best_of(sql_impl, args.repeat)
+        columnar_time, actual = best_of(columnar_impl, args.repeat)
+        parity = 'ok' if not _payloads_match(expected, actual) else 'MISMATCH'
+        print(f"{name:16s} {sql_time * 1000:10.1f} {columnar_time * 1000:12.1f}  {parity}")
+
+    # Incremental catch-up after a few ORM writes
+    item = Storage.query.first()
+    for _ in range(10):
+        StorageService.record_usage(item.id, {'使用人': '基准', '使用日期': date.today(), '使用量': 0.01})
+    start = time.perf_counter()
+    columnar_usage_cache.snapshot()
+    print(f"catch-up after 10 writes: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Dashboard aggregation benchmark
+
+Seeds a throwaway SQLite database (1,000,000 usage records by default), then
+compares the original per-metric dashboard queries over usage_records against
+the single-pass rollup query used by /api/analytics/dashboard.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_dashboard [--rows 1000000] [--days 30]
+"""
+
+import argparse
+from datetime import date, timedelta
+
+from benchmarks.common import (
+    StatementCounter, best_of, create_benchmark_app, remove_benchmark_db, seed_usage
+)
+
+
+def legacy_dashboard(days):
+    """Original implementation: seven separate queries over usage_records"""
+    from sqlalchemy import func, desc
+    from models import db, UsageRecord
+
+    start_date = date.today() - timedelta(days=days)
+    linked = UsageRecord.storage_id.isnot(None)
+    base_query = UsageRecord.query.filter(linked)
+
+    total_records = base_query.count()
+    recent_records = base_query.filter(UsageRecord.使用日期 >= start_date).count()
+    unique_personnel = db.session.query(func.count(func.distinct(UsageRecord.使用人))).filter(linked).scalar()
+    unique_products = db.session.query(func.count(func.distinct(UsageRecord.产品名))).filter(linked).scalar()
+    top_products = db.session.query(
+        UsageRecord.产品名, func.count(UsageRecord.id).label('usage_count')
+    ).filter(linked, UsageRecord.使用日期 >= start_date).group_by(
+        UsageRecord.产品名).order_by(desc('usage_count')).limit(5).all()
+    top_personnel = db.session.query(
+        UsageRecord.使用人, func.count(UsageRecord.id).label('record_count')
+    ).filter(linked, UsageRecord.使用日期 >= start_date).group_by(
+        UsageRecord.使用人).order_by(desc('record_count')).limit(5).all()
+    daily_usage = db.session.query(
+        UsageRecord.使用日期, func.count(UsageRecord.id).label('count')
+    ).filter(linked, UsageRecord.使用日期 >= start_date).group_by(
+        UsageRecord.使用日期).order_by(UsageRecord.使用日期).all()
+
+    return {
+        'total_records': total_records,
+        'recent_records': recent_records,
+        'unique_personnel': unique_personnel,
+        'unique_products': unique_products,
+        'top_products': top_products,
+        'top_personnel': top_personnel,
+        'daily_usage': daily_usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='usage records to seed')
+    parser.add_argument('--days', type=int, default=30, help='dashboard window in days')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    app, db_path = create_benchmark_app()
+    try:
+        run(args, db_path)
+    finally:
+        remove_benchmark_db(db_path)
+
+
+def run(args, db_path):
+    from models import db
+    from routes.analytics import _compute_dashboard_stats
+    from services.usage_rollup import UsageRollupService
+
+    print(f"Seeding {args.rows:,} usage records into {db_path} ...")
+    seed_usage(args.rows)
+    rollup_rows = UsageRollupService.rebuild()
+    print(f"usage_daily_rollup: {rollup_rows:,} rows")
+
+    counter = StatementCounter(db.engine)
+    variants = [
+        ('legacy (7 queries on usage_records)', lambda: legacy_dashboard(args.days)),
+        ('single pass (rollup CTE)', lambda: _compute_dashboard_stats(args.days)),
+    ]
+
+    results = {}
+    for label, func in variants:
+        counter.reset()
+        func()
+        statements = len(counter.statements)
+        scans = counter.full_scans()
+        elapsed, payload = best_of(func, args.repeat)
+        results[label] = payload
+        print(f"{label:40s} statements={statements:<3d} full_scans={scans!s:<4s} best={elapsed * 1000:9.1f} ms")
+
+    legacy, single = (results[label] for label, _ in variants)
+    assert legacy['total_records'] == single['total_records']
+    assert legacy['recent_records'] == single['recent_records']
+    assert [(d.使用日期.isoformat(), d.count) for d in legacy['daily_usage']] == \
+        [(d['date'], d['count']) for d in single['daily_usage']]
+    print("Totals and daily series match.")
+
+
+if __name__ == '__main__':
+    main()
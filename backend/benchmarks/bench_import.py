@@ -0,0 +1,109 @@
+"""
+Usage record import benchmark
+
+Times inserting validated import records the old way (one ORM object per row,
+a single commit) against UsageImportService's chunked Core inserts, for each
+size in --sizes.  "longest txn" is the longest single write transaction, i.e.
+how long the import holds SQLite's write lock at a time.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_import [--sizes 10000,100000,1000000] [--chunk-size 5000]
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import create_benchmark_app, remove_benchmark_db
+
+
+def make_records(count, seed=42):
+    """Validated import records as produced by ExcelProcessor.import_excel"""
+    rng = random.Random(seed)
+    today = date.today()
+    units = ['g', 'ml', 'mg', '瓶']
+    records = []
+    for i in range(count):
+        unit = units[i % len(units)]
+        records.append({
+            '类型': f'类型{i % 8}',
+            '产品名': f'产品{rng.randrange(2000)}',
+            '数量及数量单位': f'500{unit}',
+            '存放地': f'柜{i % 20}',
+            'CAS号': '',
+            '使用人': f'用户{rng.randrange(50)}',
+            '使用日期': today - timedelta(days=rng.randrange(730)),
+            '使用量': round(rng.uniform(0.1, 5.0), 2),
+            '余量': 0.0,
+            '单位': unit,
+            '备注': '',
+        })
+    return records
+
+
+def import_orm(records):
+    """The previous /api/import loop: session.add per row, one commit"""
+    from models import db, UsageRecord
+
+    for record_data in records:
+        db.session.add(UsageRecord(**record_data))
+    db.session.commit()
+    return len(records)
+
+
+def clear_usage():
+    from models import db, UsageRecord, UsageRecordChange
+    db.session.query(UsageRecordChange).delete()
+    db.session.query(UsageRecord).delete()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated record counts')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='records per transaction')
+    parser.add_argument('--orm-limit', type=int, default=100000,
+                        help='skip the ORM baseline above this many records (it is slow)')
+    args = parser.parse_args()
+
+    app, db_path = create_benchmark_app()
+    try:
+        run(args)
+    finally:
+        remove_benchmark_db(db_path)
+
+
+def run(args):
+    from services.usage_import import UsageImportService
+
+    print(f"{'records':>10s} {'method':8s} {'seconds':>9s} {'rows/s':>10s} {'longest txn ms':>15s}")
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        records = make_records(size)
+
+        if size <= args.orm_limit:
+            clear_usage()
+            start = time.perf_counter()
+            import_orm(records)
+            elapsed = time.perf_counter() - start
+            # The whole import is one transaction
+            print(f"{size:10,d} {'orm':8s} {elapsed:9.2f} {size / elapsed:10,.0f} {elapsed * 1000:15.0f}")
+
+        clear_usage()
+        chunk_times = []
+        last = [time.perf_counter()]
+
+        def on_progress(inserted, total):
+            now = time.perf_counter()
+            chunk_times.append(now - last[0])
+            last[0] = now
+
+        start = time.perf_counter()
+        inserted, errors = UsageImportService.insert_records(records, args.chunk_size, on_progress)
+        elapsed = time.perf_counter() - start
+        assert inserted == size and not errors, errors
+        print(f"{size:10,d} {'chunked':8s} {elapsed:9.2f} {size / elapsed:10,.0f} {max(chunk_times) * 1000:15.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Multi-sheet workbook import benchmark
+
+Writes an XLSX workbook of --sheets worksheets with --rows rows of usage
+records each (a few invalid rows per sheet, and some numeric product codes
+and staff numbers, which must come back as text) and times reading, cleaning and
+validating all sheets with ExcelProcessor.iter_import_chunks for every
+process count in --processes, checking that all counts return the same
+records and errors.  The parallel speed-up is bounded by the number of CPU
+cores and by the largest sheet.  With --write, the merged records are then
+inserted once with UsageImportService.import_chunks into a throwaway database
+whose catalogue holds the numeric product codes, to show the serial part of an
+import (every valid record must be inserted).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_sheets [--sheets 8] [--rows 50000] [--processes 1,2,4,8] [--write]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from openpyxl import Workbook
+
+from benchmarks.common import create_benchmark_app, remove_benchmark_db
+
+# Product codes written as number cells
+NUMERIC_CODES = range(1000, 1100)
+TEXT_COLUMNS = ['类型', '产品名', '数量及数量单位', '存放地', 'CAS号', '使用人', '单位', '备注']
+
+
+def write_workbook(path, sheet_count, row_count, seed=42):
+    """One sheet of usage rows per month, as sub-labs send them, with ~1% invalid rows and ~2% numeric codes"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=730)
+    workbook = Workbook(write_only=True)
+    for s in range(sheet_count):
+        worksheet = workbook.create_sheet(f'{s + 1}月')
+        worksheet.append(['类型', '产品名', '数量及数量单位', '存放地', 'CAS号', '使用人', '使用日期', '使用量', '余量', '单位', '备注'])
+        for i in range(row_count):
+            usage_date = (start + timedelta(days=rng.randrange(730))).strftime('%Y.%m.%d')
+            product = f'产品{rng.randrange(2000)}'
+            user = f'用户{rng.randrange(50)}'
+            amount = round(rng.uniform(0.1, 5.0), 2)
+            roll = rng.random()
+            if roll < 0.005:
+                user = None
+            elif roll < 0.01:
+                usage_date = '未知'
+            elif roll < 0.02:
+                product = NUMERIC_CODES[0] + rng.randrange(len(NUMERIC_CODES))
+            elif roll < 0.03:
+                user = 20000 + rng.randrange(50)
+            worksheet.append([f'类型{i % 8}', product, '500g', f'柜{i % 20}', None,
+                              user, usage_date, amount, 0, 'g', None])
+    workbook.save(path)
+
+
+def seed_catalogue():
+    """Storage items named by the numeric product codes, in every cabinet the workbook uses"""
+    from sqlalchemy import insert
+    from models import db, Storage
+
+    db.session.execute(insert(Storage), [
+        {'类型': f'类型{c % 8}', '产品名': str(code), '数量及数量单位': '500g', '存放地': f'柜{c}',
+         '当前库存量': 500.0, '单位': 'g'}
+        for code in NUMERIC_CODES for c in range(20)
+    ])
+    db.session.commit()
+
+
+def parse_all(path, chunk_size, processes):
+    from services.excel_processor import ExcelProcessor
+
+    valid_records, errors = [], []
+    for chunk_records, chunk_errors in ExcelProcessor.iter_import_chunks(path, chunk_size, processes=processes):
+        valid_records.extend(chunk_records)
+        errors.extend(chunk_errors)
+    return valid_records, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=8, help='worksheets in the workbook')
+    parser.add_argument('--rows', type=int, default=50000, help='data rows per worksheet')
+    parser.add_argument('--processes', default=None,
+                        help='comma-separated process counts (default: 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows per chunk (IMPORT_CHUNK_SIZE)')
+    parser.add_argument('--write', action='store_true', help='also time inserting the merged records')
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    if args.processes:
+        process_counts = [int(p) for p in args.processes.split(',')]
+    else:
+        process_counts = [1]
+        while process_counts[-1] * 2 <= cpu_count:
+            process_counts.append(process_counts[-1] * 2)
+
+    work_dir = tempfile.mkdtemp(prefix='lab_tracker_bench_')
+    try:
+        path = os.path.join(work_dir, 'usage.xlsx')
+        start = time.perf_counter()
+        write_workbook(path, args.sheets, args.rows)
+        print(f"wrote {args.sheets} sheets x {args.rows:,d} rows ({os.path.getsize(path) / 1e6:.1f} MB) "
+              f"in {time.perf_counter() - start:.2f}s; {cpu_count} CPUs")
+
+        results = {}
+        baseline = None
+        for processes in process_counts:
+            start = time.perf_counter()
+            results[processes] = parse_all(path, args.chunk_size, processes)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            valid_records, errors = results[processes]
+            print(f"{processes:3d} processes {elapsed:8.2f}s  speed-up {baseline / elapsed:5.2f}x "
+                  f"({len(valid_records):,d} valid, {len(errors):,d} errors)")
+
+        first = results[process_counts[0]]
+        assert all(result == first for result in results.values()), 'process counts disagree'
+        assert all(isinstance(record[col], str) for record in first[0] for col in TEXT_COLUMNS), \
+            'numeric cells in text columns must be read as text'
+
+        if args.write:
+            from services.usage_import import UsageImportService
+
+            app, db_path = create_benchmark_app()
+            try:
+                seed_catalogue()
+                start = time.perf_counter()
+                result = UsageImportService.import_chunks([first], chunk_size=args.chunk_size)
+                print(f"insert {result['imported_count']:,d} records ({result['linked_count']:,d} linked): "
+                      f"{time.perf_counter() - start:.2f}s")
+                assert result['imported_count'] == len(first[0]), result['errors'][-5:]
+            finally:
+                remove_benchmark_db(db_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Shared helpers for the benchmark scripts."""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def create_benchmark_app(db_path=None):
+    """Create an app bound to a throwaway SQLite file and create its tables"""
+    import logging
+    logging.disable(logging.INFO)
+
+    db_path = db_path or os.path.join(tempfile.mkdtemp(prefix='lab_tracker_bench_'), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from app import create_app
+    from models import db
+
+    app = create_app('production')
+    app.config['RESPONSE_CACHE_ENABLED'] = False
+    ctx = app.app_context()
+    ctx.push()
+    db.create_all()
+    return app, db_path
+
+
+def remove_benchmark_db(db_path):
+    """Dispose the engine and delete the throwaway database directory"""
+    from models import db
+    db.session.remove()
+    db.engine.dispose()
+    shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+
+def seed_usage(row_count, item_count=1000, user_count=50, items_per_user=5, days=730,
+               chunk_size=50000, seed=42):
+    """Insert storage items and *row_count* usage records with Core executemany.
+
+    Each user draws from a small set of items, as lab members repeatedly use
+    the same reagents, so several records share a (day, item, user) bucket.
+    """
+    from sqlalchemy import insert
+    from models import db, Storage, UsageRecord
+
+    rng = random.Random(seed)
+    units = ['g', 'ml', 'mg', '瓶']
+    storage_rows = []
+    for i in range(item_count):
+        unit = units[i % len(units)]
+        storage_rows.append({
+            '类型': f'类型{i % 8}',
+            '产品名': f'产品{i}',
+            '数量及数量单位': f'1000{unit}',
+            '存放地': f'柜{i % 20}',
+            'CAS号': f'{i}-00-{i % 10}',
+            '当前库存量': float(rng.randint(0, 1000)),
+            '单位': unit,
+        })
+    db.session.execute(insert(Storage), storage_rows)
+    db.session.commit()
+
+    items = db.session.query(Storage.id, Storage.产品名, Storage.类型, Storage.存放地, Storage.单位).all()
+    today = date.today()
+    users = [f'用户{i}' for i in range(user_count)]
+    pairs = [(user, items[rng.randrange(len(items))]) for user in users for _ in range(items_per_user)]
+
+    inserted = 0
+    while inserted < row_count:
+        batch = []
+        for _ in range(min(chunk_size, row_count - inserted)):
+            user, item = pairs[rng.randrange(len(pairs))]
+            batch.append({
+                'storage_id': item.id,
+                '类型': item.类型,
+                '产品名': item.产品名,
+                '数量及数量单位': f'1000{item.单位}',
+                '存放地': item.存放地,
+                '使用人': user,
+                '使用日期': today - timedelta(days=rng.randrange(days)),
+                '使用量': round(rng.uniform(0.1, 5.0), 2),
+                '余量': 0.0,
+                '单位': item.单位,
+            })
+        db.session.execute(insert(UsageRecord), batch)
+        db.session.commit()
+        inserted += len(batch)
+    return inserted
+
+
+class StatementCounter:
+    """Count SQL statements (and SQLite full-table scans) executed on an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.engine = engine
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('EXPLAIN'):
+            self.statements.append((statement, parameters))
+
+    def reset(self):
+        self.statements = []
+
+    def full_scans(self):
+        """Number of base-table 'SCAN' steps in the SQLite query plans of the recorded statements.
+
+        Scans of materialized CTEs and subqueries are not counted.
+        """
+        if self.engine.dialect.name != 'sqlite':
+            return None
+        from sqlalchemy import inspect
+        tables = set(inspect(self.engine).get_table_names())
+        scans = 0
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            for statement, parameters in self.statements:
+                if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+                for row in cursor.fetchall():
+                    detail = str(row[-1]).split()
+                    if len(detail) > 1 and detail[0] == 'SCAN' and detail[1] in tables:
+                        scans += 1
+        finally:
+            raw.close()
+        return scans
+
+
+def best_of(func, repeat=3):
+    """Return (best wall time in seconds, last result)"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
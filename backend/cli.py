@@ -0,0 +1,153 @@
+"""
+Flask CLI commands for lab tracker maintenance tasks
+
+Usage (from the backend directory):
+    flask --app run upgrade-schema
+    flask --app run backfill usage-rollup
+"""
+
+import click
+from flask.cli import AppGroup, with_appcontext
+
+backfill_cli = AppGroup('backfill', help='Rebuild derived tables from source data.')
+
+
+@backfill_cli.command('usage-rollup')
+def backfill_usage_rollup():
+    """Rebuild usage_daily_rollup from usage_records"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('usage-rollup')
+    click.echo(f"✅ usage_daily_rollup rebuilt: {row_count} rows")
+
+
+@backfill_cli.command('storage-quantities')
+def backfill_storage_quantities():
+    """Re-parse initial quantity/unit and stock ratio for all storage items"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('storage-quantities')
+    click.echo(f"✅ storage quantity fields backfilled: {row_count} rows")
+
+
+@backfill_cli.command('usage-base-quantities')
+def backfill_usage_base_quantities():
+    """Convert 使用量 of all usage records to the base unit of their dimension"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('usage-base-quantities')
+    click.echo(f"✅ usage base quantities backfilled: {row_count} rows")
+
+
+@backfill_cli.command('usage-row-hashes')
+def backfill_usage_row_hashes():
+    """Fingerprint all usage records so that re-imported rows are recognized"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('usage-row-hashes')
+    click.echo(f"✅ usage row hashes backfilled: {row_count} rows")
+
+
+@backfill_cli.command('storage-last-used')
+def backfill_storage_last_used():
+    """Recompute last_used_at of all storage items from usage_records"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('storage-last-used')
+    click.echo(f"✅ storage last_used_at backfilled: {row_count} rows")
+
+
+@backfill_cli.command('storage-usage-stats')
+def backfill_storage_usage_stats():
+    """Rebuild storage_usage_stats from usage_records"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('storage-usage-stats')
+    click.echo(f"✅ storage_usage_stats rebuilt: {row_count} rows")
+
+
+@backfill_cli.command('usage-sketches')
+def backfill_usage_sketches():
+    """Rebuild the per-day top-N sketches from usage_records"""
+    from services.schema_migrations import run_backfill
+
+    row_count = run_backfill('usage-sketches')
+    click.echo(f"✅ usage_daily_sketches rebuilt: {row_count} rows")
+
+
+@click.command('upgrade-schema')
+@with_appcontext
+def upgrade_schema_command():
+    """Add columns and indexes missing from an existing database, then run their backfills"""
+    from models import db
+    from services.schema_migrations import upgrade_schema, empty_derived_tables, run_backfill
+
+    db.create_all()
+    backfills = upgrade_schema()
+    backfills += [name for name in empty_derived_tables() if name not in backfills]
+    for name in backfills:
+        row_count = run_backfill(name)
+        click.echo(f"✅ Backfill {name} completed ({row_count} rows)")
+    click.echo("✅ Schema is up to date")
+
+
+def _payloads_match(expected, actual, path='') -> list:
+    """Differences between two JSON-like payloads (floats compared with a tolerance)"""
+    import math
+
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if expected.keys() != actual.keys():
+            return [f"{path}: keys {sorted(expected)} != {sorted(actual)}"]
+        return [d for key in expected for d in _payloads_match(expected[key], actual[key], f"{path}.{key}")]
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path}: {len(expected)} items != {len(actual)} items"]
+        return [d for i, (e, a) in enumerate(zip(expected, actual)) for d in _payloads_match(e, a, f"{path}[{i}]")]
+    if isinstance(expected, float) or isinstance(actual, float):
+        if isinstance(expected, (int, float)) and isinstance(actual, (int, float)) \
+                and math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-9):
+            return []
+    elif expected == actual:
+        return []
+    return [f"{path}: {expected!r} != {actual!r}"]
+
+
+@click.command('analytics-parity')
+@click.option('--days', default='7,30,365', help='Comma-separated analytics windows to compare.')
+@with_appcontext
+def analytics_parity_command(days):
+    """Compare the columnar analytics cache with the SQL implementation"""
+    from routes.analytics import (
+        _compute_dashboard_stats, _compute_personnel_stats, _compute_product_stats, _compute_usage_trends
+    )
+    from services.columnar_usage import ColumnarAnalytics
+
+    failures = 0
+    for window in [int(d) for d in days.split(',') if d.strip()]:
+        checks = [
+            ('dashboard', _compute_dashboard_stats, ColumnarAnalytics.dashboard_stats, (window,)),
+            ('personnel', _compute_personnel_stats, ColumnarAnalytics.personnel_stats, (window,)),
+            ('products', _compute_product_stats, ColumnarAnalytics.product_stats, (window,)),
+        ] + [
+            (f'trends/{period}', _compute_usage_trends, ColumnarAnalytics.usage_trends, (period, window))
+            for period in ('daily', 'weekly', 'monthly')
+        ]
+        for name, sql_impl, columnar_impl, args in checks:
+            differences = _payloads_match(sql_impl(*args), columnar_impl(*args))
+            if differences:
+                failures += 1
+                click.echo(f"❌ {name} (days={window}): {len(differences)} differences")
+                for difference in differences[:10]:
+                    click.echo(f"   {difference}")
+            else:
+                click.echo(f"✅ {name} (days={window})")
+
+    if failures:
+        raise SystemExit(1)
+
+
+def register_commands(app):
+    """Register all CLI command groups with the Flask application"""
+    app.cli.add_command(backfill_cli)
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(analytics_parity_command)
@@ -18,6 +18,8 @@ class Config:
     # Upload configuration
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Upload limit of the chunked /api/import path, whose memory use does not grow with the file
+    STREAMING_IMPORT_MAX_CONTENT_LENGTH = int(os.environ.get('STREAMING_IMPORT_MAX_CONTENT_LENGTH', 512 * 1024 * 1024))
     ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     
@@ -31,9 +33,45 @@ class Config:
     RATELIMIT_DEFAULT = "200 per day;50 per hour"
     RATELIMIT_STORAGE_URL = "memory://"
     
+    # Response cache for dashboard endpoints (invalidated by writes, TTL as fallback)
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))  # seconds
+    
+    # Serve analytics from a per-worker NumPy snapshot of usage_records instead of SQL
+    ANALYTICS_COLUMNAR_CACHE = os.environ.get('ANALYTICS_COLUMNAR_CACHE', 'false').lower() == 'true'
+    # Newest usage change log entries kept for the columnar caches to catch up from (older ones are pruned
+    # hourly; a cache further behind rebuilds).  Nothing is logged while the columnar cache is off.
+    USAGE_CHANGE_LOG_KEEP = int(os.environ.get('USAGE_CHANGE_LOG_KEEP', 100000))
+    
+    # Background scheduler: one leader process (holding SCHEDULER_LOCK_FILE) runs periodic jobs
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 2))
+    SCHEDULER_LOCK_FILE = os.path.join(INSTANCE_DIR, 'scheduler.lock')
+    # Precomputed payloads older than this are recomputed on request (date-relative windows)
+    PRECOMPUTED_PAYLOAD_MAX_AGE = int(os.environ.get('PRECOMPUTED_PAYLOAD_MAX_AGE', 600))  # seconds
+    
+    # Temp directories of Excel exports, pruned by the scheduler
+    EXPORT_TEMP_PREFIX = 'lab_tracker_export_'
+    EXPORT_TEMP_MAX_AGE = 3600  # seconds
+    EXPORT_BATCH_SIZE = 2000  # rows fetched per round trip while streaming an export
+    
+    # Background import jobs (async=true uploads), run by IMPORT_WORKERS threads per process
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))  # 0 disables this process's workers
+    IMPORT_JOB_DIR = os.path.join(INSTANCE_DIR, 'imports')  # saved uploads of queued/running jobs
+    IMPORT_JOB_POLL_INTERVAL = 5  # seconds between checks for jobs queued by other processes
+    IMPORT_JOB_HEARTBEAT_INTERVAL = 60  # seconds between heartbeats of a running job
+    IMPORT_JOB_STALE_AFTER = 600  # seconds without a heartbeat before a running job whose worker exited is failed
+    IMPORT_JOB_MAX_AGE_DAYS = 7  # finished jobs and their errors are deleted after this
+    # Processes parsing the worksheets of a multi-sheet workbook in parallel, per import (1 parses them in-process).
+    # Each holds one chunk in memory and spills its parsed sheet to a temp file until the import reads it.
+    IMPORT_SHEET_PROCESSES = int(os.environ.get('IMPORT_SHEET_PROCESSES', 1))
+    
     # Pagination
     RECORDS_PER_PAGE = 20
     STORAGE_ITEMS_PER_PAGE = 20
+    IMPORT_CHUNK_SIZE = 5000  # usage records inserted per transaction by /api/import
+    MAX_PER_PAGE = 500  # JSON pages; use format=ndjson|csv for full reads
+    STREAM_BATCH_SIZE = 1000  # rows fetched per round trip by streaming list responses
     
     # Application settings
     JSON_SORT_KEYS = False
@@ -63,6 +101,7 @@ class TestingConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    SCHEDULER_ENABLED = False
     
     # Testing-specific settings
     PRESERVE_CONTEXT_ON_EXCEPTION = False
@@ -1,14 +1,18 @@
 """Simple factory helpers to generate common list endpoints (GET /api/<model>)."""
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from typing import Callable, List, Any
 from sqlalchemy.orm import Query
 
 # Import query helper lazily to avoid circular deps
 from utils.query_helpers import apply_search, apply_filters, apply_sort, paginate
+from core.streaming import requested_format, stream_query
 
 def list_endpoint(model, schema_func: Callable[[Any], dict], search_columns: List[str], extra_filters: dict | None = None, base_query: Query | None = None):
     """Handle a generic paginated list response.
 
+    `format=ndjson|csv` streams every matching row instead of one page; JSON
+    pages are capped at MAX_PER_PAGE items.
+
     Parameters
     ----------
     model : SQLAlchemy model class
@@ -22,12 +26,16 @@ def list_endpoint(model, schema_func: Callable[[Any], dict], search_columns: Lis
     search = request.args.get('search', '')
     sort_by = request.args.get('sort_by', search_columns[0] if search_columns else 'id')
     sort_order = request.args.get('sort_order', 'asc')
+    try:
+        fmt = requested_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Build initial query
     query = base_query or model.query
 
     # Apply dynamic filters from query params (except known params)
-    ignore_keys = {'page', 'per_page', 'search', 'sort_by', 'sort_order'}
+    ignore_keys = {'page', 'per_page', 'search', 'sort_by', 'sort_order', 'format'}
     dynamic_filters = {k: v for k, v in request.args.items() if k not in ignore_keys and v}
 
     if extra_filters:
@@ -37,13 +45,16 @@ def list_endpoint(model, schema_func: Callable[[Any], dict], search_columns: Lis
     query = apply_filters(query, model, dynamic_filters)
     query = apply_sort(query, model, sort_by, sort_order)
 
-    pagination = paginate(query, page, per_page)
+    if fmt:
+        return stream_query(query, schema_func, fmt, model.__tablename__)
+
+    pagination = paginate(query, page, per_page, current_app.config.get('MAX_PER_PAGE'))
 
     return jsonify({
         'items': [schema_func(item) for item in pagination.items],
         'total': pagination.total,
         'page': page,
-        'per_page': per_page,
+        'per_page': pagination.per_page,
         'pages': pagination.pages,
         'has_next': pagination.has_next,
         'has_prev': pagination.has_prev
@@ -0,0 +1,40 @@
+"""
+Temp files for Excel downloads
+
+Exports are written to a fresh temp directory and streamed from disk with
+send_file; the directory is removed as soon as the response is closed.  The
+prune-temp-exports job only catches directories left behind by crashed
+workers.
+"""
+import os
+import shutil
+import tempfile
+
+from flask import current_app, send_file
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def export_path(filename: str) -> str:
+    """Path of *filename* inside a new export temp directory"""
+    temp_dir = tempfile.mkdtemp(prefix=current_app.config.get('EXPORT_TEMP_PREFIX', 'lab_tracker_export_'))
+    return os.path.join(temp_dir, filename)
+
+
+def discard_export(file_path: str) -> None:
+    """Remove the temp directory of an export path"""
+    shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+
+def send_export(file_path: str, download_name: str, mimetype: str = XLSX_MIMETYPE):
+    """Stream *file_path* as an attachment and delete its temp directory afterwards"""
+    try:
+        response = send_file(file_path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    except Exception:
+        discard_export(file_path)
+        raise
+    # Close callbacks only run for responses that werkzeug wraps in a ClosingIterator,
+    # which it skips for direct-passthrough file responses
+    response.direct_passthrough = False
+    response.call_on_close(lambda: discard_export(file_path))
+    return response
@@ -0,0 +1,76 @@
+"""Local worker pool for jobs queued in the database.
+
+Jobs are rows in a table; the request that creates one returns immediately.
+Worker threads claim the oldest queued job with a conditional UPDATE, so every
+process can run a pool and a job is only ever run once.  notify() wakes the
+local workers right away; otherwise they poll, which also picks up jobs queued
+by other processes or left over from a restart.
+"""
+import logging
+import os
+import threading
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Worker threads that claim and run queued jobs inside an application context"""
+
+    def __init__(self, name: str, claim: Callable[[], Optional[int]], run: Callable[[int], None],
+                 poll_interval: float = 5.0):
+        self.name = name
+        self.claim = claim
+        self.run = run
+        self.poll_interval = poll_interval
+        self._app = None
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self, app, workers: int = 1) -> bool:
+        """Start *workers* threads once per process; returns False if already running"""
+        with self._start_lock:
+            if self.running or workers < 1:
+                return False
+
+            self._app = app
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._loop, name=f'{self.name}-worker-{i}', daemon=True)
+                for i in range(workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        logger.info(f"{self.name} workers started in process {os.getpid()} ({workers} threads)")
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self) -> None:
+        """Wake the local workers to claim a newly queued job"""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            job_id = None
+            try:
+                with self._app.app_context():
+                    job_id = self.claim()
+                    if job_id is not None:
+                        self.run(job_id)
+            except Exception as e:
+                logger.error(f"{self.name} worker failed on job {job_id}: {str(e)}")
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
@@ -0,0 +1,148 @@
+"""In-process response cache keyed by request parameters and data version.
+
+Entries are reused only while the data version they were computed for is still
+current and their TTL has not expired.  Concurrent misses for the same key are
+coalesced: one caller computes the value while the others wait for its result.
+Keys registered with precompute() are also refreshed by a scheduled job, and a
+miss first looks for that shared precomputed copy.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Entry:
+    __slots__ = ('version', 'value', 'expires_at')
+
+    def __init__(self, version: Hashable, value: Any, expires_at: float):
+        self.version = version
+        self.value = value
+        self.expires_at = expires_at
+
+
+class _Pending:
+    __slots__ = ('version', 'event', 'value', 'error')
+
+    def __init__(self, version: Hashable):
+        self.version = version
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class ResponseCache:
+    """Thread-safe cache of computed response payloads."""
+
+    def __init__(self, default_ttl: float = 60.0, wait_timeout: float = 30.0):
+        self.default_ttl = default_ttl
+        self.wait_timeout = wait_timeout
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, version: Hashable, compute: Callable[[], Any],
+                       ttl: Optional[float] = None) -> Any:
+        """Return the cached value for *key* at *version*, computing it at most once.
+
+        Parameters
+        ----------
+        key : hashable cache key (endpoint name + parameters)
+        version : data version the value must have been computed for
+        compute : zero-argument callable producing the value on a miss
+        ttl : seconds before the entry expires regardless of version (default_ttl if None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version and entry.expires_at > now:
+                self.hits += 1
+                return entry.value
+
+            self.misses += 1
+            pending = self._pending.get(key)
+            is_leader = pending is None or pending.version != version
+            if is_leader:
+                pending = _Pending(version)
+                self._pending[key] = pending
+
+        if not is_leader:
+            # Another request is already computing this key at the same version
+            if pending.event.wait(self.wait_timeout) and pending.error is None:
+                return pending.value
+            return compute()
+
+        try:
+            value = compute()
+            pending.value = value
+            with self._lock:
+                self._entries[key] = _Entry(version, value, time.monotonic() + (self.default_ttl if ttl is None else ttl))
+            return value
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+            pending.event.set()
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one entry, or every entry if *key* is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Shared per-process instance used by route handlers
+response_cache = ResponseCache()
+
+# Payloads refreshed by scheduled jobs: group -> {cache key: compute}
+PRECOMPUTED: Dict[str, Dict[Hashable, Callable[[], Any]]] = {}
+
+
+def precompute(group: str, key: Tuple, compute: Callable[[], Any]) -> None:
+    """Register a cache key whose payload the *group* scheduled job keeps precomputed"""
+    PRECOMPUTED.setdefault(group, {})[key] = compute
+
+
+def _is_precomputed(key: Hashable) -> bool:
+    return any(key in payloads for payloads in PRECOMPUTED.values())
+
+
+def cached_payload(key: Tuple, compute: Callable[[], Any]) -> Any:
+    """Serve *compute()* through the shared cache, versioned by Storage/UsageRecord writes.
+
+    Honours the RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_TTL and
+    PRECOMPUTED_PAYLOAD_MAX_AGE config values.
+    """
+    from flask import current_app
+    from services.data_version import DataVersionService
+    from services.precomputed_payloads import PrecomputedPayloadService
+
+    if not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+        return compute()
+
+    version = DataVersionService.current()
+    if _is_precomputed(key):
+        max_age = current_app.config.get('PRECOMPUTED_PAYLOAD_MAX_AGE', 600)
+
+        def load_or_compute():
+            payload = PrecomputedPayloadService.get(key, version, max_age)
+            return payload if payload is not None else compute()
+    else:
+        load_or_compute = compute
+
+    return response_cache.get_or_compute(
+        key,
+        version,
+        load_or_compute,
+        ttl=current_app.config.get('RESPONSE_CACHE_TTL', response_cache.default_ttl)
+    )
@@ -0,0 +1,220 @@
+"""In-process scheduler for periodic background jobs.
+
+Every worker process may start the scheduler, but only the process holding an
+exclusive lock on a shared lock file (the leader) runs jobs.  Followers retry
+the lock on every tick, so leadership moves to another worker when the leader
+exits.  Due jobs run on a small thread pool inside an application context; a
+job is never started again while its previous run is still in progress.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, every process leads
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """Non-blocking exclusive lock on a file, held for the life of the process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._handle = None
+
+    @property
+    def held(self) -> bool:
+        return self._handle is not None
+
+    def try_acquire(self) -> bool:
+        if self._handle is not None:
+            return True
+        if fcntl is None:
+            self._handle = True
+            return True
+
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._handle = handle
+        return True
+
+    def release(self) -> None:
+        if self._handle is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            self._handle.close()
+        self._handle = None
+
+
+class ScheduledJob:
+    """A registered periodic job and its in-process run metrics"""
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float,
+                 initial_delay: float = 0.0, description: str = ''):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.description = description
+        self.next_run = time.monotonic() + initial_delay
+        self.running = False
+        self.run_count = 0
+        self.failure_count = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_started_at: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_result: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'description': self.description,
+            'interval_seconds': self.interval,
+            'running': self.running,
+            'run_count': self.run_count,
+            'failure_count': self.failure_count,
+            'last_started_at': self.last_started_at.isoformat() if self.last_started_at else None,
+            'last_duration_ms': round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+            'avg_duration_ms': round(self.total_duration / self.run_count * 1000, 1) if self.run_count else None,
+            'max_duration_ms': round(self.max_duration * 1000, 1),
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'last_result': self.last_result
+        }
+
+
+class JobScheduler:
+    """Leader-elected periodic job runner backed by a thread pool"""
+
+    def __init__(self, tick: float = 1.0):
+        self.tick = tick
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.lock: Optional[LeaderLock] = None
+        self._app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._jobs_lock = threading.Lock()
+        self._listeners: List[Callable[[ScheduledJob], None]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lock is not None and self.lock.held
+
+    def register(self, name: str, func: Callable[[], Any], interval: float,
+                 initial_delay: float = 0.0, description: str = '') -> ScheduledJob:
+        """Register *func* to run every *interval* seconds (first run after *initial_delay*)"""
+        job = ScheduledJob(name, func, interval, initial_delay, description)
+        with self._jobs_lock:
+            self.jobs[name] = job
+        return job
+
+    def on_finish(self, listener: Callable[[ScheduledJob], None]) -> None:
+        """Call *listener(job)* in the job's app context after every run"""
+        self._listeners.append(listener)
+
+    def start(self, app, lock_path: str, max_workers: int = 2) -> bool:
+        """Start the scheduler thread once per process; returns False if already running"""
+        if self.running:
+            return False
+
+        self._app = app
+        self.lock = LeaderLock(lock_path)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler-job')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduler started in process {os.getpid()} with {len(self.jobs)} jobs")
+        return True
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        if self.lock is not None:
+            self.lock.release()
+
+    def run_now(self, name: str) -> None:
+        """Make a job due on the next tick (only the leader runs it)"""
+        self.jobs[name].next_run = 0.0
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._jobs_lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.lock.try_acquire():
+                    self._submit_due_jobs()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {str(e)}")
+            self._stop.wait(self.tick)
+
+    def _submit_due_jobs(self) -> None:
+        now = time.monotonic()
+        with self._jobs_lock:
+            due = [job for job in self.jobs.values() if not job.running and job.next_run <= now]
+            for job in due:
+                job.running = True
+        for job in due:
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: ScheduledJob) -> None:
+        started = time.perf_counter()
+        job.last_started_at = datetime.utcnow()
+        with self._app.app_context():
+            try:
+                job.last_result = job.func()
+                job.last_status = 'success'
+                job.last_error = None
+            except Exception as e:
+                job.failure_count += 1
+                job.last_status = 'failed'
+                job.last_error = str(e)
+                logger.error(f"Scheduled job {job.name} failed: {str(e)}")
+            finally:
+                duration = time.perf_counter() - started
+                job.run_count += 1
+                job.last_duration = duration
+                job.total_duration += duration
+                job.max_duration = max(job.max_duration, duration)
+                job.next_run = time.monotonic() + job.interval
+                job.running = False
+
+            for listener in self._listeners:
+                try:
+                    listener(job)
+                except Exception as e:
+                    logger.error(f"Scheduler listener failed for {job.name}: {str(e)}")
+
+
+# Shared per-process instance
+scheduler = JobScheduler()
@@ -0,0 +1,80 @@
+"""
+Streaming list responses (NDJSON / CSV) for full-table reads
+
+List endpoints accept `format=ndjson|csv` to return every matching row instead
+of one JSON page.  Rows are fetched from a server-side cursor in batches of
+STREAM_BATCH_SIZE (Query.yield_per) and serialized batch by batch in a
+generator response, so neither the result set nor the response body is held
+in memory.
+"""
+import csv
+import io
+import json
+from typing import Any, Callable, Iterator, Optional
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy.orm import Query
+
+# Streaming format -> Content-Type
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def requested_format(args) -> Optional[str]:
+    """Streaming format requested via `format=`, None for the default JSON page.
+
+    Raises ValueError for unknown formats.
+    """
+    value = (args.get('format') or 'json').lower()
+    if value == 'json':
+        return None
+    if value not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported format '{value}', expected one of: json, {', '.join(STREAM_FORMATS)}")
+    return value
+
+
+def _batches(query: Query, batch_size: int) -> Iterator[list]:
+    batch = []
+    for item in query.yield_per(batch_size):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ndjson(query: Query, schema_func: Callable[[Any], dict], batch_size: int) -> Iterator[str]:
+    for batch in _batches(query, batch_size):
+        yield ''.join(json.dumps(schema_func(item), ensure_ascii=False, default=str) + '\n' for item in batch)
+
+
+def _csv(query: Query, schema_func: Callable[[Any], dict], batch_size: int) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = None
+    for batch in _batches(query, batch_size):
+        for item in batch:
+            row = schema_func(item)
+            if writer is None:
+                # Header from the first row's keys
+                writer = csv.DictWriter(buffer, fieldnames=list(row), extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_query(query: Query, schema_func: Callable[[Any], dict], fmt: str, filename: str) -> Response:
+    """Stream every row of *query* as NDJSON or CSV (*filename* without extension for CSV downloads)"""
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 1000)
+    generate = _ndjson if fmt == 'ndjson' else _csv
+    response = Response(
+        stream_with_context(generate(query, schema_func, batch_size)),
+        content_type=STREAM_FORMATS[fmt]
+    )
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+    return response
@@ -0,0 +1,13 @@
+"""Gunicorn settings (loaded automatically from the working directory)"""
+
+
+def post_worker_init(worker):
+    """Start the background scheduler and import workers in every worker process.
+
+    Only the scheduler lock holder runs scheduled jobs; every process's import
+    workers claim queued import jobs.
+    """
+    from services.import_jobs import start_import_workers
+    from services.scheduled_jobs import start_scheduler
+    start_scheduler(worker.wsgi)
+    start_import_workers(worker.wsgi)
@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import Index
+from sqlalchemy import Index, event
 from flask_login import UserMixin
 
+from utils.number_utils import NumberUtils
+from utils.units import to_base
+
 db = SQLAlchemy()
 
 # User Authentication Model
@@ -44,9 +47,38 @@ class Storage(db.Model):
     创建时间 = db.Column(db.DateTime, default=datetime.utcnow)
     更新时间 = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Parsed from 数量及数量单位 on every write (see sync_quantity_fields)
+    initial_quantity = db.Column(db.Float, nullable=True)  # Initial quantity (in initial_unit)
+    initial_unit = db.Column(db.String(10), nullable=True)  # Initial unit
+    stock_ratio = db.Column(db.Float, nullable=True)  # 当前库存量 / initial_quantity, NULL if not comparable
+    base_quantity = db.Column(db.Float, nullable=True)  # 当前库存量 in the base unit (mg, µL or count)
+    base_dimension = db.Column(db.String(10), nullable=True)  # 'mass', 'volume', 'count'; NULL for unknown units
+    
+    # Latest 使用日期 of the item's usage records, or the creation date if never used (maintained by StorageService)
+    last_used_at = db.Column(db.Date, nullable=True)
+    
     # Relationship to usage records
     usage_records = db.relationship('UsageRecord', backref='storage_item', lazy=True)
     
+    def created_on(self):
+        """Date of 创建时间 (None before the item is inserted)"""
+        return self.创建时间.date() if self.创建时间 else None
+    
+    def sync_quantity_fields(self):
+        """Refresh the parsed initial quantity/unit and the stock ratio"""
+        try:
+            self.initial_quantity, self.initial_unit = NumberUtils.parse_quantity(self.数量及数量单位)
+        except ValueError:
+            self.initial_quantity, self.initial_unit = None, None
+        
+        # Ratio is only meaningful when units match and the initial quantity is positive
+        if self.initial_quantity and self.initial_quantity > 0 and self.initial_unit == self.单位:
+            self.stock_ratio = (self.当前库存量 or 0.0) / self.initial_quantity
+        else:
+            self.stock_ratio = None
+        
+        self.base_quantity, self.base_dimension = to_base(self.当前库存量, self.单位)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -58,6 +90,7 @@ class Storage(db.Model):
             'CAS号': self.CAS号,
             '当前库存量': self.当前库存量,
             '单位': self.单位,
+            'last_used_at': self.last_used_at.isoformat() if self.last_used_at else None,
             '创建时间': self.创建时间.isoformat() if self.创建时间 else None,
             '更新时间': self.更新时间.isoformat() if self.更新时间 else None
         }
@@ -85,9 +118,40 @@ class UsageRecord(db.Model):
     创建时间 = db.Column(db.DateTime, default=datetime.utcnow)
     更新时间 = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 使用量 converted on every write (see sync_base_quantity)
+    base_quantity = db.Column(db.Float, nullable=True)  # 使用量 in the base unit (mg, µL or count)
+    base_dimension = db.Column(db.String(10), nullable=True)  # 'mass', 'volume', 'count'; NULL for unknown units
+    
+    # Content fingerprint (see UsageImportService.row_hash); NULL for records entered by hand since the
+    # usage-row-hashes backfill, which fingerprints every older record
+    row_hash = db.Column(db.String(80), nullable=True, unique=True, index=True)
+    
     # Relationship to user
     user = db.relationship('User', backref='usage_records')
     
+    @staticmethod
+    def resolve_unit(unit, quantity_text):
+        """Unit of 使用量: *unit*, or the unit of *quantity_text* (数量及数量单位) when empty"""
+        if unit:
+            return unit
+        try:
+            return NumberUtils.parse_quantity(quantity_text)[1]
+        except ValueError:
+            return None
+    
+    @property
+    def usage_unit(self):
+        """Unit of 使用量 (see resolve_unit)"""
+        return UsageRecord.resolve_unit(self.单位, self.数量及数量单位)
+    
+    def base_usage(self):
+        """(使用量 in the base unit, dimension) from the current field values"""
+        return to_base(self.使用量, self.usage_unit)
+    
+    def sync_base_quantity(self):
+        """Refresh the persisted base-unit quantity"""
+        self.base_quantity, self.base_dimension = self.base_usage()
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -126,13 +190,262 @@ class Personnel(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+# Daily usage rollup, maintained transactionally by StorageService usage write paths
+class UsageDailyRollup(db.Model):
+    __tablename__ = 'usage_daily_rollup'
+    
+    day = db.Column(db.Date, primary_key=True)  # Usage Date
+    storage_id = db.Column(db.Integer, db.ForeignKey('storage.id'), primary_key=True)
+    使用人 = db.Column(db.String(100), primary_key=True)  # User
+    产品名 = db.Column(db.String(200), primary_key=True)  # Product Name as recorded (UsageRecord.产品名)
+    类型 = db.Column(db.String(100), primary_key=True)  # Type as recorded (UsageRecord.类型)
+    record_count = db.Column(db.Integer, nullable=False, default=0)  # Number of usage records
+    total_usage = db.Column(db.Float, nullable=False, default=0.0)  # Sum of 使用量 (in storage/unit)
+    total_base_quantity = db.Column(db.Float, nullable=False, default=0.0)  # Sum of base_quantity
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'storage_id': self.storage_id,
+            '使用人': self.使用人,
+            '产品名': self.产品名,
+            '类型': self.类型,
+            'record_count': self.record_count,
+            'total_usage': self.total_usage,
+            'total_base_quantity': self.total_base_quantity
+        }
+
+# Per-storage usage statistics, maintained incrementally with the usage records
+class StorageUsageStats(db.Model):
+    __tablename__ = 'storage_usage_stats'
+    
+    storage_id = db.Column(db.Integer, db.ForeignKey('storage.id'), primary_key=True)
+    usage_count = db.Column(db.Integer, nullable=False, default=0)  # Number of usage records
+    total_usage = db.Column(db.Float, nullable=False, default=0.0)  # Sum of 使用量 (in storage/unit)
+    total_base_quantity = db.Column(db.Float, nullable=False, default=0.0)  # Sum of base_quantity
+    first_usage_date = db.Column(db.Date, nullable=True)  # Earliest 使用日期
+    last_usage_date = db.Column(db.Date, nullable=True)  # Latest 使用日期
+    top_user = db.Column(db.String(100), nullable=True)  # 使用人 with the most records
+    top_user_count = db.Column(db.Integer, nullable=False, default=0)  # Records of top_user
+    
+    def to_dict(self):
+        return {
+            'storage_id': self.storage_id,
+            'usage_count': self.usage_count,
+            'total_usage': self.total_usage,
+            'total_base_quantity': self.total_base_quantity,
+            'first_usage_date': self.first_usage_date.isoformat() if self.first_usage_date else None,
+            'last_usage_date': self.last_usage_date.isoformat() if self.last_usage_date else None,
+            'top_user': self.top_user,
+            'top_user_count': self.top_user_count
+        }
+
+# Per-day streaming summaries of storage-linked usage, maintained by StorageService usage write paths
+class UsageDailySketch(db.Model):
+    __tablename__ = 'usage_daily_sketches'
+    
+    day = db.Column(db.Date, primary_key=True)  # Usage Date
+    dimension = db.Column(db.String(20), primary_key=True)  # 'product' (UsageRecord.产品名) or 'person' (使用人)
+    top_counters = db.Column(db.Text, nullable=True)  # Space-Saving counters as JSON
+    distinct_registers = db.Column(db.LargeBinary, nullable=True)  # HyperLogLog registers
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'dimension': self.dimension,
+            'top_counters': self.top_counters
+        }
+
+# Append-only change sequence of usage_records, read by in-process caches to catch up
+class UsageRecordChange(db.Model):
+    __tablename__ = 'usage_record_changes'
+    
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)  # Change sequence number
+    usage_id = db.Column(db.Integer, nullable=False)  # Inserted, updated or deleted usage record
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'usage_id': self.usage_id
+        }
+
+# Per-table data version counters, bumped in the same transaction as every write
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)  # Table name
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version
+        }
+
+# Response payloads precomputed by scheduled jobs, shared by all worker processes
+class PrecomputedPayload(db.Model):
+    __tablename__ = 'precomputed_payloads'
+    
+    key = db.Column(db.String(255), primary_key=True)  # Response cache key as JSON
+    version = db.Column(db.String(100), nullable=False)  # Data version the payload was computed at
+    payload = db.Column(db.Text, nullable=False)  # Response payload as JSON
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'version': self.version,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+# Last run of each scheduled background job, written by the scheduler leader
+class ScheduledJobStatus(db.Model):
+    __tablename__ = 'scheduled_jobs'
+    
+    name = db.Column(db.String(100), primary_key=True)  # Job name
+    interval_seconds = db.Column(db.Float, nullable=False)
+    run_count = db.Column(db.Integer, nullable=False, default=0)  # Runs by the current leader
+    failure_count = db.Column(db.Integer, nullable=False, default=0)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Float, nullable=True)
+    avg_duration_ms = db.Column(db.Float, nullable=True)
+    max_duration_ms = db.Column(db.Float, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)  # 'success' or 'failed'
+    last_error = db.Column(db.Text, nullable=True)
+    leader_pid = db.Column(db.Integer, nullable=True)  # Process that ran the job
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'interval_seconds': self.interval_seconds,
+            'run_count': self.run_count,
+            'failure_count': self.failure_count,
+            'last_started_at': self.last_started_at.isoformat() if self.last_started_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'avg_duration_ms': self.avg_duration_ms,
+            'max_duration_ms': self.max_duration_ms,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'leader_pid': self.leader_pid
+        }
+
+# Background import jobs, claimed from this table by the import workers of any process
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'usage' or 'storage'
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, succeeded, failed, cancelled
+    filename = db.Column(db.String(255), nullable=False)  # Uploaded file name
+    file_path = db.Column(db.String(500), nullable=True)  # Saved upload, cleared once the job finishes
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    rows_read = db.Column(db.Integer, nullable=False, default=0)  # Data rows read so far
+    valid_count = db.Column(db.Integer, nullable=False, default=0)
+    imported_count = db.Column(db.Integer, nullable=False, default=0)  # Records / storage items created
+    updated_count = db.Column(db.Integer, nullable=False, default=0)  # Storage items renamed
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)  # Result summary or failure reason
+    worker_pid = db.Column(db.Integer, nullable=True)  # Process running the job
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Last progress update of a running job
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'filename': self.filename,
+            'cancel_requested': self.cancel_requested,
+            'rows_read': self.rows_read,
+            'valid_count': self.valid_count,
+            'imported_count': self.imported_count,
+            'updated_count': self.updated_count,
+            'error_count': self.error_count,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+# Uploaded files already imported, by content hash, so a repeated upload is not parsed again
+class ImportedFile(db.Model):
+    __tablename__ = 'imported_files'
+    __table_args__ = (db.Index('ix_imported_files_kind_sha256', 'kind', 'sha256', unique=True),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'usage'
+    sha256 = db.Column(db.String(64), nullable=False)  # Hex digest of the file content
+    filename = db.Column(db.String(255), nullable=False)  # Name of the first upload
+    row_count = db.Column(db.Integer, nullable=False, default=0)  # Valid records read
+    imported_count = db.Column(db.Integer, nullable=False, default=0)  # Records inserted
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)  # Records already present
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    job_id = db.Column(db.Integer, nullable=True)  # Background import job, if any (jobs expire)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'sha256': self.sha256,
+            'filename': self.filename,
+            'row_count': self.row_count,
+            'imported_count': self.imported_count,
+            'skipped_count': self.skipped_count,
+            'error_count': self.error_count,
+            'job_id': self.job_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# Row errors of an import job, in the order they were found
+class ImportJobError(db.Model):
+    __tablename__ = 'import_job_errors'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('import_jobs.id', ondelete='CASCADE'), nullable=False, index=True)
+    message = db.Column(db.Text, nullable=False)
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'message': self.message
+        }
+
+@event.listens_for(Storage, 'before_insert')
+@event.listens_for(Storage, 'before_update')
+def _sync_storage_quantity_fields(mapper, connection, target):
+    """Keep persisted quantity fields in step with ORM writes"""
+    target.sync_quantity_fields()
+
+@event.listens_for(Storage, 'before_insert')
+def _default_storage_last_used(mapper, connection, target):
+    """A new item counts as last used on its creation date"""
+    if target.创建时间 is None:
+        target.创建时间 = datetime.utcnow()
+    if target.last_used_at is None:
+        target.last_used_at = target.created_on()
+
+@event.listens_for(UsageRecord, 'before_insert')
+@event.listens_for(UsageRecord, 'before_update')
+def _sync_usage_base_quantity(mapper, connection, target):
+    """Keep the persisted base-unit quantity in step with ORM writes"""
+    target.sync_base_quantity()
 
 # Storage table indexes
+Index('idx_storage_stock_ratio', Storage.stock_ratio)
+Index('idx_storage_last_used_at', Storage.last_used_at)
 Index('idx_storage_类型', Storage.类型)
 Index('idx_storage_产品名', Storage.产品名)
 Index('idx_storage_CAS号', Storage.CAS号)
 
 # Updated usage records indexes with Chinese fields
 Index('idx_usage_records_使用人_使用日期', UsageRecord.使用人, UsageRecord.使用日期)
-Index('idx_usage_records_产品名_使用日期', UsageRecord.产品名, UsageRecord.使用日期) 
\ No newline at end of file
+Index('idx_usage_records_产品名_使用日期', UsageRecord.产品名, UsageRecord.使用日期)
+
+# Usage rollup indexes
+Index('idx_usage_daily_rollup_storage_id_day', UsageDailyRollup.storage_id, UsageDailyRollup.day)
+Index('idx_usage_daily_rollup_使用人_day', UsageDailyRollup.使用人, UsageDailyRollup.day)
@@ -14,6 +14,7 @@ from .inventory import inventory_bp
 from .analytics import analytics_bp
 from .import_export import import_export_bp
 from .auth import auth_bp
+from .admin import admin_bp
 
 # List of all blueprints for easy registration
 ALL_BLUEPRINTS = [
@@ -22,7 +23,8 @@ ALL_BLUEPRINTS = [
     inventory_bp,
     analytics_bp,
     import_export_bp,
-    auth_bp
+    auth_bp,
+    admin_bp
 ]
 
 def register_blueprints(app):
@@ -37,6 +39,7 @@ __all__ = [
     'analytics_bp',
     'import_export_bp',
     'auth_bp',
+    'admin_bp',
     'ALL_BLUEPRINTS',
     'register_blueprints'
 ] 
\ No newline at end of file
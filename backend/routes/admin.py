@@ -0,0 +1,50 @@
+from flask import Blueprint, jsonify, current_app
+from flask_login import login_required, current_user
+import os
+import logging
+
+from models import ScheduledJobStatus
+from core.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.route('/api/admin/jobs', methods=['GET'])
+@login_required
+def get_scheduled_jobs():
+    """Get background job status and timing metrics (admin only).
+
+    Metrics are read from the database, where the scheduler leader records
+    every run, so any worker can answer.
+    """
+    try:
+        # Check if current user is admin (first user is considered admin)
+        if current_user.id != 1:
+            return jsonify({'error': '权限不足'}), 403
+        
+        statuses = {status.name: status.to_dict() for status in ScheduledJobStatus.query.all()}
+        jobs = []
+        for job in scheduler.jobs.values():
+            job_data = statuses.pop(job.name, {'name': job.name, 'run_count': 0})
+            job_data['description'] = job.description
+            job_data['interval_seconds'] = job.interval
+            if scheduler.is_leader:
+                job_data['running'] = job.running
+            jobs.append(job_data)
+        # Jobs recorded by a leader whose registrations this worker does not have
+        jobs.extend(statuses.values())
+        
+        return jsonify({
+            'scheduler': {
+                'enabled': current_app.config.get('SCHEDULER_ENABLED', False),
+                'running': scheduler.running,
+                'leader': scheduler.is_leader,
+                'pid': os.getpid()
+            },
+            'jobs': sorted(jobs, key=lambda j: j['name'])
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting scheduled jobs: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
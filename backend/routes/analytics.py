@@ -1,251 +1,369 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func, desc
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import func, desc, select, union_all, literal, null, case, Integer, String
 from datetime import datetime, date, timedelta
 import logging
 
-from models import db, UsageRecord
+from models import db, Storage, UsageRecord, UsageDailyRollup
+from core.response_cache import cached_payload, precompute
+from services.columnar_usage import ColumnarAnalytics
+from services.usage_sketches import UsageSketchService
+from utils.time_buckets import time_bucket, format_bucket, normalize_period
+from utils.units import BASE_UNITS
 
 logger = logging.getLogger(__name__)
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Default dashboard view kept warm by the scheduler (see services/scheduled_jobs.py)
+precompute('dashboards', ('analytics.dashboard', 30, False, False), lambda: _dashboard_payload(30))
+
 @analytics_bp.route('/api/analytics/dashboard', methods=['GET'])
 def get_dashboard_stats():
-    """Get dashboard statistics (storage-integrated only)"""
+    """Get dashboard statistics (storage-integrated only, cached until the next write).
+
+    With approx=true the top product / personnel lists, and with
+    approx_distinct=true the distinct personnel / product counts, come from
+    the per-day sketches instead of aggregating the usage rows.
+    """
     try:
         days = request.args.get('days', 30, type=int)
-        end_date = date.today()
-        start_date = end_date - timedelta(days=days)
+        approx = request.args.get('approx', 'false').lower() == 'true'
+        approx_distinct = request.args.get('approx_distinct', 'false').lower() == 'true'
+        stats = cached_payload(
+            ('analytics.dashboard', days, approx, approx_distinct),
+            lambda: _dashboard_payload(days, approx, approx_distinct)
+        )
+        return jsonify(stats), 200
+    except Exception as e:
+        logger.error(f"Error getting dashboard stats: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
 
-        # 只统计 storage-integrated 记录
-        base_query = UsageRecord.query.filter(UsageRecord.storage_id.isnot(None))
+def _dashboard_payload(days, approx=False, approx_distinct=False):
+    if approx or approx_distinct:
+        return _compute_dashboard_stats_approx(days, approx_top=approx, approx_distinct=approx_distinct)
+    if _use_columnar():
+        return ColumnarAnalytics.dashboard_stats(days)
+    return _compute_dashboard_stats(days)
 
-        total_records = base_query.count()
-        recent_records = base_query.filter(UsageRecord.使用日期 >= start_date).count()
-        unique_personnel = db.session.query(func.count(func.distinct(UsageRecord.使用人))).filter(UsageRecord.storage_id.isnot(None)).scalar()
-        unique_products = db.session.query(func.count(func.distinct(UsageRecord.产品名))).filter(UsageRecord.storage_id.isnot(None)).scalar()
+def _compute_dashboard_stats(days, top_n=5, include_top=True, include_distinct=True):
+    """Aggregate dashboard statistics from the daily rollup in a single query.
 
-        # Most used products
-        top_products = db.session.query(
-            UsageRecord.产品名,
-            func.count(UsageRecord.id).label('usage_count')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.产品名).order_by(desc('usage_count')).limit(5).all()
+    One CTE joins the rollup to storage once (products are counted by the
+    产品名 recorded on the usage records); totals use conditional
+    aggregation, the top-N lists use ROW_NUMBER() over per-key sums, and all
+    sections come back as (section, key, value, rank, distinct counts) rows of
+    one UNION ALL.
+    """
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
 
-        # Most active personnel
-        top_personnel = db.session.query(
-            UsageRecord.使用人,
-            func.count(UsageRecord.id).label('record_count')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.使用人).order_by(desc('record_count')).limit(5).all()
+    # The rollup only holds storage-integrated records
+    base = select(
+        UsageDailyRollup.day.label('day'),
+        UsageDailyRollup.使用人.label('person'),
+        UsageDailyRollup.产品名.label('product'),
+        UsageDailyRollup.record_count.label('cnt')
+    ).select_from(UsageDailyRollup).join(
+        Storage, UsageDailyRollup.storage_id == Storage.id
+    ).cte('base')
 
-        # Daily usage trend
-        daily_usage = db.session.query(
-            UsageRecord.使用日期,
-            func.count(UsageRecord.id).label('count')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.使用日期).order_by(UsageRecord.使用日期).all()
+    recent = select(base).where(base.c.day >= start_date).cte('recent')
 
-        return jsonify({
-            'total_records': total_records,
-            'recent_records': recent_records,
-            'unique_personnel': unique_personnel,
-            'unique_products': unique_products,
-            'top_products': [
-                {'name': d.产品名, 'count': d.usage_count}
-                for d in top_products
-            ],
-            'top_personnel': [
-                {'name': p.使用人, 'count': p.record_count}
-                for p in top_personnel
-            ],
-            'daily_usage': [
-                {'date': str(du.使用日期), 'count': du.count}
-                for du in daily_usage
+    def ranked(column, name):
+        total = func.sum(recent.c.cnt)
+        return select(
+            column.label('key'),
+            total.label('total'),
+            func.row_number().over(order_by=(total.desc(), column)).label('rn')
+        ).group_by(column).cte(name)
+
+    products = ranked(recent.c.product, 'product_ranked')
+    personnel = ranked(recent.c.person, 'person_ranked')
+
+    empty_int = null().cast(Integer)
+    sections = [
+        select(
+            literal('totals').label('section'),
+            null().cast(String).label('key'),
+            func.coalesce(func.sum(base.c.cnt), 0).label('value'),
+            func.coalesce(func.sum(case((base.c.day >= start_date, base.c.cnt), else_=0)), 0).label('rank'),
+            func.count(func.distinct(base.c.person)).label('distinct_personnel')
+            if include_distinct else empty_int.label('distinct_personnel'),
+            func.count(func.distinct(base.c.product)).label('distinct_products')
+            if include_distinct else empty_int.label('distinct_products')
+        ),
+        select(
+            literal('day'), recent.c.day.cast(String), func.sum(recent.c.cnt), empty_int, empty_int, empty_int
+        ).group_by(recent.c.day)
+    ]
+    if include_top:
+        sections += [
+            select(
+                literal('product'), products.c.key, products.c.total, products.c.rn, empty_int, empty_int
+            ).where(products.c.rn <= top_n),
+            select(
+                literal('person'), personnel.c.key, personnel.c.total, personnel.c.rn, empty_int, empty_int
+            ).where(personnel.c.rn <= top_n)
+        ]
+    statement = union_all(*sections)
+
+    stats = {
+        'total_records': 0,
+        'recent_records': 0,
+        'unique_personnel': 0,
+        'unique_products': 0,
+        'top_products': [],
+        'top_personnel': [],
+        'daily_usage': []
+    }
+    top = {'product': [], 'person': []}
+
+    for section, key, value, rank, distinct_personnel, distinct_products in db.session.execute(statement):
+        if section == 'totals':
+            stats['total_records'] = int(value or 0)
+            stats['recent_records'] = int(rank or 0)
+            stats['unique_personnel'] = int(distinct_personnel or 0)
+            stats['unique_products'] = int(distinct_products or 0)
+        elif section == 'day':
+            stats['daily_usage'].append({'date': str(key), 'count': int(value)})
+        else:
+            top[section].append((rank, {'name': key, 'count': int(value)}))
+
+    stats['top_products'] = [item for _, item in sorted(top['product'], key=lambda x: x[0])]
+    stats['top_personnel'] = [item for _, item in sorted(top['person'], key=lambda x: x[0])]
+    stats['daily_usage'].sort(key=lambda x: x['date'])
+    return stats
+
+def _compute_dashboard_stats_approx(days, top_n=5, approx_top=True, approx_distinct=False):
+    """Dashboard statistics with sketch-based top lists and/or distinct counts.
+
+    Each top entry's count may overestimate the exact count by at most its
+    max_error; top_*_max_error bounds the count of any name not listed.
+    Distinct counts are HyperLogLog estimates (a few percent error).
+    """
+    stats = _compute_dashboard_stats(days, top_n, include_top=not approx_top, include_distinct=not approx_distinct)
+    start_date = date.today() - timedelta(days=days)
+
+    if approx_top:
+        for field, dimension in (('top_products', 'product'), ('top_personnel', 'person')):
+            top = UsageSketchService.top(dimension, start_date, top_n)
+            stats[field] = [
+                {'name': key, 'count': int(count), 'max_error': int(error)}
+                for key, count, error, _ in top['items']
             ]
-        }), 200
-    except Exception as e:
-        logger.error(f"Error getting dashboard stats: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+            stats[f'{field}_max_error'] = int(top['max_error'])
+
+    if approx_distinct:
+        stats['unique_personnel'] = UsageSketchService.distinct('person')
+        stats['unique_products'] = UsageSketchService.distinct('product')
+
+    stats['approximate'] = True
+    return stats
 
 @analytics_bp.route('/api/analytics/personnel', methods=['GET'])
 def get_personnel_stats():
     """Get personnel usage statistics (storage-integrated only)"""
     try:
         days = request.args.get('days', 30, type=int)
-        end_date = date.today()
-        start_date = end_date - timedelta(days=days)
-
-        personnel_stats = db.session.query(
-            UsageRecord.使用人,
-            func.count(UsageRecord.id).label('total_records'),
-            func.count(func.distinct(UsageRecord.产品名)).label('unique_products'),
-            func.min(UsageRecord.使用日期).label('first_usage'),
-            func.max(UsageRecord.使用日期).label('last_usage')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.使用人).order_by(desc('total_records')).all()
-
-        # Personnel activity by month
-        monthly_activity = db.session.query(
-            UsageRecord.使用人,
-            func.strftime('%Y-%m', UsageRecord.使用日期).label('month'),
-            func.count(UsageRecord.id).label('count')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(
-            UsageRecord.使用人,
-            func.strftime('%Y-%m', UsageRecord.使用日期)
-        ).order_by(
-            UsageRecord.使用人,
-            func.strftime('%Y-%m', UsageRecord.使用日期)
-        ).all()
-
-        return jsonify({
-            'personnel_stats': [
-                {
-                    'name': ps.使用人,
-                    'total_records': ps.total_records,
-                    'unique_products': ps.unique_products,
-                    'first_usage': str(ps.first_usage) if ps.first_usage else None,
-                    'last_usage': str(ps.last_usage) if ps.last_usage else None
-                }
-                for ps in personnel_stats
-            ],
-            'monthly_activity': [
-                {
-                    'personnel': ma.使用人,
-                    'month': str(ma.month),
-                    'count': ma.count
-                }
-                for ma in monthly_activity
-            ]
-        }), 200
+        if _use_columnar():
+            return jsonify(ColumnarAnalytics.personnel_stats(days)), 200
+        return jsonify(_compute_personnel_stats(days)), 200
     except Exception as e:
         logger.error(f"Error getting personnel stats: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def _compute_personnel_stats(days):
+    """Per-person totals and monthly activity from the daily rollup"""
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+
+    personnel_stats = db.session.query(
+        UsageDailyRollup.使用人,
+        func.sum(UsageDailyRollup.record_count).label('total_records'),
+        func.count(func.distinct(UsageDailyRollup.产品名)).label('unique_products'),
+        func.min(UsageDailyRollup.day).label('first_usage'),
+        func.max(UsageDailyRollup.day).label('last_usage')
+    ).join(
+        Storage, UsageDailyRollup.storage_id == Storage.id
+    ).filter(
+        UsageDailyRollup.day >= start_date
+    ).group_by(UsageDailyRollup.使用人).order_by(desc('total_records'), UsageDailyRollup.使用人).all()
+
+    # Personnel activity by month
+    month_bucket = time_bucket('month', UsageDailyRollup.day)
+    monthly_activity = db.session.query(
+        UsageDailyRollup.使用人,
+        month_bucket.label('month'),
+        func.sum(UsageDailyRollup.record_count).label('count')
+    ).filter(
+        UsageDailyRollup.day >= start_date
+    ).group_by(
+        UsageDailyRollup.使用人,
+        month_bucket
+    ).order_by(
+        UsageDailyRollup.使用人,
+        month_bucket
+    ).all()
+
+    return {
+        'personnel_stats': [
+            {
+                'name': ps.使用人,
+                'total_records': int(ps.total_records),
+                'unique_products': ps.unique_products,
+                'first_usage': str(ps.first_usage) if ps.first_usage else None,
+                'last_usage': str(ps.last_usage) if ps.last_usage else None
+            }
+            for ps in personnel_stats
+        ],
+        'monthly_activity': [
+            {
+                'personnel': ma.使用人,
+                'month': format_bucket(ma.month, 'month'),
+                'count': int(ma.count)
+            }
+            for ma in monthly_activity
+        ]
+    }
+
 @analytics_bp.route('/api/analytics/products', methods=['GET'])
 def get_product_stats():
     """Get product usage statistics (storage-integrated only)"""
     try:
         days = request.args.get('days', 30, type=int)
-        end_date = date.today()
-        start_date = end_date - timedelta(days=days)
-
-        product_stats = db.session.query(
-            UsageRecord.产品名,
-            UsageRecord.类型,
-            func.count(UsageRecord.id).label('total_usage'),
-            func.count(func.distinct(UsageRecord.使用人)).label('unique_users'),
-            func.min(UsageRecord.使用日期).label('first_usage'),
-            func.max(UsageRecord.使用日期).label('last_usage'),
-            func.avg(UsageRecord.使用量).label('avg_usage')
-        ).filter(
-            UsageRecord.storage_id.isnot(None),
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.产品名, UsageRecord.类型).order_by(desc('total_usage')).all()
-
-        return jsonify({
-            'product_stats': [
-                {
-                    'name': d.产品名,
-                    'type': d.类型,
-                    'total_usage': d.total_usage,
-                    'unique_users': d.unique_users,
-                    'first_usage': str(d.first_usage) if d.first_usage else None,
-                    'last_usage': str(d.last_usage) if d.last_usage else None,
-                    'avg_usage': float(d.avg_usage) if d.avg_usage else 0
-                }
-                for d in product_stats
-            ]
-        }), 200
+        if _use_columnar():
+            return jsonify(ColumnarAnalytics.product_stats(days)), 200
+        return jsonify(_compute_product_stats(days)), 200
     except Exception as e:
         logger.error(f"Error getting product stats: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def _compute_product_stats(days):
+    """Per-product totals from the daily rollup (average usage in the base unit of each dimension).
+
+    Rollup base quantities are in the item's current base_dimension, so grouping by it is safe.
+    """
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+
+    product_stats = db.session.query(
+        UsageDailyRollup.产品名,
+        UsageDailyRollup.类型,
+        Storage.base_dimension,
+        func.sum(UsageDailyRollup.record_count).label('total_usage'),
+        func.count(func.distinct(UsageDailyRollup.使用人)).label('unique_users'),
+        func.min(UsageDailyRollup.day).label('first_usage'),
+        func.max(UsageDailyRollup.day).label('last_usage'),
+        func.sum(UsageDailyRollup.total_base_quantity).label('usage_sum')
+    ).select_from(UsageDailyRollup).join(
+        Storage, UsageDailyRollup.storage_id == Storage.id
+    ).filter(
+        UsageDailyRollup.day >= start_date
+    ).group_by(UsageDailyRollup.产品名, UsageDailyRollup.类型, Storage.base_dimension).order_by(
+        desc('total_usage'), UsageDailyRollup.产品名, UsageDailyRollup.类型, func.coalesce(Storage.base_dimension, '')
+    ).all()
+
+    return {
+        'product_stats': [
+            {
+                'name': d.产品名,
+                'type': d.类型,
+                'total_usage': int(d.total_usage),
+                'unique_users': d.unique_users,
+                'first_usage': str(d.first_usage) if d.first_usage else None,
+                'last_usage': str(d.last_usage) if d.last_usage else None,
+                'dimension': d.base_dimension,
+                'avg_usage': float(d.usage_sum) / d.total_usage if d.usage_sum and d.total_usage else 0,
+                'avg_usage_unit': BASE_UNITS.get(d.base_dimension)
+            }
+            for d in product_stats
+        ]
+    }
+
 @analytics_bp.route('/api/analytics/trends', methods=['GET'])
 def get_usage_trends():
-    """Get usage trends over time (storage-integrated only)"""
+    """Get usage trends over time (storage-integrated only, approx_distinct=true: sketch-based distinct counts)"""
     try:
         period = request.args.get('period', 'daily')  # daily, weekly, monthly
         days = request.args.get('days', 30, type=int)
-        end_date = date.today()
-        start_date = end_date - timedelta(days=days)
-
-        if period == 'daily':
-            trends = db.session.query(
-                UsageRecord.使用日期,
-                func.count(UsageRecord.id).label('count'),
-                func.count(func.distinct(UsageRecord.使用人)).label('active_users'),
-                func.count(func.distinct(UsageRecord.产品名)).label('products_used')
-            ).filter(
-                UsageRecord.storage_id.isnot(None),
-                UsageRecord.使用日期 >= start_date
-            ).group_by(UsageRecord.使用日期).order_by(UsageRecord.使用日期).all()
-            result = [
-                {
-                    'date': str(t.使用日期),
-                    'count': t.count,
-                    'active_users': t.active_users,
-                    'products_used': t.products_used
-                }
-                for t in trends
-            ]
-        elif period == 'weekly':
-            trends = db.session.query(
-                func.strftime('%Y-%W', UsageRecord.使用日期).label('week'),
-                func.count(UsageRecord.id).label('count'),
-                func.count(func.distinct(UsageRecord.使用人)).label('active_users'),
-                func.count(func.distinct(UsageRecord.产品名)).label('products_used')
-            ).filter(
-                UsageRecord.storage_id.isnot(None),
-                UsageRecord.使用日期 >= start_date
-            ).group_by(func.strftime('%Y-%W', UsageRecord.使用日期)).order_by(func.strftime('%Y-%W', UsageRecord.使用日期)).all()
-            result = [
-                {
-                    'week': str(t.week),
-                    'count': t.count,
-                    'active_users': t.active_users,
-                    'products_used': t.products_used
-                }
-                for t in trends
-            ]
-        else:  # monthly
-            trends = db.session.query(
-                func.strftime('%Y-%m', UsageRecord.使用日期).label('month'),
-                func.count(UsageRecord.id).label('count'),
-                func.count(func.distinct(UsageRecord.使用人)).label('active_users'),
-                func.count(func.distinct(UsageRecord.产品名)).label('products_used')
-            ).filter(
-                UsageRecord.storage_id.isnot(None),
-                UsageRecord.使用日期 >= start_date
-            ).group_by(func.strftime('%Y-%m', UsageRecord.使用日期)).order_by(func.strftime('%Y-%m', UsageRecord.使用日期)).all()
-            result = [
-                {
-                    'month': str(t.month),
-                    'count': t.count,
-                    'active_users': t.active_users,
-                    'products_used': t.products_used
-                }
-                for t in trends
-            ]
-        return jsonify({
-            'period': period,
-            'trends': result
-        }), 200
+        if request.args.get('approx_distinct', 'false').lower() == 'true':
+            return jsonify(_compute_usage_trends_approx(period, days)), 200
+        if _use_columnar():
+            return jsonify(ColumnarAnalytics.usage_trends(period, days)), 200
+        return jsonify(_compute_usage_trends(period, days)), 200
     except Exception as e:
         logger.error(f"Error getting usage trends: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def _compute_usage_trends(period, days):
+    """Usage counts per day/week/month bucket from the daily rollup"""
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+
+    bucket_period = normalize_period(period)
+    bucket = time_bucket(bucket_period, UsageDailyRollup.day)
+    label = 'date' if bucket_period == 'day' else bucket_period
+
+    trends = db.session.query(
+        bucket.label('bucket'),
+        func.sum(UsageDailyRollup.record_count).label('count'),
+        func.count(func.distinct(UsageDailyRollup.使用人)).label('active_users'),
+        func.count(func.distinct(UsageDailyRollup.产品名)).label('products_used')
+    ).join(
+        Storage, UsageDailyRollup.storage_id == Storage.id
+    ).filter(
+        UsageDailyRollup.day >= start_date
+    ).group_by(bucket).order_by(bucket).all()
+
+    return {
+        'period': period,
+        'trends': [
+            {
+                label: format_bucket(t.bucket, bucket_period),
+                'count': int(t.count),
+                'active_users': t.active_users,
+                'products_used': t.products_used
+            }
+            for t in trends
+        ]
+    }
+
+def _compute_usage_trends_approx(period, days):
+    """Usage trends with active_users / products_used merged from the per-day HyperLogLog sketches"""
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+
+    bucket_period = normalize_period(period)
+    bucket = time_bucket(bucket_period, UsageDailyRollup.day)
+    label = 'date' if bucket_period == 'day' else bucket_period
+
+    # Record counts need no join or DISTINCT (the rollup only holds linked records)
+    counts = db.session.query(
+        bucket.label('bucket'),
+        func.sum(UsageDailyRollup.record_count).label('count')
+    ).filter(
+        UsageDailyRollup.day >= start_date
+    ).group_by(bucket).order_by(bucket).all()
+
+    active_users = UsageSketchService.distinct_by_bucket('person', bucket_period, start_date)
+    products_used = UsageSketchService.distinct_by_bucket('product', bucket_period, start_date)
+
+    trends = []
+    for row in counts:
+        bucket_date = row.bucket if isinstance(row.bucket, date) else date.fromisoformat(str(row.bucket)[:10])
+        trends.append({
+            label: format_bucket(bucket_date, bucket_period),
+            'count': int(row.count),
+            'active_users': active_users.get(bucket_date, 0),
+            'products_used': products_used.get(bucket_date, 0)
+        })
+
+    return {'period': period, 'trends': trends, 'approximate': True}
+
+def _use_columnar():
+    """Serve analytics from the in-process columnar usage cache instead of SQL"""
+    return current_app.config.get('ANALYTICS_COLUMNAR_CACHE', False)
+
 @analytics_bp.route('/api/analytics/autocomplete', methods=['GET'])
 def get_autocomplete_data():
     """Get autocomplete data for search fields (storage-integrated only)"""
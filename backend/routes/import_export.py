@@ -1,12 +1,17 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, current_app
 from werkzeug.utils import secure_filename
 import os
 import tempfile
 from datetime import datetime
 import logging
 
-from models import db, UsageRecord
+from models import db, UsageRecord, ImportJob, ImportJobError
 from services.excel_processor import ExcelProcessor
+from services.usage_import import UsageImportService
+from services.import_jobs import ImportJobService
+from services.import_files import ImportedFileService
+from utils.query_helpers import paginate
+from core.exports import export_path, discard_export, send_export
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -37,16 +42,22 @@ def preview_import():
         file.save(file_path)
         
         try:
-            # Process the file for preview
-            valid_records, errors = ExcelProcessor.import_excel(file_path)
+            # full=true: read, clean and validate the whole file
+            if request.args.get('full', 'false').lower() == 'true':
+                valid_records, errors = ExcelProcessor.import_excel(
+                    file_path, processes=current_app.config.get('IMPORT_SHEET_PROCESSES', 1)
+                )
+                return jsonify({
+                    'valid_records': valid_records[:10],  # Limit to first 10 for preview
+                    'total_valid': len(valid_records),
+                    'errors': errors,
+                    'total_errors': len(errors)
+                }), 200
             
-            # Return preview data
-            return jsonify({
-                'valid_records': valid_records[:10],  # Limit to first 10 for preview
-                'total_valid': len(valid_records),
-                'errors': errors,
-                'total_errors': len(errors)
-            }), 200
+            # Default: header and first rows only; the import validates the rest
+            nrows = request.args.get('rows', ExcelProcessor.PREVIEW_ROWS, type=int)
+            nrows = max(1, min(nrows, current_app.config.get('MAX_PER_PAGE', 500)))
+            return jsonify(ExcelProcessor.preview_file(file_path, nrows)), 200
             
         finally:
             # Clean up temporary file
@@ -61,8 +72,11 @@ def preview_import():
 
 @import_export_bp.route('/api/import', methods=['POST'])
 def import_excel():
-    """Import data from Excel/CSV file"""
+    """Import data from Excel/CSV file (read, validated and inserted chunk by chunk)"""
     try:
+        # Memory no longer grows with the file, so this path accepts larger uploads
+        request.max_content_length = current_app.config.get('STREAMING_IMPORT_MAX_CONTENT_LENGTH')
+
         # Check if file was uploaded
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -76,6 +90,21 @@ def import_excel():
         if not ExcelProcessor.allowed_file(file.filename, Config.ALLOWED_EXTENSIONS):
             return jsonify({'error': 'Invalid file type. Please upload Excel or CSV file.'}), 400
         
+        # The same bytes imported before: answer from the stored result (force=true imports again,
+        # which still skips the rows already stored)
+        sha256 = ImportedFileService.upload_digest(file)
+        if request.args.get('force', 'false').lower() != 'true':
+            imported_file = ImportedFileService.find('usage', sha256)
+            if imported_file is not None:
+                return jsonify(ImportedFileService.already_imported_response(imported_file)), 200
+        
+        # async=true: queue a background job and return at once (poll /api/import/jobs/<id>)
+        if request.args.get('async', 'false').lower() == 'true':
+            job = ImportJobService.enqueue('usage', file)
+            response = jsonify(job.to_dict())
+            response.headers['Location'] = f'/api/import/jobs/{job.id}'
+            return response, 202
+        
         # Save file temporarily
         filename = secure_filename(file.filename)
         temp_dir = tempfile.mkdtemp()
@@ -83,51 +112,34 @@ def import_excel():
         file.save(file_path)
         
         try:
-            # Process the file
-            valid_records, errors = ExcelProcessor.import_excel(file_path)
+            # Read, validate and insert one chunk at a time; each insert chunk is its own transaction
+            chunk_size = current_app.config.get('IMPORT_CHUNK_SIZE', 5000)
+
+            def log_progress(inserted, total):
+                logger.info(f"Imported {inserted}/{total} records from {filename}")
+
+            result = UsageImportService.import_chunks(
+                ExcelProcessor.iter_import_chunks(
+                    file_path, chunk_size, processes=current_app.config.get('IMPORT_SHEET_PROCESSES', 1)
+                ),
+                chunk_size=chunk_size,
+                progress=log_progress
+            )
             
-            if not valid_records:
+            if not result['total_records']:
                 return jsonify({
                     'error': 'No valid records found in file',
-                    'details': errors
+                    'details': result['errors']
                 }), 400
             
-            # Import records to database
-            imported_count = 0
-            import_errors = []
-            
-            for record_data in valid_records:
-                try:
-                    # Create usage record with current Chinese field names
-                    record = UsageRecord(
-                        类型=record_data.get('类型', ''),
-                        产品名=record_data.get('产品名', ''),
-                        数量及数量单位=record_data.get('数量及数量单位', ''),
-                        存放地=record_data.get('存放地', ''),
-                        CAS号=record_data.get('CAS号'),
-                        使用人=record_data.get('使用人', ''),
-                        使用日期=record_data.get('使用日期'),
-                        使用量=record_data.get('使用量', 0),
-                        余量=record_data.get('余量', 0),
-                        单位=record_data.get('单位', ''),
-                        备注=record_data.get('备注', '')
-                    )
-                    
-                    db.session.add(record)
-                    imported_count += 1
-                    
-                except Exception as e:
-                    import_errors.append(f"Error importing record: {str(e)}")
-            
-            # Commit all records
-            db.session.commit()
+            # Remember the file unless an insert batch failed (a retry must read it again)
+            if result['imported_count'] + result['skipped_count'] == result['total_records']:
+                ImportedFileService.remember(
+                    'usage', sha256, filename, result['total_records'], result['imported_count'],
+                    result['skipped_count'], len(result['errors'])
+                )
             
-            return jsonify({
-                'message': f'Successfully imported {imported_count} records',
-                'imported_count': imported_count,
-                'total_records': len(valid_records),
-                'errors': errors + import_errors
-            }), 200
+            return jsonify({'message': UsageImportService.summary(result), **result}), 200
             
         finally:
             # Clean up temporary file
@@ -140,6 +152,51 @@ def import_excel():
         logger.error(f"Error importing file: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@import_export_bp.route('/api/import/jobs/<int:job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """Get a background import job's status and counts, with a page of its row errors"""
+    try:
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            return jsonify({'error': 'Import job not found'}), 404
+        
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 50, type=int)
+        pagination = paginate(
+            ImportJobError.query.filter_by(job_id=job_id).order_by(ImportJobError.id),
+            page, per_page, current_app.config.get('MAX_PER_PAGE')
+        )
+        
+        job_data = job.to_dict()
+        job_data['errors'] = {
+            'items': [error.message for error in pagination.items],
+            'total': pagination.total,
+            'page': page,
+            'per_page': pagination.per_page,
+            'pages': pagination.pages
+        }
+        return jsonify(job_data), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting import job {job_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@import_export_bp.route('/api/import/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_import_job(job_id):
+    """Cancel a queued job, or stop a running one after its current chunk"""
+    try:
+        job = ImportJobService.cancel(job_id)
+        if job is None:
+            return jsonify({'error': 'Import job not found'}), 404
+        if job.status in ('succeeded', 'failed'):
+            return jsonify({'error': f'Import job already {job.status}'}), 409
+        
+        return jsonify(job.to_dict()), 202 if job.status == 'running' else 200
+        
+    except Exception as e:
+        logger.error(f"Error cancelling import job {job_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @import_export_bp.route('/api/export', methods=['GET'])
 def export_excel():
     """Export lab records (usage records) to Excel file.
@@ -186,34 +243,32 @@ def export_excel():
             if parsed_end:
                 query = query.filter(UsageRecord.使用日期 <= parsed_end)
 
-        # Get all records ordered by date desc
-        records = query.order_by(UsageRecord.使用日期.desc()).all()
-
-        if not records:
+        if query.with_entities(UsageRecord.id).first() is None:
             return jsonify({'error': 'No records found to export'}), 404
 
-        # Create temporary file
-        temp_dir = tempfile.mkdtemp()
+        # Stream only the exported columns, ordered by date desc
+        columns = [getattr(UsageRecord, name) for name in ExcelProcessor.EXPORT_COLUMNS]
+        records = query.with_entities(*columns).order_by(UsageRecord.使用日期.desc()).yield_per(
+            current_app.config.get('EXPORT_BATCH_SIZE', 2000)
+        )
+
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'lab_records_{timestamp}.xlsx'
-        file_path = os.path.join(temp_dir, filename)
+        file_path = export_path(filename)
 
         try:
             # Export to Excel using current field mapping
             success = ExcelProcessor.export_excel(records, file_path)
 
             if not success:
+                discard_export(file_path)
                 return jsonify({'error': 'Failed to create Excel file'}), 500
 
-            # Send file
-            return send_file(
-                file_path,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+            # Stream the file; its temp directory is removed once the response is closed
+            return send_export(file_path, filename)
 
         except Exception as e:
+            discard_export(file_path)
             logger.error(f"Error exporting file: {str(e)}")
             return jsonify({'error': 'Internal server error'}), 500
 
@@ -225,8 +280,8 @@ def export_excel():
 def download_template():
     """Download sample Excel template"""
     try:
-        # Create temporary file
-        temp_dir = tempfile.mkdtemp()
+        # Create temporary file (removed later by the prune-temp-exports job)
+        temp_dir = tempfile.mkdtemp(prefix=Config.EXPORT_TEMP_PREFIX)
         filename = 'lab_records_template.xlsx'
         file_path = os.path.join(temp_dir, filename)
         
@@ -1,20 +1,38 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func, desc, and_
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import func, desc, case, null
 from datetime import datetime, date, timedelta
 import logging
 
-from models import db, Storage, UsageRecord
+from models import db, Storage, UsageRecord, UsageDailyRollup, StorageUsageStats
 from services.storage_service import StorageService
+from services.forecast_service import ForecastService, DEFAULT_HISTORY_DAYS, DEFAULT_LEAD_TIME_DAYS
+from services.usage_sketches import UsageSketchService
+from core.response_cache import cached_payload, precompute
+from utils.time_buckets import time_bucket, format_bucket, normalize_period
+from utils.units import dimension_sums, dimension_totals, mass_in_grams, BASE_UNITS, MASS
 
 logger = logging.getLogger(__name__)
 
 inventory_bp = Blueprint('inventory', __name__)
 
+# Default views kept warm by the scheduler (see services/scheduled_jobs.py)
+precompute('alerts', ('inventory.alerts', 10.0, 90), lambda: StorageService.get_inventory_alerts(10.0, 90))
+precompute('dashboards', ('inventory.dashboard', 10.0), lambda: StorageService.get_inventory_dashboard_data(10.0))
+precompute(
+    'dashboards',
+    ('inventory.forecast', 30, DEFAULT_HISTORY_DAYS, DEFAULT_LEAD_TIME_DAYS),
+    lambda: ForecastService.forecast_catalogue(30, DEFAULT_HISTORY_DAYS, DEFAULT_LEAD_TIME_DAYS)
+)
+
 @inventory_bp.route('/api/inventory/dashboard', methods=['GET'])
 def get_inventory_dashboard():
-    """Get inventory dashboard statistics"""
+    """Get inventory dashboard statistics (cached until the next write)"""
     try:
-        dashboard_data = StorageService.get_inventory_dashboard_data()
+        threshold = request.args.get('threshold', 10.0, type=float)
+        dashboard_data = cached_payload(
+            ('inventory.dashboard', threshold),
+            lambda: StorageService.get_inventory_dashboard_data(threshold)
+        )
         return jsonify(dashboard_data), 200
         
     except Exception as e:
@@ -23,35 +41,14 @@ def get_inventory_dashboard():
 
 @inventory_bp.route('/api/inventory/alerts', methods=['GET'])
 def get_inventory_alerts():
-    """Get low stock and expiry alerts"""
+    """Get low stock and expiry alerts (cached until the next write)"""
     try:
         threshold = request.args.get('threshold', 10.0, type=float)
-        
-        # Get low stock items
-        low_stock_items = StorageService.get_low_stock_items(threshold)
-        
-        # Get items with no recent usage (potential expired items)
         days_threshold = request.args.get('days_threshold', 90, type=int)
-        cutoff_date = datetime.now().date() - timedelta(days=days_threshold)
-        
-        # Get storage items that haven't been used recently
-        unused_items = db.session.query(Storage).outerjoin(
-            UsageRecord, Storage.id == UsageRecord.storage_id
-        ).group_by(Storage.id).having(
-            func.max(UsageRecord.使用日期) < cutoff_date
-        ).all()
-        
-        alerts = {
-            'low_stock': {
-                'count': len(low_stock_items),
-                'items': [item.to_dict() for item in low_stock_items]
-            },
-            'unused_items': {
-                'count': len(unused_items),
-                'items': [item.to_dict() for item in unused_items]
-            }
-        }
-        
+        alerts = cached_payload(
+            ('inventory.alerts', threshold, days_threshold),
+            lambda: StorageService.get_inventory_alerts(threshold, days_threshold)
+        )
         return jsonify(alerts), 200
         
     except Exception as e:
@@ -60,55 +57,62 @@ def get_inventory_alerts():
 
 @inventory_bp.route('/api/inventory/usage-history/<int:storage_id>', methods=['GET'])
 def get_usage_history(storage_id):
-    """Get usage history for specific storage item"""
+    """Get usage history for specific storage item.
+
+    Statistics (and the pagination total) come from the storage_usage_stats row
+    maintained on write, so the page needs no COUNT/SUM/GROUP BY queries.
+    """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 20, type=int), 1)
         
         # Verify storage item exists
         storage_item = Storage.query.get_or_404(storage_id)
+        stats = db.session.get(StorageUsageStats, storage_id)
+        usage_count = stats.usage_count if stats else 0
+        total_usage = stats.total_usage if stats else 0
+        total_base = (stats.total_base_quantity or 0.0) if stats else 0.0
         
         # Get usage history
-        query = UsageRecord.query.filter_by(storage_id=storage_id).order_by(
+        usage_records = UsageRecord.query.filter_by(storage_id=storage_id).order_by(
             desc(UsageRecord.使用日期), desc(UsageRecord.创建时间)
-        )
-        
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        
-        # Calculate usage statistics
-        total_usage = db.session.query(
-            func.sum(UsageRecord.使用量)
-        ).filter_by(storage_id=storage_id).scalar() or 0
+        ).offset((page - 1) * per_page).limit(per_page).all()
         
-        usage_count = UsageRecord.query.filter_by(storage_id=storage_id).count()
+        pages = (usage_count + per_page - 1) // per_page
         
         # Average usage per record
         avg_usage = total_usage / usage_count if usage_count > 0 else 0
         
-        # Most frequent user
-        frequent_user = db.session.query(
-            UsageRecord.使用人, func.count(UsageRecord.id).label('count')
-        ).filter_by(storage_id=storage_id).group_by(
-            UsageRecord.使用人
-        ).order_by(desc('count')).first()
+        # Gram figures only exist for mass units; other dimensions report their base unit
+        dimension = storage_item.base_dimension
+        is_mass = dimension == MASS
         
         return jsonify({
             'storage_item': storage_item.to_dict(),
-            'usage_records': [record.to_dict() for record in pagination.items],
+            'usage_records': [record.to_dict() for record in usage_records],
             'pagination': {
-                'total': pagination.total,
+                'total': usage_count,
                 'page': page,
                 'per_page': per_page,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
+                'pages': pages,
+                'has_next': page < pages,
+                'has_prev': page > 1
             },
             'statistics': {
-                'total_usage_g': total_usage,
+                'unit': storage_item.单位,
+                'total_usage': total_usage,
+                'average_usage': round(avg_usage, 3),
+                'base_dimension': dimension,
+                'base_unit': BASE_UNITS.get(dimension),
+                'total_usage_base': total_base if dimension else None,
+                'total_usage_g': total_base / 1000.0 if is_mass else None,
                 'usage_count': usage_count,
-                'average_usage_g': round(avg_usage, 3),
-                'most_frequent_user': frequent_user[0] if frequent_user else None,
-                'current_stock_g': storage_item.当前库存量
+                'average_usage_g': round(total_base / 1000.0 / usage_count, 3) if is_mass and usage_count else (0 if is_mass else None),
+                'most_frequent_user': stats.top_user if stats else None,
+                'first_usage_date': stats.first_usage_date.isoformat() if stats and stats.first_usage_date else None,
+                'last_usage_date': stats.last_usage_date.isoformat() if stats and stats.last_usage_date else None,
+                'current_stock': storage_item.当前库存量,
+                'current_stock_g': storage_item.base_quantity / 1000.0 if is_mass and storage_item.base_quantity is not None else None
             }
         }), 200
         
@@ -118,62 +122,150 @@ def get_usage_history(storage_id):
 
 @inventory_bp.route('/api/inventory/turnover', methods=['GET'])
 def get_inventory_turnover():
-    """Get inventory turnover analysis"""
+    """Get inventory turnover analysis.
+
+    Period usage comes from one grouped LEFT JOIN against the daily rollup and the
+    turnover math is done in SQL, so sorting and paging happen in the database.
+    period_usage / avg_daily_usage are in the item's unit, period_usage_base in
+    the base unit of its base_dimension; the _g fields are set for mass items only.
+
+    Query params: days, sort (turnover|usage|depletion|stock|name), order (asc|desc),
+    limit (page size, default STORAGE_ITEMS_PER_PAGE, at most MAX_PER_PAGE), page.
+    """
     try:
         days = request.args.get('days', 30, type=int)
+        sort = request.args.get('sort', 'turnover')
+        order = request.args.get('order', 'asc' if sort in ('depletion', 'name') else 'desc')
+        limit = request.args.get('limit', current_app.config.get('STORAGE_ITEMS_PER_PAGE', 20), type=int)
+        limit = max(1, min(limit, current_app.config.get('MAX_PER_PAGE', 500)))
+        page = max(request.args.get('page', 1, type=int), 1)
         start_date = datetime.now().date() - timedelta(days=days)
         
-        # Get storage items with usage in the period
-        turnover_data = []
+        # Period usage per storage item
+        usage_subquery = db.session.query(
+            UsageDailyRollup.storage_id.label('storage_id'),
+            func.sum(UsageDailyRollup.total_usage).label('period_usage'),
+            func.sum(UsageDailyRollup.total_base_quantity).label('period_usage_base')
+        ).filter(
+            UsageDailyRollup.day >= start_date
+        ).group_by(UsageDailyRollup.storage_id).subquery()
         
-        storage_items = Storage.query.all()
+        period_usage = func.coalesce(usage_subquery.c.period_usage, 0.0)
         
-        for item in storage_items:
-            # Calculate usage in period
-            period_usage = db.session.query(
-                func.sum(UsageRecord.使用量)
-            ).filter(
-                and_(
-                    UsageRecord.storage_id == item.id,
-                    UsageRecord.使用日期 >= start_date
-                )
-            ).scalar() or 0
-            
-            # Calculate turnover rate (usage / current stock)
-            turnover_rate = 0
-            if item.当前库存量 > 0:
-                turnover_rate = period_usage / item.当前库存量
-            
-            # Estimated days until depletion
-            avg_daily_usage = period_usage / days if days > 0 else 0
-            days_until_depletion = None
-            if avg_daily_usage > 0:
-                days_until_depletion = item.当前库存量 / avg_daily_usage
-            
+        # Turnover rate (usage / current stock)
+        turnover_rate = case(
+            (Storage.当前库存量 > 0, period_usage / Storage.当前库存量),
+            else_=0.0
+        )
+        
+        # Estimated days until depletion (current stock / average daily usage)
+        days_until_depletion = case(
+            (period_usage > 0, Storage.当前库存量 * days / period_usage),
+            else_=None
+        ) if days > 0 else null()
+        
+        sort_columns = {
+            'turnover': turnover_rate,
+            'usage': period_usage,
+            'depletion': days_until_depletion,
+            'stock': Storage.当前库存量,
+            'name': Storage.产品名
+        }
+        sort_column = sort_columns.get(sort, turnover_rate)
+        sort_order = sort_column.desc() if order.lower() == 'desc' else sort_column.asc()
+        
+        query = db.session.query(
+            Storage,
+            period_usage.label('period_usage'),
+            func.coalesce(usage_subquery.c.period_usage_base, 0.0).label('period_usage_base'),
+            turnover_rate.label('turnover_rate'),
+            days_until_depletion.label('days_until_depletion')
+        ).outerjoin(
+            usage_subquery, usage_subquery.c.storage_id == Storage.id
+        ).order_by(
+            # Items without a depletion estimate always go last
+            days_until_depletion.is_(None) if sort == 'depletion' else sort_order,
+            sort_order,
+            Storage.id
+        )
+        
+        total = Storage.query.count()
+        rows = query.limit(limit).offset((page - 1) * limit).all()
+        
+        turnover_data = []
+        for item, usage, usage_base, rate, depletion in rows:
+            is_mass = item.base_dimension == MASS
             turnover_data.append({
                 'storage_item': item.to_dict(),
-                'period_usage_g': period_usage,
-                'turnover_rate': round(turnover_rate, 3),
-                'avg_daily_usage_g': round(avg_daily_usage, 3),
-                'days_until_depletion': round(days_until_depletion) if days_until_depletion else None
+                'unit': item.单位,
+                'period_usage': usage,
+                'avg_daily_usage': round(usage / days, 3) if days > 0 else 0,
+                'base_dimension': item.base_dimension,
+                'base_unit': BASE_UNITS.get(item.base_dimension),
+                'period_usage_base': usage_base if item.base_dimension else None,
+                'period_usage_g': usage_base / 1000.0 if is_mass else None,
+                'avg_daily_usage_g': (round(usage_base / 1000.0 / days, 3) if days > 0 else 0) if is_mass else None,
+                'turnover_rate': round(rate or 0, 3),
+                'days_until_depletion': round(depletion) if depletion else None
             })
         
-        # Sort by turnover rate (highest first)
-        turnover_data.sort(key=lambda x: x['turnover_rate'], reverse=True)
-        
         return jsonify({
             'period_days': days,
             'start_date': start_date.isoformat(),
-            'turnover_analysis': turnover_data
+            'turnover_analysis': turnover_data,
+            'pagination': {
+                'total': total,
+                'page': page,
+                'limit': limit,
+                'sort': sort if sort in sort_columns else 'turnover',
+                'order': order.lower()
+            }
         }), 200
         
     except Exception as e:
         logger.error(f"Error getting inventory turnover: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@inventory_bp.route('/api/inventory/forecast', methods=['GET'])
+def get_inventory_forecast():
+    """Get predicted stock-out dates and reorder suggestions for all storage items.
+
+    Query params: horizon (days, default 30), history_days (default 90),
+    lead_time (days, default 7), reorder_only (true|false).
+    The forecast is cached until the next Storage/UsageRecord write.
+    """
+    try:
+        horizon = min(max(request.args.get('horizon', 30, type=int), 1), 365)
+        history_days = min(max(request.args.get('history_days', DEFAULT_HISTORY_DAYS, type=int), 7), 730)
+        lead_time = min(max(request.args.get('lead_time', DEFAULT_LEAD_TIME_DAYS, type=int), 0), horizon)
+        reorder_only = request.args.get('reorder_only', 'false').lower() == 'true'
+        
+        result = cached_payload(
+            ('inventory.forecast', horizon, history_days, lead_time),
+            lambda: ForecastService.forecast_catalogue(horizon, history_days, lead_time)
+        )
+        
+        if reorder_only:
+            result = dict(result, forecasts=[f for f in result['forecasts'] if f['reorder_suggested']])
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting inventory forecast: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def _usage_totals(row):
+    """total_usage_g / total_usage_by_dimension fields of a row with dimension_sums() columns"""
+    totals = dimension_totals(row)
+    return {'total_usage_g': mass_in_grams(totals), 'total_usage_by_dimension': totals}
+
 @inventory_bp.route('/api/inventory/trends', methods=['GET'])
 def get_inventory_trends():
-    """Get inventory usage trends"""
+    """Get inventory usage trends (approx=true: top users / products from the per-day sketches).
+
+    total_usage_g covers mass units only; total_usage_by_dimension has the
+    totals of every dimension in its base unit.
+    """
     try:
         days = request.args.get('days', 30, type=int)
         period = request.args.get('period', 'daily')  # daily, weekly, monthly
@@ -181,57 +273,85 @@ def get_inventory_trends():
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=days)
         
-        # Build date grouping based on period
-        if period == 'daily':
-            date_format = func.date(UsageRecord.使用日期)
-            date_label = 'date'
-        elif period == 'weekly':
-            date_format = func.strftime('%Y-W%W', UsageRecord.使用日期)
-            date_label = 'week'
-        else:  # monthly
-            date_format = func.strftime('%Y-%m', UsageRecord.使用日期)
-            date_label = 'month'
+        # Build date grouping based on period (over the daily rollup)
+        bucket_period = normalize_period(period)
+        date_format = time_bucket(bucket_period, UsageDailyRollup.day)
+        date_label = 'date' if bucket_period == 'day' else bucket_period
+        label_format = '%Y-W%W' if bucket_period == 'week' else None
+        
+        # Usage totals in base units per dimension (mass in mg, volume in µL, counts); the rollup
+        # only holds base quantities in the item's current dimension, see UsageRollupService.rebuild_buckets
+        base_totals = dimension_sums(UsageDailyRollup.total_base_quantity, Storage.base_dimension)
         
         # Get usage trends
         usage_trends = db.session.query(
             date_format.label(date_label),
-            func.count(UsageRecord.id).label('usage_count'),
-            func.sum(UsageRecord.使用量).label('total_usage'),
-            func.count(func.distinct(UsageRecord.使用人)).label('unique_users')
+            func.sum(UsageDailyRollup.record_count).label('usage_count'),
+            func.count(func.distinct(UsageDailyRollup.使用人)).label('unique_users'),
+            *base_totals
+        ).select_from(UsageDailyRollup).join(
+            Storage, UsageDailyRollup.storage_id == Storage.id
         ).filter(
-            UsageRecord.使用日期 >= start_date
+            UsageDailyRollup.day >= start_date
         ).group_by(date_format).order_by(date_format).all()
         
         # Get type-wise usage
         type_trends = db.session.query(
-            UsageRecord.类型,
-            func.count(UsageRecord.id).label('usage_count'),
-            func.sum(UsageRecord.使用量).label('total_usage')
-        ).filter(
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.类型).all()
-        
-        # Get top users
-        top_users = db.session.query(
-            UsageRecord.使用人,
-            func.count(UsageRecord.id).label('usage_count'),
-            func.sum(UsageRecord.使用量).label('total_usage')
+            UsageDailyRollup.类型,
+            func.sum(UsageDailyRollup.record_count).label('usage_count'),
+            *base_totals
+        ).select_from(UsageDailyRollup).join(
+            Storage, UsageDailyRollup.storage_id == Storage.id
         ).filter(
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.使用人).order_by(
-            desc('usage_count')
-        ).limit(10).all()
+            UsageDailyRollup.day >= start_date
+        ).group_by(UsageDailyRollup.类型).all()
         
-        # Get top products
-        top_products = db.session.query(
-            UsageRecord.产品名,
-            func.count(UsageRecord.id).label('usage_count'),
-            func.sum(UsageRecord.使用量_g).label('total_usage_g')
-        ).filter(
-            UsageRecord.使用日期 >= start_date
-        ).group_by(UsageRecord.产品名).order_by(
-            desc('usage_count')
-        ).limit(10).all()
+        if request.args.get('approx', 'false').lower() == 'true':
+            # Merge the per-day sketches; total_usage_g is a lower bound (sketch weights are mass in mg)
+            top_users, top_products = [
+                [
+                    {
+                        field: key,
+                        'usage_count': int(count),
+                        'total_usage_g': float(weight) / 1000.0,
+                        'max_error': int(error)
+                    }
+                    for key, count, error, weight in UsageSketchService.top(dimension, start_date, 10)['items']
+                ]
+                for field, dimension in (('user', 'person'), ('product', 'product'))
+            ]
+        else:
+            # Get top users
+            top_users = [
+                dict(user=trend.使用人, usage_count=int(trend.usage_count), **_usage_totals(trend))
+                for trend in db.session.query(
+                    UsageDailyRollup.使用人,
+                    func.sum(UsageDailyRollup.record_count).label('usage_count'),
+                    *base_totals
+                ).select_from(UsageDailyRollup).join(
+                    Storage, UsageDailyRollup.storage_id == Storage.id
+                ).filter(
+                    UsageDailyRollup.day >= start_date
+                ).group_by(UsageDailyRollup.使用人).order_by(
+                    desc('usage_count')
+                ).limit(10).all()
+            ]
+            
+            # Get top products
+            top_products = [
+                dict(product=trend.产品名, usage_count=int(trend.usage_count), **_usage_totals(trend))
+                for trend in db.session.query(
+                    UsageDailyRollup.产品名,
+                    func.sum(UsageDailyRollup.record_count).label('usage_count'),
+                    *base_totals
+                ).select_from(UsageDailyRollup).join(
+                    Storage, UsageDailyRollup.storage_id == Storage.id
+                ).filter(
+                    UsageDailyRollup.day >= start_date
+                ).group_by(UsageDailyRollup.产品名).order_by(
+                    desc('usage_count')
+                ).limit(10).all()
+            ]
         
         return jsonify({
             'period': period,
@@ -239,37 +359,19 @@ def get_inventory_trends():
             'end_date': end_date.isoformat(),
             'usage_trends': [
                 {
-                    date_label: trend[0],
-                    'usage_count': trend[1],
-                    'total_usage_g': float(trend[2]) if trend[2] else 0,
-                    'unique_users': trend[3]
+                    date_label: format_bucket(trend[0], bucket_period, label_format),
+                    'usage_count': int(trend.usage_count),
+                    'unique_users': trend.unique_users,
+                    **_usage_totals(trend)
                 }
                 for trend in usage_trends
             ],
             'type_trends': [
-                {
-                    'type': trend[0],
-                    'usage_count': trend[1],
-                    'total_usage_g': float(trend[2]) if trend[2] else 0
-                }
+                dict(type=trend.类型, usage_count=int(trend.usage_count), **_usage_totals(trend))
                 for trend in type_trends
             ],
-            'top_users': [
-                {
-                    'user': trend[0],
-                    'usage_count': trend[1],
-                    'total_usage_g': float(trend[2]) if trend[2] else 0
-                }
-                for trend in top_users
-            ],
-            'top_products': [
-                {
-                    'product': trend[0],
-                    'usage_count': trend[1],
-                    'total_usage_g': float(trend[2]) if trend[2] else 0
-                }
-                for trend in top_products
-            ]
+            'top_users': top_users,
+            'top_products': top_products
         }), 200
         
     except Exception as e:
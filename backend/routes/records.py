@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import or_, asc, desc
 from datetime import datetime, date
 import logging
@@ -6,6 +6,7 @@ import logging
 from models import db, UsageRecord, Storage
 from services.storage_service import StorageService
 from utils.date_parser import DateParser
+from core.streaming import requested_format, stream_query
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +47,10 @@ def get_records():
         end_date = request.args.get('end_date', '')
         sort_by = request.args.get('sort_by', '使用日期')
         sort_order = request.args.get('sort_order', 'desc')
+        try:
+            fmt = requested_format(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         from utils.query_helpers import apply_search, apply_filters, apply_sort, paginate
         # Build base query - only storage-integrated records
@@ -72,9 +77,13 @@ def get_records():
         # Apply sorting via helper (fallback column inside helper is ignored if column missing)
         query = apply_sort(query, UsageRecord, sort_by, sort_order)
 
+        # format=ndjson|csv streams all matching records instead of a page
+        if fmt:
+            return stream_query(query, lambda record: record.to_dict(), fmt, 'records')
+
         # Pagination via helper
         try:
-            paginated = paginate(query, page, per_page)
+            paginated = paginate(query, page, per_page, current_app.config.get('MAX_PER_PAGE'))
             
             # Get unique values for filter dropdowns
             personnel_list = db.session.query(UsageRecord.使用人).filter(
@@ -503,6 +512,7 @@ def get_records_by_personnel(personnel_name):
         paginated = query.paginate(
             page=page,
             per_page=per_page,
+            max_per_page=current_app.config.get('MAX_PER_PAGE'),
             error_out=False
         )
         
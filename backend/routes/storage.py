@@ -1,17 +1,25 @@
-from flask import Blueprint, request, jsonify, send_file
-from sqlalchemy import or_, desc, asc
+from flask import Blueprint, request, jsonify, send_file, current_app
+from sqlalchemy import and_, or_, desc, asc
 from datetime import datetime, date
 import os
 import logging
 
 from models import db, Storage, UsageRecord
 from services.storage_service import StorageService
+from services.usage_rollup import UsageRollupService
+from services.usage_stats import UsageStatsService
+from services.usage_sketches import UsageSketchService
 from services.storage_excel_processor import StorageExcelProcessor
+from services.import_jobs import ImportJobService
+from core.exports import export_path, discard_export, send_export
 
 logger = logging.getLogger(__name__)
 
 storage_bp = Blueprint('storage', __name__)
 
+# Remaining-stock ratio below which an item is reported as low stock
+LOW_STOCK_RATIO = 0.2
+
 @storage_bp.route('/api/storage', methods=['GET'])
 def get_storage_items():
     """Paginated storage list (delegates to core.list_endpoint)."""
@@ -269,6 +277,9 @@ def delete_storage_item(storage_id):
                     db.session.delete(record)
                 
                 # Delete the storage item
+                UsageRollupService.delete_for_storage(storage_id)
+                UsageStatsService.delete_for_storage(storage_id)
+                UsageSketchService.remove_records(usage_records)
                 db.session.delete(storage_item)
                 db.session.commit()
                 
@@ -418,13 +429,14 @@ def get_storage_by_type(storage_type):
         per_page = request.args.get('per_page', 20, type=int)
         
         query = Storage.query.filter(Storage.类型.ilike(f'%{storage_type}%'))
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = query.paginate(page=page, per_page=per_page, max_per_page=current_app.config.get('MAX_PER_PAGE'),
+                                    error_out=False)
         
         return jsonify({
             'items': [item.to_dict() for item in pagination.items],
             'total': pagination.total,
             'page': page,
-            'per_page': per_page,
+            'per_page': pagination.per_page,
             'pages': pagination.pages
         }), 200
         
@@ -440,13 +452,14 @@ def get_storage_by_location(location):
         per_page = request.args.get('per_page', 20, type=int)
         
         query = Storage.query.filter(Storage.存放地.ilike(f'%{location}%'))
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = query.paginate(page=page, per_page=per_page, max_per_page=current_app.config.get('MAX_PER_PAGE'),
+                                    error_out=False)
         
         return jsonify({
             'items': [item.to_dict() for item in pagination.items],
             'total': pagination.total,
             'page': page,
-            'per_page': per_page,
+            'per_page': pagination.per_page,
             'pages': pagination.pages
         }), 200
         
@@ -534,6 +547,13 @@ def import_storage_excel():
                 file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
             return jsonify({'error': 'Invalid file format. Only Excel files allowed.'}), 400
         
+        # async=true: queue a background job and return at once (poll /api/import/jobs/<id>)
+        if request.args.get('async', 'false').lower() == 'true':
+            job = ImportJobService.enqueue('storage', file)
+            response = jsonify(job.to_dict())
+            response.headers['Location'] = f'/api/import/jobs/{job.id}'
+            return response, 202
+        
         # Save uploaded file temporarily
         filename = f"storage_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         file_path = os.path.join('uploads', filename)
@@ -543,7 +563,9 @@ def import_storage_excel():
         
         try:
             # Import data
-            result = StorageExcelProcessor.import_storage_excel(file_path)
+            result = StorageExcelProcessor.import_storage_excel(
+                file_path, processes=current_app.config.get('IMPORT_SHEET_PROCESSES', 1)
+            )
             
             return jsonify(result), 200 if result['success'] else 400
             
@@ -573,21 +595,23 @@ def export_storage_excel():
         if location_filter:
             query = query.filter(Storage.存放地.ilike(f'%{location_filter}%'))
         
-        storage_items = query.all()
+        # Stream only the exported columns in batches
+        columns = [getattr(Storage, name) for name in StorageExcelProcessor.EXPORT_FIELDS]
+        storage_items = query.with_entities(*columns).order_by(Storage.id).yield_per(
+            current_app.config.get('EXPORT_BATCH_SIZE', 2000)
+        )
         
-        # Create export file
+        # Create export file in a temp directory removed after the download
         filename = f"storage_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        file_path = os.path.join('uploads', filename)
+        file_path = export_path(filename)
         
-        os.makedirs('uploads', exist_ok=True)
-        StorageExcelProcessor.export_storage_excel(storage_items, file_path)
+        try:
+            StorageExcelProcessor.export_storage_excel(storage_items, file_path)
+        except Exception:
+            discard_export(file_path)
+            raise
         
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return send_export(file_path, filename)
         
     except Exception as e:
         logger.error(f"Error exporting storage Excel: {str(e)}")
@@ -636,48 +660,42 @@ def search_available_storage():
                 )
             )
 
+        # Exclude low stock items in SQL (uses the persisted stock ratio) unless requested;
+        # items without a parseable initial quantity have no ratio and pass while in stock
+        if not include_low_stock:
+            query = query.filter(
+                or_(
+                    Storage.stock_ratio >= LOW_STOCK_RATIO,
+                    and_(Storage.initial_quantity.is_(None), Storage.当前库存量 > 0)
+                )
+            )
+
         # Limit results for quick selector
         items = query.order_by(Storage.产品名.asc()).limit(limit).all()
 
         def compute_availability(item):
-            """Return availability_status based on percentage remaining"""
-            try:
-                total_qty, unit = StorageService.parse_quantity(item.数量及数量单位)
-
-                # Since 当前库存量 is stored in the original unit, compare directly
-                if total_qty == 0:
-                    return 'unknown'
-
-                # Only compare if units match
-                if unit != item.单位:
-                    return 'unknown'
-                current_qty = item.当前库存量
-
-                ratio = current_qty / total_qty
-            except Exception:
-                # Fallback if parsing fails
-                ratio = None
-
-            if ratio is None:
+            """Return availability_status based on the persisted stock ratio"""
+            if item.initial_quantity is None:
+                # Unparseable quantity format
                 return 'available' if item.当前库存量 > 0 else 'out_of_stock'
-            if ratio == 0:
+            if item.stock_ratio is None:
+                # Zero initial quantity or mismatched units
+                return 'unknown'
+            if item.stock_ratio == 0:
                 return 'out_of_stock'
-            elif ratio < 0.2:
+            elif item.stock_ratio < LOW_STOCK_RATIO:
                 return 'low_stock'
             else:
                 return 'available'
 
-        results = []
-        for item in items:
-            availability_status = compute_availability(item)
-            # Optionally exclude low stock items if not requested
-            if not include_low_stock and availability_status != 'available':
-                continue
-            results.append({
-                'availability_status': availability_status,
+        results = [
+            {
+                'availability_status': compute_availability(item),
                 'match_score': 1.0,
                 **item.to_dict()
-            })
+            }
+            for item in items
+        ]
 
         return jsonify({'results': results, 'total_count': len(results)})
     except Exception as e:
@@ -14,6 +14,8 @@ from pathlib import Path
 from app import create_app, db
 from models import User, Personnel
 from flask_bcrypt import Bcrypt
+from services.scheduled_jobs import start_scheduler
+from services.import_jobs import start_import_workers
 
 def ensure_directories():
     """Ensure required directories exist"""
@@ -29,6 +31,19 @@ def ensure_directories():
         print(f"✅ Directory ensured: {directory}")
 
 
+def backfill_derived_tables():
+    """Upgrade an existing database schema and populate derived data added since it was created"""
+    from services.schema_migrations import upgrade_schema, empty_derived_tables, run_backfill
+    
+    backfills = upgrade_schema()
+    backfills += [name for name in empty_derived_tables() if name not in backfills]
+    
+    for name in backfills:
+        print(f"📊 Running backfill: {name}...")
+        row_count = run_backfill(name)
+        print(f"✅ Backfill {name} completed ({row_count} rows)")
+
+
 def initialize_database(app):
     """Initialize database tables and create admin user if needed"""
     with app.app_context():
@@ -36,6 +51,7 @@ def initialize_database(app):
             print("📦 Creating database tables...")
             db.create_all()
             print("✅ Database tables created successfully")
+            backfill_derived_tables()
             
             # Check if admin user exists, create if not
             admin_user = User.query.filter_by(username='admin').first()
@@ -86,6 +102,13 @@ def main():
     # Initialize database
     initialize_database(app)
     
+    # With the reloader, this process only watches files and restarts a serving
+    # child (WERKZEUG_RUN_MAIN=true); background threads belong in the child
+    use_reloader = True
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler(app)
+        start_import_workers(app)
+    
     # Start development server
     print("\n" + "="*50)
     print("🌐 Starting development server...")
@@ -99,7 +122,7 @@ def main():
             debug=True, 
             host='0.0.0.0', 
             port=5000,
-            use_reloader=True,
+            use_reloader=use_reloader,
             threaded=True
         )
     except KeyboardInterrupt:
@@ -117,6 +140,7 @@ with app.app_context():
         print("📦 Creating database tables...")
         db.create_all()
         print("✅ Database tables created successfully")
+        backfill_derived_tables()
         
         # Check if admin user exists, create if not
         admin_user = User.query.filter_by(username='admin').first()
@@ -9,6 +9,9 @@ file operations, and other complex operations separated from route handlers.
 from .excel_processor import ExcelProcessor
 from .storage_excel_processor import StorageExcelProcessor
 from .storage_service import StorageService
+from .data_version import DataVersionService
+from .usage_change_log import UsageChangeLog
+from .forecast_service import ForecastService
 
 # Service instances for dependency injection
 excel_processor = ExcelProcessor()
@@ -19,6 +22,9 @@ __all__ = [
     'ExcelProcessor',
     'StorageExcelProcessor', 
     'StorageService',
+    'DataVersionService',
+    'UsageChangeLog',
+    'ForecastService',
     'excel_processor',
     'storage_excel_processor',
     'storage_service'
@@ -0,0 +1,519 @@
+"""
+In-process columnar snapshot of storage-linked usage records for analytics
+
+Each worker keeps the analytics columns of usage_records as NumPy arrays:
+
+* day      int32   使用日期 as days since 1970-01-01
+* storage  int32   storage_id
+* person   int32   使用人, dictionary-encoded
+* product  int32   产品名 as recorded, dictionary-encoded
+* type     int32   类型 as recorded, dictionary-encoded
+* usage    float64 使用量 in the base unit (base_quantity)
+* unit_dimension int8 base_dimension of the record, as an index into DIMENSIONS
+
+The snapshot is built once and then caught up from the usage_record_changes
+sequence (one primary-key range scan per request, plus re-reading only the
+changed records).  The base dimension is resolved through storage_id at query
+time, and records whose storage item no longer exists drop out, like in the
+SQL joins of the rollup.  Like the rollup, base quantities only count when the
+record's dimension is the item's (see UsageRollupService.item_quantities).
+
+ColumnarAnalytics computes the analytics payloads from a snapshot with
+vectorized group-bys and returns exactly what the SQL implementations in
+routes.analytics return.  Enable it with ANALYTICS_COLUMNAR_CACHE and verify it
+with `flask --app run analytics-parity`.
+"""
+
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Storage, UsageRecord
+from services.data_version import DataVersionService
+from services.usage_change_log import UsageChangeLog
+from utils.time_buckets import format_bucket, normalize_period
+from utils.units import BASE_UNITS, DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Rows fetched per round trip when building or catching up
+FETCH_BATCH_SIZE = 50000
+# Changed ids re-read per IN (...) query
+CHANGE_BATCH_SIZE = 500
+# Group-bys over at most this many (group, value) cells use bincount instead of sorting
+DENSE_GRID_LIMIT = 20_000_000
+
+
+def _day_number(value: date) -> int:
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def _to_date(day_number) -> date:
+    return date.fromordinal(int(day_number) + EPOCH_ORDINAL)
+
+
+def _dimension_index(dimension: Optional[str]) -> int:
+    """Index of *dimension* in DIMENSIONS, -1 for none"""
+    return DIMENSIONS.index(dimension) if dimension in DIMENSIONS else -1
+
+
+def _code(names: List[str], codes: Dict[str, int], name: str) -> int:
+    """Dictionary code of *name*, appending it to *names* when new"""
+    code = codes.get(name)
+    if code is None:
+        code = len(names)
+        names.append(name)
+        codes[name] = code
+    return code
+
+
+def _month_start(month_number) -> date:
+    """First day of a month given as months since 1970-01"""
+    year, month = divmod(int(month_number), 12)
+    return date(1970 + year, month + 1, 1)
+
+
+class ColumnarSnapshot:
+    """Immutable compacted view of the live usage rows plus the storage lookup array"""
+
+    def __init__(self, day, storage, person, product, type_, usage, unit_dimension, persons: Sequence[str],
+                 products: Sequence[str], types: Sequence[str],
+                 dimension_of_storage, dimensions: Sequence[Optional[str]]):
+        self.day = day
+        self.storage = storage
+        self.person = person
+        self.product = product
+        self.type = type_
+        self.persons = list(persons)
+        self.products = list(products)
+        self.types = list(types)
+        self.dimensions = list(dimensions)
+
+        # Rows whose storage item no longer exists drop out, like the SQL inner joins
+        in_range = storage < len(dimension_of_storage)
+        safe_storage = np.where(in_range, storage, 0)
+        self.dimension = np.where(in_range, dimension_of_storage[safe_storage], -1).astype(np.int32)
+        self.valid = self.dimension >= 0
+
+        # Usage recorded in another dimension than the item's counts no base quantity
+        # (items without a dimension, and the -1 of missing items, map to -2, which no record matches)
+        item_dimension = np.array([_dimension_index(name) if name else -2 for name in self.dimensions] + [-2],
+                                  dtype=np.int8)
+        self.usage = np.where(item_dimension[self.dimension] == unit_dimension, usage, 0.0)
+
+    def __len__(self):
+        return len(self.day)
+
+
+class ColumnarUsageCache:
+    """Per-process columnar usage cache, caught up from the change sequence on every read"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, bind_key: Optional[str]) -> None:
+        self._bind_key = bind_key
+        self._built = False
+        self._last_seq = 0
+        self._size = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._day = np.zeros(0, dtype=np.int32)
+        self._storage = np.zeros(0, dtype=np.int32)
+        self._person = np.zeros(0, dtype=np.int32)
+        self._product = np.zeros(0, dtype=np.int32)
+        self._type = np.zeros(0, dtype=np.int32)
+        self._usage = np.zeros(0, dtype=np.float64)
+        self._unit_dimension = np.zeros(0, dtype=np.int8)
+        self._live = np.zeros(0, dtype=bool)
+        self._positions: Dict[int, int] = {}
+        self._persons: List[str] = []
+        self._person_codes: Dict[str, int] = {}
+        self._products: List[str] = []
+        self._product_codes: Dict[str, int] = {}
+        self._types: List[str] = []
+        self._type_codes: Dict[str, int] = {}
+        self._storage_version = None
+        self._storage_lookup = None
+        self._snapshot: Optional[ColumnarSnapshot] = None
+
+    def snapshot(self) -> ColumnarSnapshot:
+        """Return a snapshot that includes every committed usage change"""
+        with self._lock:
+            bind_key = str(db.engine.url)
+            if bind_key != self._bind_key:
+                self._reset(bind_key)
+
+            changed = self._build() if not self._built else self._catch_up()
+            changed = self._refresh_storage() or changed
+
+            if changed or self._snapshot is None:
+                live = np.flatnonzero(self._live[:self._size])
+                dimension_of_storage, dimensions = self._storage_lookup
+                self._snapshot = ColumnarSnapshot(
+                    self._day[live], self._storage[live], self._person[live], self._product[live],
+                    self._type[live], self._usage[live], self._unit_dimension[live], self._persons, self._products, self._types,
+                    dimension_of_storage, dimensions
+                )
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """Drop all data; the next read rebuilds from scratch"""
+        with self._lock:
+            self._reset(None)
+
+    def _build(self) -> bool:
+        # Read the sequence end first: changes committed during the build are re-applied
+        self._last_seq = UsageChangeLog.last_seq()
+
+        statement = select(
+            UsageRecord.id, UsageRecord.storage_id, UsageRecord.使用人, UsageRecord.产品名,
+            UsageRecord.类型, UsageRecord.使用日期, UsageRecord.base_quantity,
+            UsageRecord.base_dimension
+        ).where(
+            UsageRecord.storage_id.isnot(None)
+        ).order_by(UsageRecord.id).execution_options(yield_per=FETCH_BATCH_SIZE)
+
+        for rows in db.session.connection().execute(statement).partitions():
+            self._append(rows)
+
+        self._built = True
+        logger.info(f"Built columnar usage cache with {self._size} rows (seq {self._last_seq})")
+        return True
+
+    def _catch_up(self) -> bool:
+        last_seq, usage_ids = UsageChangeLog.changes_since(self._last_seq)
+        if usage_ids is None:
+            # Changes this cache has not read yet were pruned: start over
+            logger.info(f"Usage changes after seq {self._last_seq} were pruned; rebuilding columnar usage cache")
+            self._reset(self._bind_key)
+            return self._build()
+        if not usage_ids:
+            return False
+
+        for start in range(0, len(usage_ids), CHANGE_BATCH_SIZE):
+            batch = usage_ids[start:start + CHANGE_BATCH_SIZE]
+            rows = db.session.execute(
+                select(
+                    UsageRecord.id, UsageRecord.storage_id, UsageRecord.使用人, UsageRecord.产品名,
+                    UsageRecord.类型, UsageRecord.使用日期, UsageRecord.base_quantity,
+                    UsageRecord.base_dimension
+                ).where(UsageRecord.id.in_(batch))
+            ).all()
+
+            # Ids that are gone (or no longer linked to storage) were deleted
+            linked = [row for row in rows if row.storage_id is not None]
+            kept = {row.id for row in linked}
+            for usage_id in batch:
+                if usage_id not in kept:
+                    position = self._positions.pop(usage_id, None)
+                    if position is not None:
+                        self._live[position] = False
+            self._upsert(linked)
+
+        self._last_seq = last_seq
+        return True
+
+    def _append(self, rows) -> None:
+        """Append rows that are not cached yet, converting whole columns at once"""
+        if not rows:
+            return
+        ids, storage_ids, persons, products, types, dates, usages, unit_dimensions = zip(*rows)
+        count = len(ids)
+        start, end = self._size, self._size + count
+        self._reserve(end)
+
+        self._ids[start:end] = ids
+        self._day[start:end] = np.fromiter((_day_number(d) for d in dates), dtype=np.int32, count=count)
+        self._storage[start:end] = storage_ids
+        self._person[start:end] = [_code(self._persons, self._person_codes, name) for name in persons]
+        self._product[start:end] = [_code(self._products, self._product_codes, name) for name in products]
+        self._type[start:end] = [_code(self._types, self._type_codes, name) for name in types]
+        self._usage[start:end] = np.array([usage or 0.0 for usage in usages], dtype=np.float64)
+        self._unit_dimension[start:end] = [_dimension_index(dimension) for dimension in unit_dimensions]
+        self._live[start:end] = True
+        self._positions.update(zip(ids, range(start, end)))
+        self._size = end
+
+    def _upsert(self, rows) -> None:
+        appended = [row for row in rows if row.id not in self._positions]
+        self._reserve(self._size + len(appended))
+
+        for row in rows:
+            position = self._positions.get(row.id)
+            if position is None:
+                position = self._size
+                self._positions[row.id] = position
+                self._ids[position] = row.id
+                self._size += 1
+            self._day[position] = _day_number(row.使用日期)
+            self._storage[position] = row.storage_id
+            self._person[position] = _code(self._persons, self._person_codes, row.使用人)
+            self._product[position] = _code(self._products, self._product_codes, row.产品名)
+            self._type[position] = _code(self._types, self._type_codes, row.类型)
+            self._usage[position] = row.base_quantity or 0.0
+            self._unit_dimension[position] = _dimension_index(row.base_dimension)
+            self._live[position] = True
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._ids):
+            return
+        capacity = max(capacity, 2 * len(self._ids), 1024)
+        for name in ('_ids', '_day', '_storage', '_person', '_product', '_type', '_usage', '_unit_dimension',
+                     '_live'):
+            current = getattr(self, name)
+            grown = np.zeros(capacity, dtype=current.dtype)
+            grown[:self._size] = current[:self._size]
+            setattr(self, name, grown)
+
+    def _refresh_storage(self) -> bool:
+        """Reload the storage_id -> dimension lookup (-1: no such item) when storage has been written"""
+        version = DataVersionService.current(['storage'])
+        if self._storage_lookup is not None and version == self._storage_version:
+            return False
+
+        rows = db.session.execute(select(Storage.id, Storage.base_dimension)).all()
+        size = max((row.id for row in rows), default=0) + 1
+        dimension_of_storage = np.full(size, -1, dtype=np.int32)
+        dimension_codes: Dict[Optional[str], int] = {}
+        for row in rows:
+            dimension_of_storage[row.id] = dimension_codes.setdefault(row.base_dimension, len(dimension_codes))
+
+        self._storage_lookup = (dimension_of_storage, list(dimension_codes))
+        self._storage_version = version
+        return True
+
+
+# Shared per-process instance
+columnar_usage_cache = ColumnarUsageCache()
+
+
+def _name_rank(names: Sequence[str]) -> np.ndarray:
+    """Rank of each dictionary entry in name order, for deterministic tie-breaks"""
+    order = sorted(range(len(names)), key=lambda i: names[i])
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[order] = np.arange(len(names))
+    return rank
+
+
+def _presence(groups: np.ndarray, values: np.ndarray, n_groups: int, n_values: int) -> Optional[np.ndarray]:
+    """(n_groups, n_values) matrix of which value occurs in which group, None if too large"""
+    if n_groups * n_values > DENSE_GRID_LIMIT:
+        return None
+    keys = groups.astype(np.int64) * n_values + values
+    return np.bincount(keys, minlength=n_groups * n_values).reshape(n_groups, n_values) > 0
+
+
+def _dense_groups(keys: np.ndarray, size: int):
+    """Group non-negative keys below *size*: (sorted distinct keys, group index of each row)"""
+    present = np.bincount(keys, minlength=size) > 0
+    groups = np.flatnonzero(present)
+    index = np.full(size, -1, dtype=np.int64)
+    index[groups] = np.arange(len(groups))
+    return groups, index[keys]
+
+
+def _distinct_per_group(groups: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """Number of distinct *values* per group code"""
+    if len(groups) == 0:
+        return np.zeros(n_groups, dtype=np.int64)
+    n_values = int(values.max()) + 1
+    present = _presence(groups, values, n_groups, n_values)
+    if present is not None:
+        return present.sum(axis=1)
+    pairs = np.unique(groups.astype(np.int64) * n_values + values)
+    return np.bincount(pairs // n_values, minlength=n_groups)
+
+
+def _group_min_max(groups: np.ndarray, values: np.ndarray, n_groups: int):
+    """Per-group min and max of integer *values* (undefined for empty groups)"""
+    if len(groups) == 0:
+        return np.zeros(n_groups, dtype=np.int64), np.zeros(n_groups, dtype=np.int64)
+    offset = int(values.min())
+    span = int(values.max()) - offset + 1
+    present = _presence(groups, values - offset, n_groups, span)
+    if present is not None:
+        lo = present.argmax(axis=1) + offset
+        hi = span - 1 - present[:, ::-1].argmax(axis=1) + offset
+        return lo, hi
+    lo = np.full(n_groups, np.iinfo(np.int64).max, dtype=np.int64)
+    hi = np.full(n_groups, np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(lo, groups, values)
+    np.maximum.at(hi, groups, values)
+    return lo, hi
+
+
+def _bucket_days(days: np.ndarray, period: str) -> np.ndarray:
+    """First day (as a day number) of the day/week/month bucket of each day number"""
+    if period == 'week':
+        # 1970-01-01 was a Thursday; weeks start on Monday
+        return days - (days + 3) % 7
+    if period == 'month':
+        months = days.astype('datetime64[D]').astype('datetime64[M]')
+        return months.astype('datetime64[D]').astype(np.int64)
+    return days.astype(np.int64)
+
+
+class ColumnarAnalytics:
+    """Analytics payloads computed from the columnar usage cache"""
+
+    @staticmethod
+    def _recent(snapshot: ColumnarSnapshot, days: int) -> np.ndarray:
+        start_day = _day_number(date.today() - timedelta(days=days))
+        return snapshot.valid & (snapshot.day >= start_day)
+
+    @staticmethod
+    def dashboard_stats(days: int, top_n: int = 5) -> Dict[str, Any]:
+        snapshot = columnar_usage_cache.snapshot()
+        valid = snapshot.valid
+        recent = ColumnarAnalytics._recent(snapshot, days)
+
+        def top(codes, names):
+            counts = np.bincount(codes[recent], minlength=len(names))
+            used = np.flatnonzero(counts)
+            order = used[np.lexsort((_name_rank(names)[used], -counts[used]))][:top_n]
+            return [{'name': names[i], 'count': int(counts[i])} for i in order]
+
+        recent_days = snapshot.day[recent]
+        first_day = int(recent_days.min()) if len(recent_days) else 0
+        day_counts = np.bincount(recent_days - first_day)
+        days_used = np.flatnonzero(day_counts)
+        day_counts = day_counts[days_used]
+        days_used = days_used + first_day
+        return {
+            'total_records': int(valid.sum()),
+            'recent_records': int(recent.sum()),
+            'unique_personnel': int(np.count_nonzero(np.bincount(snapshot.person[valid]))),
+            'unique_products': int(np.count_nonzero(np.bincount(snapshot.product[valid]))),
+            'top_products': top(snapshot.product, snapshot.products),
+            'top_personnel': top(snapshot.person, snapshot.persons),
+            'daily_usage': [
+                {'date': _to_date(d).isoformat(), 'count': int(c)}
+                for d, c in zip(days_used, day_counts)
+            ]
+        }
+
+    @staticmethod
+    def personnel_stats(days: int) -> Dict[str, Any]:
+        snapshot = columnar_usage_cache.snapshot()
+        recent = ColumnarAnalytics._recent(snapshot, days)
+        person = snapshot.person[recent]
+        day = snapshot.day[recent]
+        names = snapshot.persons
+        n = len(names)
+
+        totals = np.bincount(person, minlength=n)
+        unique_products = _distinct_per_group(person, snapshot.product[recent], n)
+        first, last = _group_min_max(person, day, n)
+        rank = _name_rank(names)
+        active = np.flatnonzero(totals)
+        order = active[np.lexsort((rank[active], -totals[active]))]
+
+        # Monthly activity, ordered by person name then month
+        by_rank = np.argsort(rank)
+        month = day.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        first_month = int(month.min()) if len(month) else 0
+        n_months = int(month.max()) - first_month + 1 if len(month) else 0
+        keys, inverse = _dense_groups(rank[person] * n_months + (month - first_month), n * n_months)
+        counts = np.bincount(inverse, minlength=len(keys))
+
+        return {
+            'personnel_stats': [
+                {
+                    'name': names[i],
+                    'total_records': int(totals[i]),
+                    'unique_products': int(unique_products[i]),
+                    'first_usage': _to_date(first[i]).isoformat(),
+                    'last_usage': _to_date(last[i]).isoformat()
+                }
+                for i in order
+            ],
+            'monthly_activity': [
+                {
+                    'personnel': names[by_rank[key // n_months]],
+                    'month': format_bucket(_month_start(key % n_months + first_month), 'month'),
+                    'count': int(count)
+                }
+                for key, count in zip(keys.tolist(), counts)
+            ]
+        }
+
+    @staticmethod
+    def product_stats(days: int) -> Dict[str, Any]:
+        snapshot = columnar_usage_cache.snapshot()
+        recent = ColumnarAnalytics._recent(snapshot, days)
+
+        # Group by (产品名, 类型, base_dimension) like the SQL GROUP BY
+        n_types = max(len(snapshot.types), 1)
+        n_dimensions = max(len(snapshot.dimensions), 1)
+        group = (snapshot.product[recent].astype(np.int64) * n_types + snapshot.type[recent]) * n_dimensions \
+            + snapshot.dimension[recent]
+        groups, inverse = _dense_groups(group, max(len(snapshot.products), 1) * n_types * n_dimensions)
+        n = len(groups)
+
+        totals = np.bincount(inverse, minlength=n)
+        usage_sum = np.bincount(inverse, weights=snapshot.usage[recent], minlength=n)
+        unique_users = _distinct_per_group(inverse, snapshot.person[recent], n)
+        first, last = _group_min_max(inverse, snapshot.day[recent], n)
+
+        product_rank = _name_rank(snapshot.products)
+        type_rank = _name_rank(snapshot.types) if snapshot.types else np.zeros(1, dtype=np.int64)
+        # NULL dimensions sort first, like COALESCE(base_dimension, '')
+        dimension_rank = _name_rank([name or '' for name in snapshot.dimensions]) if snapshot.dimensions \
+            else np.zeros(1, dtype=np.int64)
+        pairs, dimension_codes = groups // n_dimensions, groups % n_dimensions
+        product_codes, type_codes = pairs // n_types, pairs % n_types
+        order = np.lexsort((dimension_rank[dimension_codes], type_rank[type_codes],
+                            product_rank[product_codes], -totals))
+
+        return {
+            'product_stats': [
+                {
+                    'name': snapshot.products[product_codes[i]],
+                    'type': snapshot.types[type_codes[i]],
+                    'total_usage': int(totals[i]),
+                    'unique_users': int(unique_users[i]),
+                    'first_usage': _to_date(first[i]).isoformat(),
+                    'last_usage': _to_date(last[i]).isoformat(),
+                    'dimension': snapshot.dimensions[dimension_codes[i]],
+                    'avg_usage': float(usage_sum[i]) / int(totals[i]) if usage_sum[i] and totals[i] else 0,
+                    'avg_usage_unit': BASE_UNITS.get(snapshot.dimensions[dimension_codes[i]])
+                }
+                for i in order
+            ]
+        }
+
+    @staticmethod
+    def usage_trends(period: str, days: int) -> Dict[str, Any]:
+        snapshot = columnar_usage_cache.snapshot()
+        recent = ColumnarAnalytics._recent(snapshot, days)
+        bucket_period = normalize_period(period)
+        label = 'date' if bucket_period == 'day' else bucket_period
+
+        bucket_days = _bucket_days(snapshot.day[recent], bucket_period)
+        first_bucket = int(bucket_days.min()) if len(bucket_days) else 0
+        buckets, inverse = _dense_groups(bucket_days - first_bucket, int(bucket_days.max()) - first_bucket + 1
+                                         if len(bucket_days) else 0)
+        buckets = buckets + first_bucket
+        n = len(buckets)
+        counts = np.bincount(inverse, minlength=n)
+        active_users = _distinct_per_group(inverse, snapshot.person[recent], n)
+        products_used = _distinct_per_group(inverse, snapshot.product[recent], n)
+
+        return {
+            'period': period,
+            'trends': [
+                {
+                    label: format_bucket(_to_date(buckets[i]), bucket_period),
+                    'count': int(counts[i]),
+                    'active_users': int(active_users[i]),
+                    'products_used': int(products_used[i])
+                }
+                for i in range(n)
+            ]
+        }
@@ -0,0 +1,64 @@
+import logging
+from typing import Iterable, Tuple
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import db, DataVersion, Storage, UsageRecord
+
+logger = logging.getLogger(__name__)
+
+# Models whose writes invalidate cached responses, by data version name
+TRACKED_MODELS = {
+    Storage: 'storage',
+    UsageRecord: 'usage_records',
+}
+
+ALL_VERSIONS = tuple(TRACKED_MODELS.values())
+
+
+class DataVersionService:
+    """Service class for the per-table data version counters.
+
+    Versions live in the database so that every worker process sees a bump made
+    by any other.  ORM writes to tracked models bump them automatically on flush;
+    Core-level bulk writes must call bump() themselves.
+    """
+
+    @staticmethod
+    def current(names: Iterable[str] = ALL_VERSIONS) -> Tuple[int, ...]:
+        """Return the current versions for the given names (0 if never written)"""
+        names = tuple(names)
+        rows = db.session.execute(
+            select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(names))
+        ).all()
+        versions = dict(rows)
+        return tuple(versions.get(name, 0) for name in names)
+
+    @staticmethod
+    def bump(names: Iterable[str], connection=None) -> None:
+        """Increment the given versions within the current transaction"""
+        connection = connection or db.session.connection()
+        for name in sorted(set(names)):
+            result = connection.execute(
+                update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1)
+            )
+            if result.rowcount == 0:
+                connection.execute(insert(DataVersion).values(name=name, version=1))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_versions_on_flush(session, flush_context):
+    """Bump data versions for tracked models written in this flush"""
+    changed = set()
+    for obj in list(session.new) + list(session.deleted):
+        name = TRACKED_MODELS.get(type(obj))
+        if name:
+            changed.add(name)
+    for obj in session.dirty:
+        name = TRACKED_MODELS.get(type(obj))
+        if name and session.is_modified(obj, include_collections=False):
+            changed.add(name)
+
+    if changed:
+        DataVersionService.bump(changed, connection=session.connection())
@@ -1,15 +1,26 @@
 import pandas as pd
 import os
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
 from werkzeug.utils import secure_filename
 import logging
 
 from utils.date_parser import DateParser
+from utils.sheet_pool import map_sheets
+from utils.table_reader import DEFAULT_CHUNK_SIZE, frame_records, iter_frames, read_heads, sheet_names
+from utils.xlsx_writer import write_xlsx
 from models import UsageRecord, Personnel
 
 logger = logging.getLogger(__name__)
 
+def _cell_text(value: Any) -> str:
+    """Text of a cell in a text column: '' for blanks, 1001 (or 1001.0) -> '1001'"""
+    if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
 class ExcelProcessor:
     """Service class for processing Excel files with storage-integrated usage records"""
     
@@ -28,6 +39,15 @@ class ExcelProcessor:
         '备注': ['备注', 'Notes', 'notes', 'comment'],
     }
 
+    # Columns a file (or each imported worksheet) must have
+    REQUIRED_COLUMNS = ['类型', '产品名', '存放地', '使用日期', '使用人', '使用量']
+
+    # Data rows read by preview_file
+    PREVIEW_ROWS = 10
+
+    # Exported columns, in sheet order (the UsageRecord attributes export_excel reads)
+    EXPORT_COLUMNS = ['类型', '产品名', 'CAS号', '存放地', '使用日期', '使用人', '使用量', '余量', '单位', '备注']
+
     @staticmethod
     def normalize_column_names(df: pd.DataFrame) -> pd.DataFrame:
         column_mapping = {}
@@ -41,18 +61,17 @@ class ExcelProcessor:
         return df
 
     @staticmethod
-    def clean_data(df: pd.DataFrame) -> pd.DataFrame:
+    def clean_data(df: pd.DataFrame, date_cache: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
         df = df.dropna(how='all')
+        # Numeric cells (product codes, staff numbers) are stored and matched as text
         string_columns = ['类型', '产品名', '数量及数量单位', '存放地', 'CAS号', '使用人', '单位', '备注']
         for col in string_columns:
             if col in df.columns:
-                df[col] = df[col].fillna('')
+                df[col] = df[col].map(_cell_text)
         
-        # Parse usage date
+        # Parse usage date (vectorized; *date_cache* carries parsed values across chunks)
         if '使用日期' in df.columns:
-            df['使用日期'] = df['使用日期'].apply(
-                lambda x: DateParser.parse_date(str(x)) if pd.notna(x) else None
-            )
+            df['使用日期'] = DateParser.parse_series(df['使用日期'], cache=date_cache)
         
         # Fill numeric columns
         for col in ['使用量', '余量']:
@@ -81,62 +100,179 @@ class ExcelProcessor:
         return len(errors) == 0, errors
 
     @staticmethod
-    def import_excel(file_path: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    def validate_frame(df: pd.DataFrame) -> pd.Series:
+        """validate_record for every row of a cleaned frame at once.
+
+        Returns the '; '-joined error messages of the invalid rows, indexed
+        like *df*; the checks are boolean masks evaluated column by column.
+        """
+        checks = []
+        for field in ['类型', '产品名', '存放地', '使用日期', '使用人', '使用量']:
+            if field in df.columns:
+                # Same truth test as record.get(field)
+                missing = ~df[field].astype(bool)
+            else:
+                missing = pd.Series(True, index=df.index)
+            checks.append((missing, f"Missing required field: {field}"))
+        
+        # clean_data leaves only dates or None in 使用日期 and numbers in 使用量 / 余量,
+        # so the type checks of validate_record reduce to the sign checks
+        for field in ['使用量', '余量']:
+            if field in df.columns:
+                checks.append((df[field] < 0, f"Invalid {field} value"))
+        
+        failed = pd.Series(False, index=df.index)
+        for mask, _ in checks:
+            failed |= mask
+        
+        messages = pd.Series('', index=df.index[failed], dtype=object)
+        for mask, message in checks:
+            rows = mask[failed]
+            rows = rows.index[rows]
+            messages[rows] = messages[rows] + '; ' + message
+        return messages.str[2:]
+
+    @staticmethod
+    def validate_chunk(df: pd.DataFrame, first_row: int, date_cache: Optional[Dict[str, Any]] = None,
+                       sheet: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Normalize, clean and validate one chunk whose first data row is file row *first_row*.
+
+        Row errors name the worksheet when *sheet* is given.
+        """
+        df.index = range(first_row, first_row + len(df))
+        df = ExcelProcessor.normalize_column_names(df)
+        df = ExcelProcessor.clean_data(df, date_cache)
+        messages = ExcelProcessor.validate_frame(df)
+        valid_records = frame_records(df.drop(index=messages.index))
+        label = f"Sheet '{sheet}', row" if sheet is not None else "Row"
+        errors = [f"{label} {row_number}: {message}" for row_number, message in messages.items()]
+        return valid_records, errors
+
+    @staticmethod
+    def iter_sheet_chunks(file_path: str, sheet: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+                          ) -> Iterator[Tuple[List[Dict[str, Any]], List[str]]]:
+        """Yield (valid records, errors) per chunk of one worksheet (the first one when *sheet* is None).
+
+        A named sheet without the required columns, such as a notes sheet,
+        yields a single error instead of one per row.
+        """
+        first_row = 2  # row 1 is the header
+        date_cache: Dict[str, Any] = {}
+        for df in iter_frames(file_path, chunk_size, sheet):
+            if sheet is not None and first_row == 2:
+                columns = ExcelProcessor.normalize_column_names(df.iloc[:0]).columns
+                missing_columns = [col for col in ExcelProcessor.REQUIRED_COLUMNS if col not in columns]
+                if missing_columns:
+                    yield [], [f"Sheet '{sheet}': missing required columns {missing_columns}; sheet skipped"]
+                    return
+            row_count = len(df)
+            yield ExcelProcessor.validate_chunk(df, first_row, date_cache, sheet)
+            first_row += row_count
+
+    @staticmethod
+    def iter_import_chunks(file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, processes: int = 1
+                           ) -> Iterator[Tuple[List[Dict[str, Any]], List[str]]]:
+        """Yield (valid records, errors) per chunk of at most *chunk_size* file rows.
+
+        Only one chunk is held in memory at a time.  Every worksheet of a
+        workbook is imported, in workbook order.  With *processes* > 1 the
+        sheets of a multi-sheet workbook are parsed in parallel (see
+        utils.sheet_pool).  A read error ends the iteration with a final
+        ([], [error]) chunk.
+        """
         try:
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path, encoding='utf-8')
+            sheets = sheet_names(file_path)
+            if len(sheets) <= 1:
+                yield from ExcelProcessor.iter_sheet_chunks(file_path, None, chunk_size)
+            elif processes > 1:
+                yield from map_sheets(ExcelProcessor.iter_sheet_chunks, file_path, sheets, processes, chunk_size)
             else:
-                df = pd.read_excel(file_path, engine='openpyxl')
-            df = ExcelProcessor.normalize_column_names(df)
-            df = ExcelProcessor.clean_data(df)
-            records = df.to_dict('records')
-            valid_records = []
-            errors = []
-            for i, record in enumerate(records):
-                is_valid, record_errors = ExcelProcessor.validate_record(record)
-                if is_valid:
-                    valid_records.append(record)
-                else:
-                    errors.append(f"Row {i+2}: {'; '.join(record_errors)}")
-            return valid_records, errors
+                for sheet in sheets:
+                    yield from ExcelProcessor.iter_sheet_chunks(file_path, sheet, chunk_size)
         except Exception as e:
             logger.error(f"Error importing Excel file: {str(e)}")
-            return [], [f"Import error: {str(e)}"]
+            yield [], [f"Import error: {str(e)}"]
 
     @staticmethod
-    def export_excel(records: List[Any], output_path: str) -> bool:
+    def import_excel(file_path: str, processes: int = 1) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """All valid records and errors of a file (see iter_import_chunks for bounded memory)"""
+        valid_records = []
+        errors = []
+        for chunk_records, chunk_errors in ExcelProcessor.iter_import_chunks(file_path, processes=processes):
+            valid_records.extend(chunk_records)
+            errors.extend(chunk_errors)
+        return valid_records, errors
+
+    @staticmethod
+    def preview_file(file_path: str, nrows: int = PREVIEW_ROWS) -> Dict[str, Any]:
+        """Column mapping and the first *nrows* rows of a file, cleaned and validated.
+
+        Only the header and those rows of each worksheet are read; the row
+        count is an estimate (see read_head) summed over the sheets the import
+        reads, and the rest of the file is validated by the import.  Like the
+        import, a workbook with several sheets skips those without the
+        required columns; the sample comes from the first sheet it imports.
+        """
+        try:
+            heads = read_heads(file_path, nrows)
+        except Exception as e:
+            logger.error(f"Error previewing Excel file: {str(e)}")
+            return {'column_mapping': {}, 'missing_columns': [], 'sample_rows': 0, 'estimated_rows': None,
+                    'sheets': [], 'valid_records': [], 'errors': [f"Import error: {str(e)}"]}
+
+        multi_sheet = len(heads) > 1
+        sheets = []
+        for name, df, estimated_rows in heads:
+            normalized = ExcelProcessor.normalize_column_names(df.iloc[:0])
+            missing_columns = [col for col in ExcelProcessor.REQUIRED_COLUMNS if col not in normalized.columns]
+            sheets.append((name, df, normalized, missing_columns, estimated_rows))
+        imported = [sheet for sheet in sheets if not sheet[3]] if multi_sheet else sheets
+        name, df, normalized, missing_columns, _ = (imported or sheets)[0]
+
+        column_mapping = {
+            str(original): (column if column in ExcelProcessor.COLUMN_MAPPINGS else None)
+            for original, column in zip(df.columns, normalized.columns)
+        }
+        # Unmapped columns are not imported; leave them out of the sample records
+        mapped = [column is not None for column in column_mapping.values()]
+        valid_records, errors = ExcelProcessor.validate_chunk(
+            df.loc[:, mapped], first_row=2, sheet=name if multi_sheet else None
+        )
+        estimates = [sheet[4] for sheet in imported]
+        return {
+            'column_mapping': column_mapping,
+            'missing_columns': missing_columns,
+            'sample_rows': len(df),
+            'estimated_rows': None if None in estimates else sum(estimates),
+            'sheets': [
+                {'name': sheet_name, 'missing_columns': sheet_missing, 'estimated_rows': sheet_rows}
+                for sheet_name, _, _, sheet_missing, sheet_rows in sheets
+            ],
+            'valid_records': valid_records,
+            'errors': errors,
+        }
+
+    @staticmethod
+    def export_excel(records: Iterable[Any], output_path: str) -> bool:
+        """Stream usage records (ORM objects or rows with the same attribute names) to an XLSX file"""
         try:
-            data = []
-            for record in records:
-                # UsageRecord now uses Chinese field names and storage integration
-                data.append({
-                    '类型': getattr(record, '类型', ''),
-                    '产品名': getattr(record, '产品名', ''),
-                    'CAS号': getattr(record, 'CAS号', ''),
-                    '存放地': getattr(record, '存放地', ''),
-                    '使用日期': DateParser.format_date_for_display(getattr(record, '使用日期', None)),
-                    '使用人': getattr(record, '使用人', ''),
-                    '使用量': getattr(record, '使用量', None),
-                    '余量': getattr(record, '余量', None),
-                    '单位': getattr(record, '单位', ''),
-                    '备注': getattr(record, '备注', ''),
-                })
-            df = pd.DataFrame(data)
+            rows = (
+                [
+                    getattr(record, '类型', ''),
+                    getattr(record, '产品名', ''),
+                    getattr(record, 'CAS号', ''),
+                    getattr(record, '存放地', ''),
+                    DateParser.format_date_for_display(getattr(record, '使用日期', None)),
+                    getattr(record, '使用人', ''),
+                    getattr(record, '使用量', None),
+                    getattr(record, '余量', None),
+                    getattr(record, '单位', ''),
+                    getattr(record, '备注', ''),
+                ]
+                for record in records
+            )
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Usage Records', index=False)
-                worksheet = writer.sheets['Usage Records']
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except Exception:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            write_xlsx(output_path, 'Usage Records', ExcelProcessor.EXPORT_COLUMNS, rows)
             return True
         except Exception as e:
             logger.error(f"Error exporting Excel file: {str(e)}")
@@ -0,0 +1,181 @@
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, Storage, UsageDailyRollup
+
+logger = logging.getLogger(__name__)
+
+# Smoothing factor for the exponentially smoothed daily usage level
+DEFAULT_ALPHA = 0.3
+# Days of history used to fit the model
+DEFAULT_HISTORY_DAYS = 90
+# Days between placing an order and receiving it
+DEFAULT_LEAD_TIME_DAYS = 7
+# z-score for the safety stock (~95% service level)
+SAFETY_Z = 1.65
+# Weekday factors need at least this many full weeks of history
+MIN_SEASONAL_WEEKS = 2
+
+
+class ForecastService:
+    """Service class for batch stock depletion forecasts.
+
+    Daily usage of every storage item is loaded from the rollup in one grouped
+    query into an items × days matrix.  A simple exponential smoothing level is
+    fitted for all items at once (one vectorized step per day) and multiplied
+    by per-item weekday factors, so the whole catalogue is forecast in one pass.
+    """
+
+    @staticmethod
+    def load_usage_matrix(start_date: date, end_date: date, storage_ids: List[int]) -> np.ndarray:
+        """Return daily usage as a (len(storage_ids), days) matrix, zeros for days without usage"""
+        days = (end_date - start_date).days + 1
+        matrix = np.zeros((len(storage_ids), days), dtype=np.float64)
+        if not storage_ids or days <= 0:
+            return matrix
+
+        rows = db.session.execute(
+            select(
+                UsageDailyRollup.storage_id,
+                UsageDailyRollup.day,
+                func.sum(UsageDailyRollup.total_usage)
+            ).where(
+                UsageDailyRollup.day >= start_date,
+                UsageDailyRollup.day <= end_date
+            ).group_by(UsageDailyRollup.storage_id, UsageDailyRollup.day)
+        ).all()
+        if not rows:
+            return matrix
+
+        position = {storage_id: i for i, storage_id in enumerate(storage_ids)}
+        item_idx, day_idx, values = [], [], []
+        for storage_id, day, usage in rows:
+            i = position.get(storage_id)
+            if i is None:
+                continue
+            item_idx.append(i)
+            day_idx.append((day - start_date).days)
+            values.append(float(usage or 0.0))
+        np.add.at(matrix, (np.array(item_idx, dtype=np.intp), np.array(day_idx, dtype=np.intp)), values)
+        return matrix
+
+    @staticmethod
+    def fit(usage: np.ndarray, start_date: date, alpha: float = DEFAULT_ALPHA) -> Dict[str, np.ndarray]:
+        """Fit smoothed level, weekday factors and residual spread for every row of *usage*.
+
+        Returns a dict of arrays: level (items,), weekday_factors (items, 7) indexed
+        by date.weekday(), and sigma (items,) - the std of one-day-ahead errors.
+        """
+        n_items, n_days = usage.shape
+        weekdays = (start_date.weekday() + np.arange(n_days)) % 7
+
+        # Weekday factors: mean usage per weekday relative to the overall mean
+        factors = np.ones((n_items, 7))
+        if n_days >= 7 * MIN_SEASONAL_WEEKS:
+            overall = usage.mean(axis=1)
+            for weekday in range(7):
+                columns = weekdays == weekday
+                factors[:, weekday] = usage[:, columns].mean(axis=1)
+            active = overall > 0
+            factors[active] /= overall[active, None]
+            factors[~active] = 1.0
+
+        # Exponential smoothing of deseasonalized usage, vectorized across items.
+        # Weekdays with a zero factor carry no information about the level.
+        day_factors = factors[:, weekdays]
+        informative = day_factors > 0
+        deseasonalized = np.divide(usage, day_factors, out=np.zeros_like(usage), where=informative)
+        level = deseasonalized[:, 0].copy() if n_days else np.zeros(n_items)
+        squared_errors = np.zeros(n_items)
+        for t in range(1, n_days):
+            predicted = level * day_factors[:, t]
+            squared_errors += (usage[:, t] - predicted) ** 2
+            updated = alpha * deseasonalized[:, t] + (1 - alpha) * level
+            level = np.where(informative[:, t], updated, level)
+
+        sigma = np.sqrt(squared_errors / max(n_days - 1, 1))
+        return {'level': level, 'weekday_factors': factors, 'sigma': sigma}
+
+    @staticmethod
+    def forecast_catalogue(horizon: int = 30, history_days: int = DEFAULT_HISTORY_DAYS,
+                           lead_time: int = DEFAULT_LEAD_TIME_DAYS,
+                           alpha: float = DEFAULT_ALPHA) -> Dict[str, Any]:
+        """Forecast stock-out dates and reorder suggestions for every storage item"""
+        today = date.today()
+        start_date = today - timedelta(days=history_days - 1)
+
+        items = db.session.execute(
+            select(
+                Storage.id, Storage.产品名, Storage.类型, Storage.存放地,
+                Storage.当前库存量, Storage.单位, Storage.initial_quantity
+            ).order_by(Storage.id)
+        ).all()
+        storage_ids = [item.id for item in items]
+
+        usage = ForecastService.load_usage_matrix(start_date, today, storage_ids)
+        model = ForecastService.fit(usage, start_date, alpha)
+
+        # Daily demand forecast for tomorrow .. today + horizon
+        future_weekdays = (today.weekday() + 1 + np.arange(horizon)) % 7
+        demand = model['level'][:, None] * model['weekday_factors'][:, future_weekdays]
+        cumulative = np.cumsum(demand, axis=1)
+
+        stock = np.array([float(item.当前库存量 or 0.0) for item in items])
+        runs_out = cumulative >= stock[:, None]
+        stockout_within = runs_out.any(axis=1) & (demand.sum(axis=1) > 0)
+        stockout_day = np.where(stockout_within, runs_out.argmax(axis=1) + 1, -1)
+
+        # Beyond the horizon fall back to stock / average forecast daily demand
+        mean_demand = demand.mean(axis=1) if horizon else np.zeros(len(items))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_left = np.where(mean_demand > 0, stock / mean_demand, np.inf)
+        days_left = np.where(stockout_within, stockout_day, days_left)
+
+        # Reorder point = expected lead-time demand + safety stock
+        lead_demand = cumulative[:, min(lead_time, horizon) - 1] if horizon and lead_time > 0 else np.zeros(len(items))
+        safety_stock = SAFETY_Z * model['sigma'] * np.sqrt(max(lead_time, 0))
+        reorder_point = lead_demand + safety_stock
+        horizon_demand = cumulative[:, -1] if horizon else np.zeros(len(items))
+        reorder = (mean_demand > 0) & (stock <= reorder_point)
+        order_quantity = np.maximum(horizon_demand + safety_stock - stock, 0.0)
+
+        forecasts = []
+        for i, item in enumerate(items):
+            forecasts.append({
+                'storage_id': item.id,
+                '产品名': item.产品名,
+                '类型': item.类型,
+                '存放地': item.存放地,
+                '单位': item.单位,
+                'current_stock': float(stock[i]),
+                'initial_quantity': item.initial_quantity,
+                'forecast_daily_usage': round(float(mean_demand[i]), 3),
+                'forecast_horizon_usage': round(float(horizon_demand[i]), 3),
+                'days_until_stockout': round(float(days_left[i]), 1) if np.isfinite(days_left[i]) else None,
+                'stockout_date': (today + timedelta(days=int(stockout_day[i]))).isoformat()
+                if stockout_within[i] else None,
+                'reorder_point': round(float(reorder_point[i]), 3),
+                'reorder_suggested': bool(reorder[i]),
+                'suggested_order_quantity': round(float(order_quantity[i]), 3) if reorder[i] else 0.0
+            })
+
+        # Soonest stock-outs first, items without usage last
+        forecasts.sort(key=lambda f: (f['days_until_stockout'] is None, f['days_until_stockout'] or 0, f['storage_id']))
+
+        return {
+            'generated_on': today.isoformat(),
+            'horizon': horizon,
+            'history_days': history_days,
+            'lead_time_days': lead_time,
+            'model': 'exponential_smoothing_weekday',
+            'summary': {
+                'items': len(forecasts),
+                'stockouts_within_horizon': int(stockout_within.sum()),
+                'reorder_suggested': int(reorder.sum())
+            },
+            'forecasts': forecasts
+        }
@@ -0,0 +1,82 @@
+import hashlib
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ImportedFile
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time while hashing an upload
+READ_SIZE = 1 << 20
+
+
+class ImportedFileService:
+    """Service class for recognizing uploads whose content was already imported.
+
+    A file is remembered by the SHA-256 of its bytes once an import of it has
+    finished without failed insert batches.  Uploading the same bytes again
+    returns that result without reading the file; changed or partially
+    overlapping files are imported and skip the rows already stored (see
+    UsageImportService.row_hash).
+    """
+
+    @staticmethod
+    def stream_digest(stream) -> str:
+        """Hex SHA-256 of the rest of a binary stream"""
+        digest = hashlib.sha256()
+        for block in iter(lambda: stream.read(READ_SIZE), b''):
+            digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def upload_digest(file) -> str:
+        """Hex SHA-256 of an uploaded FileStorage, leaving it ready to be saved"""
+        file.stream.seek(0)
+        try:
+            return ImportedFileService.stream_digest(file.stream)
+        finally:
+            file.stream.seek(0)
+
+    @staticmethod
+    def file_digest(file_path: str) -> str:
+        """Hex SHA-256 of a saved upload"""
+        with open(file_path, 'rb') as f:
+            return ImportedFileService.stream_digest(f)
+
+    @staticmethod
+    def find(kind: str, sha256: str) -> Optional[ImportedFile]:
+        return db.session.execute(
+            select(ImportedFile).where(ImportedFile.kind == kind, ImportedFile.sha256 == sha256)
+        ).scalar()
+
+    @staticmethod
+    def remember(kind: str, sha256: str, filename: str, row_count: int, imported_count: int,
+                 skipped_count: int, error_count: int, job_id: Optional[int] = None) -> None:
+        """Record a finished import of a file; a concurrent import of the same file may have recorded it first"""
+        try:
+            db.session.add(ImportedFile(
+                kind=kind, sha256=sha256, filename=filename, row_count=row_count,
+                imported_count=imported_count, skipped_count=skipped_count,
+                error_count=error_count, job_id=job_id
+            ))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.info(f"Import of {filename} ({sha256}) was already recorded")
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def already_imported_response(imported_file: ImportedFile) -> dict:
+        """Body returned for an upload whose content was imported before"""
+        return {
+            'message': f'File already imported on {imported_file.created_at:%Y-%m-%d %H:%M}; no records added',
+            'already_imported': True,
+            'imported_count': 0,
+            'total_records': imported_file.row_count,
+            'import': imported_file.to_dict()
+        }
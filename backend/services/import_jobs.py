@@ -0,0 +1,346 @@
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from werkzeug.utils import secure_filename
+
+from core.job_queue import JobQueue
+from models import db, ImportJob, ImportJobError
+from services.excel_processor import ExcelProcessor
+from services.import_files import ImportedFileService
+from services.storage_excel_processor import StorageExcelProcessor
+from services.usage_import import UsageImportService
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ('usage', 'storage')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+
+class ImportCancelled(Exception):
+    """Raised inside a running job once its cancellation has been requested"""
+
+
+class ImportJobService:
+    """Service class for background import jobs.
+
+    An upload is saved under IMPORT_JOB_DIR and recorded as a queued job; the
+    import workers (see core.job_queue) claim it and run the same chunked
+    import as the synchronous endpoints.  Progress, row counts and row errors
+    are written to the database as the job goes, so any worker can report
+    them, and a side thread writes a heartbeat while the job runs.
+    Cancellation is checked between chunks: records committed before that
+    point are kept.
+    """
+
+    @staticmethod
+    def enqueue(kind: str, file) -> ImportJob:
+        """Save an uploaded file and queue a job for it"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown import job kind: {kind}")
+        filename = secure_filename(file.filename) or 'upload'
+        job_dir = os.path.join(current_app.config['IMPORT_JOB_DIR'], uuid.uuid4().hex)
+        os.makedirs(job_dir, exist_ok=True)
+        file_path = os.path.join(job_dir, filename)
+        try:
+            file.save(file_path)
+            job = ImportJob(kind=kind, filename=filename, file_path=file_path, status='queued')
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        start_import_workers(current_app._get_current_object())
+        import_queue.notify()
+        return job
+
+    @staticmethod
+    def claim_next() -> Optional[int]:
+        """Mark the oldest queued job as running in this process; returns its id"""
+        while True:
+            job_id = db.session.execute(
+                select(ImportJob.id).where(ImportJob.status == 'queued').order_by(ImportJob.id).limit(1)
+            ).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+
+            now = datetime.utcnow()
+            claimed = db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.status == 'queued')
+                .values(status='running', worker_pid=os.getpid(), started_at=now, heartbeat_at=now)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return job_id
+            # Another worker claimed it first
+
+    @staticmethod
+    def run(job_id: int) -> None:
+        """Run a claimed job to completion and record its final status"""
+        job = db.session.get(ImportJob, job_id)
+        file_path = job.file_path
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=ImportJobService._heartbeat, args=(current_app._get_current_object(), job_id, stop),
+            name=f'import-job-{job_id}-heartbeat', daemon=True
+        )
+        heartbeat.start()
+        try:
+            if job.kind == 'usage':
+                status, message = ImportJobService._run_usage(job_id, file_path)
+            else:
+                status, message = ImportJobService._run_storage(job_id, file_path)
+        except ImportCancelled:
+            status, message = 'cancelled', 'Cancelled; records imported before cancellation are kept'
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Import job {job_id} failed: {str(e)}")
+            status, message = 'failed', f"Import failed: {str(e)}"
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if ImportJobService._finish(job_id, status, message):
+            logger.info(f"Import job {job_id} {status}: {message}")
+        else:
+            logger.warning(f"Import job {job_id} was already finished; not recording {status}: {message}")
+
+    @staticmethod
+    def _heartbeat(app, job_id: int, stop: threading.Event) -> None:
+        """Write the job's heartbeat every IMPORT_JOB_HEARTBEAT_INTERVAL seconds until *stop* is set.
+
+        Covers the phases that report no progress, such as parsing a whole
+        sheet or the lookups and flush of a storage import.
+        """
+        interval = app.config.get('IMPORT_JOB_HEARTBEAT_INTERVAL', 60)
+        with app.app_context():
+            while not stop.wait(interval):
+                try:
+                    ImportJobService._update(job_id)
+                except Exception as e:
+                    logger.error(f"Heartbeat of import job {job_id} failed: {str(e)}")
+
+    @staticmethod
+    def cancel(job_id: int) -> Optional[ImportJob]:
+        """Cancel a queued job, or ask a running one to stop after its current chunk"""
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+
+        # Only cancel directly if no worker has claimed the job in the meantime
+        file_path = job.file_path
+        try:
+            cancelled = db.session.execute(
+                update(ImportJob).where(ImportJob.id == job_id, ImportJob.status == 'queued').values(
+                    status='cancelled', cancel_requested=True, message='Cancelled before it started',
+                    file_path=None, finished_at=datetime.utcnow()
+                )
+            ).rowcount
+            if not cancelled:
+                db.session.execute(update(ImportJob).where(ImportJob.id == job_id).values(cancel_requested=True))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if cancelled and file_path:
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        db.session.refresh(job)
+        return job
+
+    @staticmethod
+    def expire(stale_after: int, max_age_days: int) -> Dict[str, int]:
+        """Fail running jobs whose worker process exited, and delete old finished jobs.
+
+        A job counts as abandoned once its heartbeat is older than *stale_after*
+        seconds and its worker process is gone; uploads are saved on local disk,
+        so all workers run on this host.
+        """
+        now = datetime.utcnow()
+        stale = db.session.execute(
+            select(ImportJob.id, ImportJob.worker_pid).where(
+                ImportJob.status == 'running',
+                ImportJob.heartbeat_at < now - timedelta(seconds=stale_after)
+            )
+        ).all()
+        # _finish skips jobs that finished in the meantime
+        stale_ids = [
+            job_id for job_id, worker_pid in stale
+            if not _process_alive(worker_pid)
+            and ImportJobService._finish(job_id, 'failed', 'Import worker stopped before the job finished')
+        ]
+
+        old_ids = db.session.execute(
+            select(ImportJob.id).where(
+                ImportJob.status.in_(FINISHED_STATUSES),
+                ImportJob.finished_at < now - timedelta(days=max_age_days)
+            )
+        ).scalars().all()
+        try:
+            if old_ids:
+                db.session.execute(delete(ImportJobError).where(ImportJobError.job_id.in_(old_ids)))
+                db.session.execute(delete(ImportJob).where(ImportJob.id.in_(old_ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return {'failed': len(stale_ids), 'deleted': len(old_ids)}
+
+    @staticmethod
+    def _run_usage(job_id: int, file_path: str) -> Tuple[str, str]:
+        chunk_size = current_app.config.get('IMPORT_CHUNK_SIZE', 5000)
+        chunks = ImportJobService._tracked_chunks(
+            job_id, ExcelProcessor.iter_import_chunks(
+                file_path, chunk_size, processes=current_app.config.get('IMPORT_SHEET_PROCESSES', 1)
+            )
+        )
+        result = UsageImportService.import_chunks(
+            chunks,
+            chunk_size=chunk_size,
+            progress=lambda inserted, _: ImportJobService._update(job_id, imported_count=inserted)
+        )
+        # Row errors were recorded per chunk; these are the insert batches that failed
+        ImportJobService._add_errors(job_id, result['errors'])
+
+        if not result['total_records']:
+            return 'failed', 'No valid records found in file'
+        if result['imported_count'] + result['skipped_count'] == result['total_records']:
+            job = db.session.get(ImportJob, job_id)
+            ImportedFileService.remember(
+                'usage', ImportedFileService.file_digest(file_path), job.filename, result['total_records'],
+                result['imported_count'], result['skipped_count'], job.error_count, job_id=job_id
+            )
+
+        # Listed with the errors: stock warnings and the records left without a storage item
+        ImportJobService._add_errors(job_id, result['warnings'] + [
+            f"Not linked to a storage item ({item['count']} records): "
+            f"{item['类型']} / {item['产品名']} / {item['存放地']} / {item['CAS号'] or '-'}"
+            for item in result['unmatched']
+        ])
+        return 'succeeded', UsageImportService.summary(result)
+
+    @staticmethod
+    def _tracked_chunks(job_id: int, chunks: Iterable[Tuple[List[Dict[str, Any]], List[str]]]
+                        ) -> Iterator[Tuple[List[Dict[str, Any]], List[str]]]:
+        """Record each chunk's counts and row errors, stopping if the job was cancelled"""
+        rows_read = 0
+        valid_count = 0
+        for valid_records, errors in chunks:
+            ImportJobService._check_cancelled(job_id)
+            rows_read += len(valid_records) + len(errors)
+            valid_count += len(valid_records)
+            ImportJobService._add_errors(job_id, errors)
+            ImportJobService._update(job_id, rows_read=rows_read, valid_count=valid_count)
+            yield valid_records, []
+
+    @staticmethod
+    def _run_storage(job_id: int, file_path: str) -> Tuple[str, str]:
+        result = StorageExcelProcessor.import_storage_excel(
+            file_path,
+            progress=lambda rows_read: ImportJobService._update(job_id, rows_read=rows_read),
+            should_cancel=lambda: ImportJobService._cancel_requested(job_id),
+            processes=current_app.config.get('IMPORT_SHEET_PROCESSES', 1)
+        )
+        ImportJobService._add_errors(job_id, result.get('errors', []))
+        if not result['success']:
+            return 'failed', result['error']
+
+        ImportJobService._update(
+            job_id,
+            imported_count=result['created_count'],
+            updated_count=result['updated_count']
+        )
+        if result.get('cancelled'):
+            raise ImportCancelled()
+        return 'succeeded', f"Created {result['created_count']} and renamed {result['updated_count']} storage items"
+
+    @staticmethod
+    def _cancel_requested(job_id: int) -> bool:
+        return bool(db.session.execute(
+            select(ImportJob.cancel_requested).where(ImportJob.id == job_id)
+        ).scalar())
+
+    @staticmethod
+    def _check_cancelled(job_id: int) -> None:
+        if ImportJobService._cancel_requested(job_id):
+            raise ImportCancelled()
+
+    @staticmethod
+    def _update(job_id: int, **values) -> None:
+        """Write progress counters (and the heartbeat) in their own short transaction"""
+        try:
+            db.session.execute(
+                update(ImportJob).where(ImportJob.id == job_id).values(heartbeat_at=datetime.utcnow(), **values)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def _add_errors(job_id: int, messages: List[str]) -> None:
+        if not messages:
+            return
+        try:
+            db.session.execute(insert(ImportJobError), [{'job_id': job_id, 'message': m} for m in messages])
+            db.session.execute(
+                update(ImportJob).where(ImportJob.id == job_id)
+                .values(error_count=ImportJob.error_count + len(messages), heartbeat_at=datetime.utcnow())
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def _finish(job_id: int, status: str, message: str) -> bool:
+        """Record the final status of a running job and remove the saved upload.
+
+        Returns False, changing nothing, if the job is no longer running.
+        """
+        file_path = db.session.execute(select(ImportJob.file_path).where(ImportJob.id == job_id)).scalar()
+        try:
+            finished = db.session.execute(
+                update(ImportJob).where(ImportJob.id == job_id, ImportJob.status == 'running')
+                .values(status=status, message=message, file_path=None, finished_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if finished and file_path:
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        return bool(finished)
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """Whether a process with this id is running on this host"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+# Shared per-process worker pool
+import_queue = JobQueue('import', ImportJobService.claim_next, ImportJobService.run)
+
+
+def start_import_workers(app) -> bool:
+    """Start this process's import workers (IMPORT_WORKERS threads, 0 disables them)"""
+    import_queue.poll_interval = app.config.get('IMPORT_JOB_POLL_INTERVAL', 5)
+    return import_queue.start(app, workers=app.config.get('IMPORT_WORKERS', 1))
@@ -0,0 +1,57 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from models import db, PrecomputedPayload
+
+logger = logging.getLogger(__name__)
+
+
+class PrecomputedPayloadService:
+    """Service class for response payloads computed off the request path.
+
+    Scheduled jobs store payloads for the default parameters of expensive
+    endpoints together with the data version they were computed at.  Every
+    worker process can serve them while that version is still current and the
+    payload is younger than the configured maximum age (for date-relative
+    windows that move at midnight).
+    """
+
+    @staticmethod
+    def _serialize(value: Hashable) -> str:
+        return json.dumps(list(value) if isinstance(value, tuple) else value, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def get(key: Tuple, version: Hashable, max_age: float) -> Optional[Any]:
+        """Stored payload for *key* at *version*, or None if missing, stale or too old"""
+        row = db.session.get(PrecomputedPayload, PrecomputedPayloadService._serialize(key))
+        if row is None or row.version != PrecomputedPayloadService._serialize(version):
+            return None
+        if row.computed_at < datetime.utcnow() - timedelta(seconds=max_age):
+            return None
+        return json.loads(row.payload)
+
+    @staticmethod
+    def refresh(payloads: Dict[Tuple, Callable[[], Any]], max_age: float) -> int:
+        """Recompute the payloads whose stored copy is stale; returns the number recomputed"""
+        from services.data_version import DataVersionService
+
+        refreshed = 0
+        for key, compute in payloads.items():
+            # Read the version first: a write during compute() leaves the payload stale, never wrong
+            version = DataVersionService.current()
+            if PrecomputedPayloadService.get(key, version, max_age / 2) is not None:
+                continue
+
+            payload = compute()
+            db.session.merge(PrecomputedPayload(
+                key=PrecomputedPayloadService._serialize(key),
+                version=PrecomputedPayloadService._serialize(version),
+                payload=json.dumps(payload, ensure_ascii=False, default=str),
+                computed_at=datetime.utcnow()
+            ))
+            db.session.commit()
+            refreshed += 1
+
+        return refreshed
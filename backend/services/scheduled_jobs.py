@@ -0,0 +1,125 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from core.response_cache import PRECOMPUTED
+from core.scheduler import JobScheduler, ScheduledJob, scheduler
+from models import db, ScheduledJobStatus
+from services.import_jobs import ImportJobService
+from services.precomputed_payloads import PrecomputedPayloadService
+from services.usage_change_log import UsageChangeLog
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_precomputed(group: str) -> int:
+    """Recompute the stale payloads registered for *group*"""
+    max_age = current_app.config.get('PRECOMPUTED_PAYLOAD_MAX_AGE', 600)
+    return PrecomputedPayloadService.refresh(PRECOMPUTED.get(group, {}), max_age)
+
+
+def analyze_database() -> None:
+    """Refresh planner statistics (ANALYZE works on SQLite and PostgreSQL)"""
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+
+def prune_temp_exports() -> int:
+    """Remove export/template temp directories older than EXPORT_TEMP_MAX_AGE seconds"""
+    prefix = current_app.config.get('EXPORT_TEMP_PREFIX', 'lab_tracker_export_')
+    cutoff = time.time() - current_app.config.get('EXPORT_TEMP_MAX_AGE', 3600)
+    temp_root = tempfile.gettempdir()
+
+    removed = 0
+    for name in os.listdir(temp_root):
+        path = os.path.join(temp_root, name)
+        if not name.startswith(prefix) or not os.path.isdir(path):
+            continue
+        if os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def expire_import_jobs() -> dict:
+    """Fail import jobs whose worker died and delete finished jobs past IMPORT_JOB_MAX_AGE_DAYS"""
+    return ImportJobService.expire(
+        current_app.config.get('IMPORT_JOB_STALE_AFTER', 600),
+        current_app.config.get('IMPORT_JOB_MAX_AGE_DAYS', 7)
+    )
+
+
+def prune_usage_changes() -> int:
+    """Delete usage change log entries beyond the newest USAGE_CHANGE_LOG_KEEP"""
+    return UsageChangeLog.prune(current_app.config.get('USAGE_CHANGE_LOG_KEEP', 100000))
+
+
+def record_job_status(job: ScheduledJob) -> None:
+    """Persist a job's metrics so that the admin endpoint can read them from any worker"""
+    details = job.to_dict()
+    try:
+        db.session.merge(ScheduledJobStatus(
+            name=job.name,
+            interval_seconds=job.interval,
+            run_count=job.run_count,
+            failure_count=job.failure_count,
+            last_started_at=job.last_started_at,
+            last_duration_ms=details['last_duration_ms'],
+            avg_duration_ms=details['avg_duration_ms'],
+            max_duration_ms=details['max_duration_ms'],
+            last_status=job.last_status,
+            last_error=job.last_error,
+            leader_pid=os.getpid()
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def register_default_jobs(job_scheduler: JobScheduler) -> None:
+    """Register the periodic jobs that move expensive work off the request path"""
+    job_scheduler.register(
+        'refresh-alerts', lambda: refresh_precomputed('alerts'), interval=60,
+        description='Precompute the default low-stock / unused-item alerts'
+    )
+    job_scheduler.register(
+        'recompute-dashboards', lambda: refresh_precomputed('dashboards'), interval=60, initial_delay=5,
+        description='Precompute the default inventory / analytics dashboards and forecast'
+    )
+    job_scheduler.register(
+        'analyze', analyze_database, interval=24 * 3600, initial_delay=300,
+        description='Refresh query planner statistics'
+    )
+    job_scheduler.register(
+        'prune-temp-exports', prune_temp_exports, interval=3600, initial_delay=60,
+        description='Delete leftover export and template temp files'
+    )
+    job_scheduler.register(
+        'expire-import-jobs', expire_import_jobs, interval=60, initial_delay=30,
+        description='Fail import jobs whose worker stopped and delete old finished jobs'
+    )
+    job_scheduler.register(
+        'prune-usage-changes', prune_usage_changes, interval=3600, initial_delay=120,
+        description='Delete usage change log entries the analytics caches no longer need'
+    )
+    job_scheduler.on_finish(record_job_status)
+
+
+def start_scheduler(app) -> bool:
+    """Start the shared scheduler for *app* if SCHEDULER_ENABLED (once per process)"""
+    if not app.config.get('SCHEDULER_ENABLED', False) or scheduler.running:
+        return False
+
+    if not scheduler.jobs:
+        register_default_jobs(scheduler)
+    return scheduler.start(
+        app,
+        lock_path=app.config['SCHEDULER_LOCK_FILE'],
+        max_workers=app.config.get('SCHEDULER_WORKERS', 2)
+    )
@@ -0,0 +1,172 @@
+"""
+Additive schema migrations for existing databases
+
+Tables are created with db.create_all(), which never alters a table that already
+exists.  Columns added to existing models are listed in ADDED_COLUMNS so that
+databases created by older versions get them (plus any missing indexes), and
+each column names the backfill that must run once after it is added.
+Derived tables whose primary key gained a column are listed in REKEYED_TABLES:
+a key column cannot be added in place, so the old table is dropped, created
+again and rebuilt by its backfills.
+"""
+
+import logging
+from typing import Callable, Dict, List
+
+from sqlalchemy import inspect, text
+
+from models import db, UsageRecord
+
+logger = logging.getLogger(__name__)
+
+# (table, column, backfill name)
+ADDED_COLUMNS = [
+    ('storage', 'initial_quantity', 'storage-quantities'),
+    ('storage', 'initial_unit', 'storage-quantities'),
+    ('storage', 'stock_ratio', 'storage-quantities'),
+    ('storage', 'last_used_at', 'storage-last-used'),
+    ('storage', 'base_quantity', 'storage-quantities'),
+    ('storage', 'base_dimension', 'storage-quantities'),
+    # Backfilled before the rollup, stats and sketches, which are rebuilt from these columns
+    ('usage_records', 'base_quantity', 'usage-base-quantities'),
+    ('usage_records', 'base_dimension', 'usage-base-quantities'),
+    ('usage_daily_sketches', 'distinct_registers', 'usage-sketches'),
+    ('usage_daily_rollup', 'total_base_quantity', 'usage-rollup'),
+    ('storage_usage_stats', 'total_base_quantity', 'storage-usage-stats'),
+    ('usage_records', 'row_hash', 'usage-row-hashes'),
+]
+
+# (table, key column, backfill names); the sketches are keyed by the same product names as the rollup
+REKEYED_TABLES = [
+    ('usage_daily_rollup', '产品名', ['usage-rollup', 'usage-sketches']),
+]
+
+
+def _backfill_storage_quantities() -> int:
+    from services.storage_service import StorageService
+    return StorageService.backfill_quantity_fields()
+
+
+def _backfill_storage_last_used() -> int:
+    from services.storage_service import StorageService
+    return StorageService.backfill_last_used()
+
+
+def _backfill_usage_base_quantities() -> int:
+    from services.storage_service import StorageService
+    return StorageService.backfill_usage_base_quantities()
+
+
+def _backfill_usage_row_hashes() -> int:
+    from services.usage_import import UsageImportService
+    return UsageImportService.backfill_row_hashes()
+
+
+def _backfill_usage_rollup() -> int:
+    from services.usage_rollup import UsageRollupService
+    return UsageRollupService.rebuild()
+
+
+def _backfill_storage_usage_stats() -> int:
+    from services.usage_stats import UsageStatsService
+    return UsageStatsService.rebuild()
+
+
+def _backfill_usage_sketches() -> int:
+    from services.usage_sketches import UsageSketchService
+    return UsageSketchService.rebuild()
+
+
+BACKFILLS: Dict[str, Callable[[], int]] = {
+    'storage-quantities': _backfill_storage_quantities,
+    'storage-last-used': _backfill_storage_last_used,
+    'usage-base-quantities': _backfill_usage_base_quantities,
+    'usage-row-hashes': _backfill_usage_row_hashes,
+    'usage-rollup': _backfill_usage_rollup,
+    'storage-usage-stats': _backfill_storage_usage_stats,
+    'usage-sketches': _backfill_usage_sketches,
+}
+
+# Tables derived from storage-linked usage records: (table, backfill name).
+# An empty table next to linked usage records means it was added after the data.
+DERIVED_TABLES = [
+    ('usage_daily_rollup', 'usage-rollup'),
+    ('storage_usage_stats', 'storage-usage-stats'),
+    ('usage_daily_sketches', 'usage-sketches'),
+]
+
+
+def upgrade_schema() -> List[str]:
+    """Add missing columns and indexes, and recreate derived tables with an outdated key.
+
+    Returns:
+        list: Names of the backfills required by the columns that were added
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    metadata = db.Model.metadata
+
+    required_backfills = []
+    existing_columns = {}
+
+    with engine.begin() as connection:
+        for table_name, column_name, backfill in ADDED_COLUMNS:
+            if table_name not in existing_columns:
+                existing_columns[table_name] = {c['name'] for c in inspector.get_columns(table_name)}
+            if column_name in existing_columns[table_name]:
+                continue
+
+            column = metadata.tables[table_name].c[column_name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {preparer.quote(table_name)} "
+                f"ADD COLUMN {preparer.quote(column_name)} {column_type}"
+            ))
+            existing_columns[table_name].add(column_name)
+            logger.info(f"Added column {table_name}.{column_name}")
+
+            if backfill not in required_backfills:
+                required_backfills.append(backfill)
+
+    # Rebuilt after the column backfills above, which they may read
+    for table_name, column_name, backfills in REKEYED_TABLES:
+        if column_name in {c['name'] for c in inspector.get_columns(table_name)}:
+            continue
+        table = metadata.tables[table_name]
+        table.drop(bind=engine)
+        table.create(bind=engine)
+        logger.info(f"Recreated {table_name} with key column {column_name}")
+        for backfill in backfills:
+            if backfill in required_backfills:
+                required_backfills.remove(backfill)
+            required_backfills.append(backfill)
+
+    # create_all() skips indexes of tables that already exist
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    return required_backfills
+
+
+def empty_derived_tables() -> List[str]:
+    """Backfill names of derived tables that are empty although linked usage records exist"""
+    has_usage = db.session.query(UsageRecord.id).filter(UsageRecord.storage_id.isnot(None)).first() is not None
+    if not has_usage:
+        return []
+    
+    metadata = db.Model.metadata
+    return [
+        backfill for table_name, backfill in DERIVED_TABLES
+        if db.session.execute(metadata.tables[table_name].select().limit(1)).first() is None
+    ]
+
+
+def run_backfill(name: str) -> int:
+    """Run a named backfill and return the number of rows it wrote"""
+    if name not in BACKFILLS:
+        raise ValueError(f"Unknown backfill: {name}")
+    row_count = BACKFILLS[name]()
+    logger.info(f"Backfill {name} completed ({row_count} rows)")
+    return row_count
@@ -2,12 +2,17 @@ import pandas as pd
 import os
 import re
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple
 from werkzeug.utils import secure_filename
 import logging
 
+from sqlalchemy import or_
+
 from models import Storage, db
 from services.storage_service import StorageService
+from utils.sheet_pool import map_sheets
+from utils.table_reader import DEFAULT_CHUNK_SIZE, frame_records, iter_frames, read_heads, sheet_names
+from utils.xlsx_writer import write_xlsx
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +29,19 @@ class StorageExcelProcessor:
         '存放地': ['存放地', 'Storage Location', 'location', '位置', '存储位置'],
         'CAS号': ['CAS号', 'CAS Number', 'cas', 'cas_number', 'CAS']
     }
-    
+
+    # Columns a file (or each imported worksheet) must have
+    REQUIRED_COLUMNS = ['类型', '产品名', '数量及数量单位', '存放地']
+
+    # Suffixed duplicate names: base（库存N） -> (base, N)
+    SUFFIX_PATTERN = re.compile(r'^(.*)（库存(\d+)）$', re.DOTALL)
+
+    # Exported columns, in sheet order
+    EXPORT_COLUMNS = ['类型', '产品名', '品牌', '数量及数量单位', '存放地', 'CAS号', '当前库存量', '创建时间', '更新时间']
+
+    # Storage attributes read by export_storage_excel
+    EXPORT_FIELDS = ['类型', '产品名', '品牌', '数量及数量单位', '存放地', 'CAS号', '当前库存量', '单位', '创建时间', '更新时间']
+
     @staticmethod
     def normalize_column_name(column_name: str, mappings: Dict[str, List[str]]) -> str:
         """Normalize column names to standard field names"""
@@ -37,113 +54,173 @@ class StorageExcelProcessor:
         return column_name
     
     @staticmethod
-    def import_storage_excel(file_path: str) -> Dict[str, Any]:
-        """Import storage data from Excel file"""
-        try:
-            # Read Excel file
-            df = pd.read_excel(file_path, engine='openpyxl')
-            
-            # Normalize column names
-            normalized_columns = {}
-            for col in df.columns:
-                normalized_name = StorageExcelProcessor.normalize_column_name(
-                    col, StorageExcelProcessor.STORAGE_COLUMN_MAPPINGS
-                )
-                normalized_columns[col] = normalized_name
-            
-            df = df.rename(columns=normalized_columns)
-            
-            # Expected columns
-            required_columns = ['类型', '产品名', '数量及数量单位', '存放地']
-            optional_columns = ['品牌', 'CAS号']
-            
-            # Validate required columns
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                return {
-                    'success': False,
-                    'error': f"Missing required columns: {missing_columns}",
-                    'success_count': 0,
-                    'error_count': 0,
-                    'errors': []
+    def parse_frame(df: pd.DataFrame, first_row: int, sheet: Optional[str] = None
+                    ) -> Tuple[List[Tuple[tuple, Dict[str, Any]]], List[str]]:
+        """Validate one chunk with normalized columns whose first data row is file row *first_row*.
+
+        Returns the valid rows as ((CAS号, 存放地, 产品名) group key, row data)
+        and the row errors, which name the worksheet when *sheet* is given.
+        """
+        label = f"Sheet '{sheet}', row" if sheet is not None else "Row"
+        # Index rows by their row number in the file and skip blank rows
+        df.index = range(first_row, first_row + len(df))
+        df = df.dropna(how='all')
+
+        rows = []
+        errors = []
+        for index, row in zip(df.index, frame_records(df)):
+            try:
+                # Validate and clean data
+                storage_data = {
+                    '类型': str(row['类型']).strip(),
+                    '产品名': str(row['产品名']).strip(),
+                    '数量及数量单位': str(row['数量及数量单位']).strip(),
+                    '存放地': str(row['存放地']).strip(),
                 }
-            
+                
+                # Handle optional brand
+                if '品牌' in df.columns and pd.notna(row['品牌']):
+                    storage_data['品牌'] = str(row['品牌']).strip()
+                else:
+                    storage_data['品牌'] = None
+                
+                # Handle optional CAS number
+                if 'CAS号' in df.columns and pd.notna(row['CAS号']):
+                    storage_data['CAS号'] = str(row['CAS号']).strip()
+                else:
+                    storage_data['CAS号'] = None
+                
+                # Validate required fields are not empty
+                for field, value in storage_data.items():
+                    if field not in ['品牌', 'CAS号'] and (not value or value == 'nan'):
+                        raise ValueError(f"Required field '{field}' is empty")
+                
+                # Validate quantity format and parse (store parsed for later)
+                try:
+                    qty, unit = StorageService.parse_quantity(storage_data['数量及数量单位'])
+                except ValueError as e:
+                    raise ValueError(f"Invalid quantity format: {e}")
+
+                cas_key = storage_data.get('CAS号') or ''
+                key = (cas_key, storage_data['存放地'], storage_data['产品名'])
+                rows.append((key, {**storage_data, 'parsed_qty': qty, 'parsed_unit': unit}))
+                
+            except Exception as e:
+                errors.append(f"{label} {index}: {str(e)}")
+        return rows, errors
+
+    @staticmethod
+    def iter_sheet_chunks(file_path: str, sheet: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+                          ) -> Iterator[Dict[str, Any]]:
+        """Yield the parsed chunks of one worksheet (the first one when *sheet* is None).
+
+        Each chunk is a dict with sheet, rows and errors (see parse_frame),
+        row_count (file rows read) and missing_columns.  A sheet without the
+        required columns yields one chunk listing them and stops.
+        """
+        first_row = 2  # row 1 is the header
+        for df in iter_frames(file_path, chunk_size, sheet):
+            row_count = len(df)
+            df = df.rename(columns={
+                col: StorageExcelProcessor.normalize_column_name(col, StorageExcelProcessor.STORAGE_COLUMN_MAPPINGS)
+                for col in df.columns
+            })
+            missing_columns = [col for col in StorageExcelProcessor.REQUIRED_COLUMNS if col not in df.columns]
+            if missing_columns:
+                yield {'sheet': sheet, 'rows': [], 'errors': [], 'row_count': 0, 'missing_columns': missing_columns}
+                return
+            rows, errors = StorageExcelProcessor.parse_frame(df, first_row, sheet)
+            first_row += row_count
+            yield {'sheet': sheet, 'rows': rows, 'errors': errors, 'row_count': row_count, 'missing_columns': []}
+
+    @staticmethod
+    def import_storage_excel(file_path: str, progress: Optional[Callable[[int], None]] = None,
+                             should_cancel: Optional[Callable[[], bool]] = None,
+                             processes: int = 1) -> Dict[str, Any]:
+        """Import storage data from Excel file.
+
+        Every worksheet of a workbook is imported; sheets without the required
+        columns are skipped with an error.  With *processes* > 1 the sheets are
+        parsed in parallel (see utils.sheet_pool) and merged in workbook
+        order, so all items are still written in one transaction.
+
+        *progress(rows read)* is called after every chunk.
+        If *should_cancel()* returns True between chunks or groups, the import
+        stops and the result has 'cancelled' set; items created so far are kept.
+        """
+        try:
             storage_items = []
             errors = []
             created_count = 0
             updated_count = 0
+            cancelled = False
 
-            # Step 1: group rows by (CAS号, 存放地, 产品名)
+            # Step 1: group rows by (CAS号, 存放地, 产品名), reading the file in chunks
             groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            sheets = sheet_names(file_path)
+            multi_sheet = len(sheets) > 1
+            if multi_sheet and processes > 1:
+                chunks = map_sheets(
+                    StorageExcelProcessor.iter_sheet_chunks, file_path, sheets, processes, DEFAULT_CHUNK_SIZE
+                )
+            else:
+                chunks = (
+                    chunk
+                    for sheet in (sheets if multi_sheet else [None])
+                    for chunk in StorageExcelProcessor.iter_sheet_chunks(file_path, sheet, DEFAULT_CHUNK_SIZE)
+                )
 
-            for index, row in df.iterrows():
-                try:
-                    # Validate and clean data
-                    storage_data = {
-                        '类型': str(row['类型']).strip(),
-                        '产品名': str(row['产品名']).strip(),
-                        '数量及数量单位': str(row['数量及数量单位']).strip(),
-                        '存放地': str(row['存放地']).strip(),
-                    }
-                    
-                    # Handle optional brand
-                    if '品牌' in df.columns and pd.notna(row['品牌']):
-                        storage_data['品牌'] = str(row['品牌']).strip()
-                    else:
-                        storage_data['品牌'] = None
-                    
-                    # Handle optional CAS number
-                    if 'CAS号' in df.columns and pd.notna(row['CAS号']):
-                        storage_data['CAS号'] = str(row['CAS号']).strip()
-                    else:
-                        storage_data['CAS号'] = None
-                    
-                    # Validate required fields are not empty
-                    for field, value in storage_data.items():
-                        if field not in ['品牌', 'CAS号'] and (not value or value == 'nan'):
-                            raise ValueError(f"Required field '{field}' is empty")
-                    
-                    # Validate quantity format and parse (store parsed for later)
-                    try:
-                        qty, unit = StorageService.parse_quantity(storage_data['数量及数量单位'])
-                    except ValueError as e:
-                        raise ValueError(f"Invalid quantity format: {e}")
-
-                    cas_key = storage_data.get('CAS号') or ''
-                    key = (cas_key, storage_data['存放地'], storage_data['产品名'])
-
-                    enriched = {**storage_data, 'parsed_qty': qty, 'parsed_unit': unit}
-                    groups.setdefault(key, []).append(enriched)
-                    
-                except Exception as e:
-                    errors.append(f"Row {index + 2}: {str(e)}")
+            rows_read = 0
+            skipped_sheets = []
+            try:
+                for chunk in chunks:
+                    if chunk['missing_columns']:
+                        if not multi_sheet:
+                            return StorageExcelProcessor._failed(f"Missing required columns: {chunk['missing_columns']}")
+                        skipped_sheets.append(chunk['sheet'])
+                        errors.append(f"Sheet '{chunk['sheet']}': missing required columns "
+                                      f"{chunk['missing_columns']}; sheet skipped")
+                        continue
+                    for key, row_data in chunk['rows']:
+                        groups.setdefault(key, []).append(row_data)
+                    errors.extend(chunk['errors'])
+                    rows_read += chunk['row_count']
 
-            # Step 2: for each group, ensure sequential naming and create items
-            for (cas_value, location, base_name), rows in groups.items():
-                try:
-                    # Find existing items in this group (CAS + location) whose name is base or base（库存N）
-                    query = Storage.query.filter(
-                        Storage.存放地 == location
-                    )
-                    if cas_value:
-                        query = query.filter(Storage.CAS号 == cas_value)
-                    else:
-                        query = query.filter(Storage.CAS号.is_(None))
+                    if progress is not None:
+                        progress(rows_read)
+                    if should_cancel is not None and should_cancel():
+                        cancelled = True
+                        break
+            finally:
+                # Stops the sheet pool when the loop ends early
+                chunks.close()
+            if multi_sheet and len(skipped_sheets) == len(sheets):
+                return StorageExcelProcessor._failed(
+                    f"No worksheet has the required columns {StorageExcelProcessor.REQUIRED_COLUMNS}", errors
+                )
 
-                    candidates: List[Storage] = query.all()
+            # Step 2: one query for every existing item that can share a group with the file's rows
+            candidates = StorageExcelProcessor._prefetch_candidates(groups)
 
-                    # Match by name pattern
-                    suffix_pattern = re.compile(rf'^{re.escape(base_name)}（库存(\d+)）$')
+            # Step 3: for each group, ensure sequential naming in memory; nothing is written yet
+            for (cas_value, location, base_name), rows in groups.items():
+                if cancelled or (should_cancel is not None and should_cancel()):
+                    cancelled = True
+                    break
+                # Items in this group's CAS + location, including ones added earlier in this import
+                group_items = candidates.setdefault((cas_value or None, location), [])
+                try:
+                    # Match by name pattern: base or base（库存N）
                     existing_indices = []
                     base_plain_item = None
-                    for item in candidates:
+                    for item in group_items:
                         if item.产品名 == base_name:
                             base_plain_item = item
                         else:
-                            m = suffix_pattern.match(item.产品名 or '')
-                            if m:
+                            m = StorageExcelProcessor.SUFFIX_PATTERN.match(item.产品名 or '')
+                            if m and m.group(1) == base_name:
                                 try:
-                                    existing_indices.append(int(m.group(1)))
+                                    existing_indices.append(int(m.group(2)))
                                 except ValueError:
                                     pass
 
@@ -158,53 +235,49 @@ class StorageExcelProcessor:
                         base_plain_item.产品名 = f"{base_name}（库存{max_index}）"
                         base_plain_item.更新时间 = datetime.utcnow()
                         updated_count += 1
-                        try:
-                            db.session.commit()
-                        except Exception:
-                            db.session.rollback()
-                            raise
-
-                    if should_suffix:
-                        current_index = max_index
-                        for row_data in rows:
+
+                    current_index = max_index
+                    for row_data in rows:
+                        if should_suffix:
                             current_index += 1
-                            new_name = f"{base_name}（库存{current_index}）"
-                            create_payload = {
-                                '类型': row_data['类型'],
-                                '产品名': new_name,
-                                '品牌': row_data.get('品牌'),
-                                '数量及数量单位': f"{row_data['parsed_qty']}{row_data['parsed_unit']}",
-                                '存放地': row_data['存放地'],
-                                'CAS号': row_data.get('CAS号')
-                            }
-                            created = StorageService.create_storage_item_with_units(create_payload)
-                            storage_items.append(created)
-                            created_count += 1
-                    else:
-                        # No existing duplicates and single row: keep original name without suffix
-                        row_data = rows[0]
+                            name = f"{base_name}（库存{current_index}）"
+                        else:
+                            # No existing duplicates and single row: keep original name without suffix
+                            name = base_name
                         create_payload = {
                             '类型': row_data['类型'],
-                            '产品名': base_name,
+                            '产品名': name,
                             '品牌': row_data.get('品牌'),
                             '数量及数量单位': f"{row_data['parsed_qty']}{row_data['parsed_unit']}",
                             '存放地': row_data['存放地'],
                             'CAS号': row_data.get('CAS号')
                         }
-                        created = StorageService.create_storage_item_with_units(create_payload)
+                        created = StorageService.build_storage_item_with_units(create_payload)
+                        group_items.append(created)
                         storage_items.append(created)
                         created_count += 1
                 except Exception as e:
                     errors.append(str(e))
 
+            # Step 4: write all renames and new items in one transaction (inserts are batched by the flush)
+            try:
+                db.session.add_all(storage_items)
+                db.session.flush()
+                created_items = [item.to_dict() for item in storage_items]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
             return {
                 'success': True,
+                'cancelled': cancelled,
                 'created_count': created_count,
                 'updated_count': updated_count,
                 'success_count': created_count + updated_count,
                 'error_count': len(errors),
                 'errors': errors,
-                'storage_items': [item.to_dict() for item in storage_items]
+                'storage_items': created_items
             }
             
         except Exception as e:
@@ -218,46 +291,57 @@ class StorageExcelProcessor:
             }
     
     @staticmethod
-    def export_storage_excel(storage_items: List[Storage], file_path: str) -> str:
-        """Export storage data to Excel file"""
+    def _failed(error: str, errors: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Result of an import that wrote nothing"""
+        return {
+            'success': False,
+            'error': error,
+            'success_count': 0,
+            'error_count': 0,
+            'errors': errors or []
+        }
+
+    @staticmethod
+    def _prefetch_candidates(groups: Dict[tuple, List[Dict[str, Any]]]) -> Dict[tuple, List[Storage]]:
+        """Existing items by (CAS号 or None, 存放地) for the groups' locations and CAS numbers, in id order"""
+        candidates: Dict[tuple, List[Storage]] = {}
+        if not groups:
+            return candidates
+
+        locations = sorted({location for _, location, _ in groups})
+        cas_values = sorted({cas_value for cas_value, _, _ in groups if cas_value})
+        cas_filter = Storage.CAS号.in_(cas_values)
+        if any(not cas_value for cas_value, _, _ in groups):
+            cas_filter = or_(cas_filter, Storage.CAS号.is_(None))
+
+        items = Storage.query.filter(Storage.存放地.in_(locations), cas_filter).order_by(Storage.id).all()
+        for item in items:
+            candidates.setdefault((item.CAS号, item.存放地), []).append(item)
+        return candidates
+
+    @staticmethod
+    def export_storage_excel(storage_items: Iterable[Any], file_path: str) -> str:
+        """Stream storage items (ORM objects or rows with the same attribute names) to an Excel file"""
         try:
-            data = []
-            for item in storage_items:
-                data.append({
-                    '类型': item.类型,
-                    '产品名': item.产品名,
-                    '品牌': item.品牌 or '',
-                    '数量及数量单位': item.数量及数量单位,
-                    '存放地': item.存放地,
-                    'CAS号': item.CAS号 or '',
-                    '当前库存量': f"{item.当前库存量}{item.单位}" if item.单位 else str(item.当前库存量),
-                    '创建时间': item.创建时间.strftime('%Y-%m-%d %H:%M:%S') if item.创建时间 else '',
-                    '更新时间': item.更新时间.strftime('%Y-%m-%d %H:%M:%S') if item.更新时间 else ''
-                })
-            
-            df = pd.DataFrame(data)
+            rows = (
+                [
+                    item.类型,
+                    item.产品名,
+                    item.品牌 or '',
+                    item.数量及数量单位,
+                    item.存放地,
+                    item.CAS号 or '',
+                    f"{item.当前库存量}{item.单位}" if item.单位 else str(item.当前库存量),
+                    item.创建时间.strftime('%Y-%m-%d %H:%M:%S') if item.创建时间 else '',
+                    item.更新时间.strftime('%Y-%m-%d %H:%M:%S') if item.更新时间 else ''
+                ]
+                for item in storage_items
+            )
             
             # Ensure directory exists
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
-            # Export to Excel
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Storage Inventory', index=False)
-                
-                # Auto-adjust column widths
-                worksheet = writer.sheets['Storage Inventory']
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-            
+            write_xlsx(file_path, 'Storage Inventory', StorageExcelProcessor.EXPORT_COLUMNS, rows)
             return file_path
             
         except Exception as e:
@@ -335,35 +419,63 @@ class StorageExcelProcessor:
             raise
     
     @staticmethod
-    def validate_storage_file(file_path: str) -> Dict[str, Any]:
-        """Validate storage Excel file before import"""
+    def validate_storage_file(file_path: str, nrows: int = 5) -> Dict[str, Any]:
+        """Check the columns of a storage file and preview its first *nrows* rows.
+
+        Only the header and those rows of each worksheet are read; row_count
+        is the read_head estimate summed over the sheets the import reads, and
+        the rows themselves are validated by the import.  Like the import, a
+        workbook with several sheets skips those without the required columns
+        and is valid if any sheet has them; the preview comes from the first.
+        """
         try:
-            df = pd.read_excel(file_path, engine='openpyxl')
+            heads = read_heads(file_path, nrows)
             
-            # Normalize column names
-            normalized_columns = {}
-            for col in df.columns:
-                normalized_name = StorageExcelProcessor.normalize_column_name(
-                    col, StorageExcelProcessor.STORAGE_COLUMN_MAPPINGS
-                )
-                normalized_columns[col] = normalized_name
-            
-            df = df.rename(columns=normalized_columns)
+            sheets = []
+            for name, df, row_count in heads:
+                # Normalize column names
+                normalized_columns = {}
+                for col in df.columns:
+                    normalized_name = StorageExcelProcessor.normalize_column_name(
+                        col, StorageExcelProcessor.STORAGE_COLUMN_MAPPINGS
+                    )
+                    normalized_columns[col] = normalized_name
+                missing_columns = [
+                    col for col in StorageExcelProcessor.REQUIRED_COLUMNS if col not in normalized_columns.values()
+                ]
+                sheets.append((name, df.rename(columns=normalized_columns), normalized_columns, missing_columns,
+                               row_count))
+            sheet_summaries = [
+                {'name': name, 'missing_columns': missing_columns, 'row_count': row_count}
+                for name, _, _, missing_columns, row_count in sheets
+            ]
             
-            required_columns = ['类型', '产品名', '数量及数量单位', '存放地']
-            missing_columns = [col for col in required_columns if col not in df.columns]
+            imported = [sheet for sheet in sheets if not sheet[3]]
+            name, df, normalized_columns, missing_columns, _ = (imported or sheets)[0]
+            column_mapping = {
+                str(original): (column if column in StorageExcelProcessor.STORAGE_COLUMN_MAPPINGS else None)
+                for original, column in normalized_columns.items()
+            }
             
-            if missing_columns:
+            if not imported:
+                if len(sheets) > 1:
+                    error = '; '.join(
+                        f"Sheet '{sheet_name}': missing required columns {sheet_missing}"
+                        for sheet_name, _, _, sheet_missing, _ in sheets
+                    )
+                else:
+                    error = f"Missing required columns: {missing_columns}"
                 return {
                     'valid': False,
-                    'error': f"Missing required columns: {missing_columns}",
+                    'error': error,
                     'row_count': 0,
-                    'preview_data': []
+                    'preview_data': [],
+                    'column_mapping': column_mapping,
+                    'sheets': sheet_summaries
                 }
             
-            # Preview first 5 rows
             preview_data = []
-            for index, row in df.head(5).iterrows():
+            for index, row in df.iterrows():
                 preview_data.append({
                     '类型': str(row.get('类型', '')),
                     '产品名': str(row.get('产品名', '')),
@@ -373,11 +485,14 @@ class StorageExcelProcessor:
                     'CAS号': str(row.get('CAS号', '')) if pd.notna(row.get('CAS号')) else ''
                 })
             
+            row_counts = [sheet[4] for sheet in imported]
             return {
                 'valid': True,
-                'row_count': len(df),
+                'row_count': None if None in row_counts else sum(row_counts),
                 'preview_data': preview_data,
-                'columns': list(df.columns)
+                'columns': list(df.columns),
+                'column_mapping': column_mapping,
+                'sheets': sheet_summaries
             }
             
         except Exception as e:
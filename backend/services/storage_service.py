@@ -1,8 +1,18 @@
-import re
-from datetime import datetime
-from typing import Dict, Any, Tuple, Optional
-from models import db, Storage, UsageRecord
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Tuple, Optional
+from sqlalchemy import bindparam, func, select, union_all, literal, null, Integer, String
+from sqlalchemy.orm.attributes import flag_modified
+from models import db, Storage, UsageRecord, UsageDailyRollup
+from services.usage_change_log import UsageChangeLog
+from services.usage_rollup import UsageRollupService
+from services.usage_stats import UsageStatsService
+from services.usage_sketches import UsageSketchService
 from utils.number_utils import NumberUtils
+from utils.units import unit_info
+
+# Storage columns written by StorageService.add_usage_rows
+USAGE_ROW_COLUMNS = ['当前库存量', '更新时间', 'last_used_at', 'initial_quantity', 'initial_unit',
+                     'stock_ratio', 'base_quantity', 'base_dimension']
 
 
 class StorageService:
@@ -39,6 +49,7 @@ class StorageService:
     def update_storage_item(storage_id: int, data: Dict[str, Any]) -> Storage:
         """Update existing storage item with validation"""
         storage_item = Storage.query.get_or_404(storage_id)
+        previous_unit = storage_item.单位
         
         # Update fields only if provided
         updated_fields = []
@@ -86,6 +97,10 @@ class StorageService:
             raise ValueError('No valid fields provided for update')
         
         storage_item.更新时间 = datetime.utcnow()
+        if storage_item.单位 != previous_unit:
+            # Past usage totals are kept in the item's unit and base dimension
+            UsageRollupService.rebuild_buckets(storage_id)
+            UsageStatsService.refresh_totals(storage_id)
         db.session.commit()
         return storage_item
     
@@ -155,6 +170,7 @@ class StorageService:
         storage_item.更新时间 = datetime.utcnow()
         
         db.session.add(usage_record)
+        StorageService._usage_added(storage_item, usage_record)
         db.session.commit()
         
         return usage_record, storage_item
@@ -206,6 +222,7 @@ class StorageService:
         storage_item.更新时间 = datetime.utcnow()
         
         db.session.add(usage_record)
+        StorageService._usage_added(storage_item, usage_record)
         db.session.commit()
         
         logger.info(f"Successfully recorded usage: {usage_amount} {storage_item.单位}, remaining: {new_remaining} {storage_item.单位}")
@@ -237,6 +254,9 @@ class StorageService:
             else:
                 raise ValueError("Invalid date format")
         
+        # Move the record's contribution out of its old rollup bucket
+        StorageService._usage_removed(storage_item, usage_record)
+        
         # Update usage record
         usage_record.使用人 = usage_data.get('使用人', usage_record.使用人)
         usage_record.使用日期 = usage_date
@@ -250,9 +270,125 @@ class StorageService:
         storage_item.更新时间 = datetime.utcnow()
         usage_record.更新时间 = datetime.utcnow()
         
+        StorageService._usage_added(storage_item, usage_record)
         db.session.commit()
         return usage_record, storage_item
     
+    @staticmethod
+    def _usage_added(storage_item: Storage, usage_record: UsageRecord) -> None:
+        """Update data derived from usage records after a record was added to *storage_item*"""
+        UsageRollupService.add_record(usage_record, storage_item)
+        UsageStatsService.add_record(usage_record, storage_item)
+        UsageSketchService.add_record(usage_record)
+        
+        usage_date = usage_record.使用日期
+        if usage_date and (storage_item.last_used_at is None or usage_date > storage_item.last_used_at):
+            storage_item.last_used_at = usage_date
+        elif usage_date and StorageService._may_be_unused(storage_item, usage_date):
+            # The rollup already includes this record
+            storage_item.last_used_at = db.session.query(
+                func.max(UsageDailyRollup.day)
+            ).filter(UsageDailyRollup.storage_id == storage_item.id).scalar()
+    
+    @staticmethod
+    def _usage_removed(storage_item: Storage, usage_record: UsageRecord) -> None:
+        """Update data derived from usage records before a record is removed from *storage_item*"""
+        UsageRollupService.remove_record(usage_record, storage_item)
+        UsageStatsService.remove_record(usage_record, storage_item)
+        UsageSketchService.remove_record(usage_record)
+        
+        # Only removing the latest usage can move last_used_at back (to the creation date once none is left)
+        last_used_at = storage_item.last_used_at
+        if last_used_at is None or (usage_record.使用日期 and usage_record.使用日期 >= last_used_at):
+            storage_item.last_used_at = db.session.query(
+                func.max(UsageDailyRollup.day)
+            ).filter(UsageDailyRollup.storage_id == storage_item.id).scalar() or storage_item.created_on()
+    
+    @staticmethod
+    def _may_be_unused(storage_item: Storage, usage_date) -> bool:
+        """Whether usage on *usage_date* can move last_used_at back: it may still be the creation date of a never-used item"""
+        return usage_date < storage_item.last_used_at and storage_item.last_used_at == storage_item.created_on()
+    
+    @staticmethod
+    def add_usage_rows(rows: Iterable[Dict[str, Any]], issues: Optional[Dict[int, Dict[str, Any]]] = None) -> None:
+        """Deduct stock and update derived data for many inserted usage rows (see UsageImportService.to_row).
+
+        Usage is totalled per storage item and converted to the item's unit;
+        all items change in one flush.  Stock is not deducted for usage in a
+        unit of another dimension, nor is it counted in the usage totals, and
+        stock never goes below zero.  Both are accumulated per item in *issues*
+        (see usage_issue_messages).
+        """
+        rows = [row for row in rows if row.get('storage_id')]
+        if not rows:
+            return
+        issues = {} if issues is None else issues
+        items = {item.id: item for item in Storage.query.filter(Storage.id.in_({row['storage_id'] for row in rows}))}
+
+        # (usage in the item's unit, base quantity) per row, None when not convertible
+        quantities = [UsageRollupService.row_quantities(row, items[row['storage_id']].单位) for row in rows]
+        usage: Dict[int, float] = {}
+        last_used: Dict[int, Any] = {}
+        for row, row_quantities in zip(rows, quantities):
+            storage_id = row['storage_id']
+            item = items[storage_id]
+            if row_quantities is None:
+                issue = issues.setdefault(storage_id, {'产品名': item.产品名, '单位': item.单位, 'shortfall': 0.0, 'units': set()})
+                issue['units'].add(str(row['单位'] or row['数量及数量单位']))
+            else:
+                usage[storage_id] = NumberUtils.safe_add(usage.get(storage_id, 0.0), row_quantities[0])
+            day = row.get('使用日期')
+            if day and (storage_id not in last_used or day > last_used[storage_id]):
+                last_used[storage_id] = day
+
+        now = datetime.utcnow()
+        for storage_id, item in items.items():
+            if storage_id in usage:
+                remaining = NumberUtils.safe_subtract(item.当前库存量 or 0.0, usage[storage_id])
+                if remaining < 0:
+                    issue = issues.setdefault(storage_id, {'产品名': item.产品名, '单位': item.单位, 'shortfall': 0.0, 'units': set()})
+                    issue['shortfall'] = NumberUtils.safe_add(issue['shortfall'], -remaining)
+                    remaining = 0.0
+                item.当前库存量 = remaining
+            day = last_used.get(storage_id)
+            if day and (item.last_used_at is None or day > item.last_used_at):
+                item.last_used_at = day
+            item.更新时间 = now
+            # Same column list for every item, so the flush sends one executemany UPDATE
+            # (the before_update hook refreshes the derived quantity fields)
+            for column in USAGE_ROW_COLUMNS:
+                flag_modified(item, column)
+
+        UsageRollupService.add_rows(rows, quantities)
+        UsageStatsService.add_rows(rows, quantities)
+        UsageSketchService.add_rows(rows)
+
+        # Backdated usage of items whose last_used_at may still be their creation date: re-read
+        # the latest usage from the rollup, which now includes these rows
+        recheck = [
+            storage_id for storage_id, day in last_used.items()
+            if StorageService._may_be_unused(items[storage_id], day)
+        ]
+        if recheck:
+            for storage_id, day in db.session.query(
+                UsageDailyRollup.storage_id, func.max(UsageDailyRollup.day)
+            ).filter(UsageDailyRollup.storage_id.in_(recheck)).group_by(UsageDailyRollup.storage_id):
+                items[storage_id].last_used_at = day
+
+    @staticmethod
+    def usage_issue_messages(issues: Dict[int, Dict[str, Any]]) -> List[str]:
+        """Messages for the stock issues collected by add_usage_rows"""
+        messages = []
+        for storage_id, issue in sorted(issues.items()):
+            if issue['shortfall']:
+                messages.append(f"Storage item {storage_id} ({issue['产品名']}): usage exceeds stock by "
+                                f"{issue['shortfall']}{issue['单位']}; stock set to 0")
+            if issue['units']:
+                messages.append(f"Storage item {storage_id} ({issue['产品名']}): usage in "
+                                f"{', '.join(sorted(issue['units']))} cannot be converted to {issue['单位']}; "
+                                f"stock not deducted and usage totals leave it out")
+        return messages
+    
     @staticmethod
     def delete_usage_record(usage_id: int) -> Storage:
         """Delete usage record and restore inventory with atomic operation"""
@@ -297,6 +433,7 @@ class StorageService:
             storage_item.更新时间 = datetime.utcnow()
             
             # Delete the usage record
+            StorageService._usage_removed(storage_item, usage_record)
             db.session.delete(usage_record)
             
             # Commit transaction
@@ -356,6 +493,9 @@ class StorageService:
                     db.session.delete(record)
                 
                 # Delete storage item
+                UsageRollupService.delete_for_storage(storage_id)
+                UsageStatsService.delete_for_storage(storage_id)
+                UsageSketchService.remove_records(usage_records)
                 db.session.delete(storage_item)
                 db.session.commit()
                 
@@ -464,34 +604,160 @@ class StorageService:
     
     @staticmethod
     def get_low_stock_items(threshold_percentage: float = 10.0) -> list[Storage]:
-        """Get items with low stock"""
-        storage_items = Storage.query.all()
-        low_stock_items = []
+        """Get items with low stock (indexed range scan on the persisted stock ratio)"""
+        # stock_ratio is NULL for items with an invalid quantity format or mismatched units
+        return Storage.query.filter(
+            Storage.stock_ratio <= threshold_percentage / 100.0
+        ).order_by(Storage.id).all()
+    
+    @staticmethod
+    def get_inventory_alerts(threshold_percentage: float = 10.0, days_threshold: int = 90) -> Dict[str, Any]:
+        """Get low stock items and items without usage for *days_threshold* days"""
+        low_stock_items = StorageService.get_low_stock_items(threshold_percentage)
         
-        for item in storage_items:
-            try:
-                original_quantity, unit = StorageService.parse_quantity(item.数量及数量单位)
-                
-                # Only compare if units match
-                if unit == item.单位 and original_quantity > 0:
-                    percentage = (item.当前库存量 / original_quantity) * 100
-                    if percentage <= threshold_percentage:
-                        low_stock_items.append(item)
-            except ValueError:
-                # Skip items with invalid quantity format
-                continue
-                
-        return low_stock_items
+        # Items not used since the cutoff, and never-used items created before it: one index range,
+        # since last_used_at of a never-used item is its creation date
+        cutoff_date = datetime.now().date() - timedelta(days=days_threshold)
+        unused_items = Storage.query.filter(
+            Storage.last_used_at < cutoff_date
+        ).order_by(Storage.last_used_at, Storage.id).all()
+        
+        return {
+            'low_stock': {
+                'count': len(low_stock_items),
+                'items': [item.to_dict() for item in low_stock_items]
+            },
+            'unused_items': {
+                'count': len(unused_items),
+                'items': [item.to_dict() for item in unused_items]
+            }
+        }
+    
+    @staticmethod
+    def backfill_quantity_fields(batch_size: int = 1000) -> int:
+        """Populate initial_quantity, initial_unit, stock_ratio and the base-unit stock for existing rows"""
+        table = Storage.__table__
+        statement = table.update().where(
+            table.c.id == bindparam('b_id')
+        ).values(
+            initial_quantity=bindparam('b_initial_quantity'),
+            initial_unit=bindparam('b_initial_unit'),
+            stock_ratio=bindparam('b_stock_ratio'),
+            base_quantity=bindparam('b_base_quantity'),
+            base_dimension=bindparam('b_base_dimension'),
+            # Keep the original timestamp instead of triggering onupdate
+            更新时间=bindparam('b_updated_at')
+        )
+        
+        updated_count = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                Storage.id, Storage.数量及数量单位, Storage.当前库存量, Storage.单位, Storage.更新时间
+            ).filter(Storage.id > last_id).order_by(Storage.id).limit(batch_size).all()
+            if not rows:
+                break
+            
+            params = []
+            for row in rows:
+                item = Storage(数量及数量单位=row.数量及数量单位, 当前库存量=row.当前库存量, 单位=row.单位)
+                item.sync_quantity_fields()
+                params.append({
+                    'b_id': row.id,
+                    'b_initial_quantity': item.initial_quantity,
+                    'b_initial_unit': item.initial_unit,
+                    'b_stock_ratio': item.stock_ratio,
+                    'b_base_quantity': item.base_quantity,
+                    'b_base_dimension': item.base_dimension,
+                    'b_updated_at': row.更新时间
+                })
+            
+            db.session.execute(statement, params)
+            db.session.commit()
+            updated_count += len(rows)
+            last_id = rows[-1].id
+        
+        return updated_count
+    
+    @staticmethod
+    def backfill_usage_base_quantities() -> int:
+        """Populate base_quantity / base_dimension of usage records, one UPDATE per distinct unit"""
+        from services.data_version import DataVersionService
+        
+        table = UsageRecord.__table__
+        updated_count = 0
+        try:
+            units = db.session.execute(select(table.c.单位).distinct()).scalars().all()
+            for unit in units:
+                if not unit:
+                    continue
+                dimension, factor = unit_info(unit) or (None, None)
+                result = db.session.execute(
+                    # Keep the original timestamp instead of triggering onupdate
+                    table.update().where(table.c.单位 == unit).values(
+                        base_quantity=table.c.使用量 * factor if dimension else None,
+                        base_dimension=dimension,
+                        更新时间=table.c.更新时间
+                    )
+                )
+                updated_count += result.rowcount
+            
+            # Records without 单位 take the unit of 数量及数量单位
+            quantities = db.session.execute(
+                select(table.c.数量及数量单位).where(table.c.单位.is_(None)).distinct()
+            ).scalars().all()
+            for quantity in quantities:
+                record = UsageRecord(数量及数量单位=quantity, 使用量=1.0)
+                factor, dimension = record.base_usage()
+                result = db.session.execute(
+                    table.update().where(
+                        table.c.单位.is_(None), table.c.数量及数量单位 == quantity
+                    ).values(
+                        base_quantity=table.c.使用量 * factor if dimension else None,
+                        base_dimension=dimension,
+                        更新时间=table.c.更新时间
+                    )
+                )
+                updated_count += result.rowcount
+            # Core updates bypass the flush hook; log every record for the columnar cache
+            UsageChangeLog.record_select(select(table.c.id))
+            DataVersionService.bump(['usage_records'])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return updated_count
+    
+    @staticmethod
+    def backfill_last_used() -> int:
+        """Recompute last_used_at for all storage items from usage_records (the creation date if never used)"""
+        from services.data_version import DataVersionService
+        
+        table = Storage.__table__
+        latest_usage = select(
+            func.max(UsageRecord.使用日期)
+        ).where(
+            UsageRecord.storage_id == table.c.id
+        ).scalar_subquery()
+        
+        try:
+            result = db.session.execute(
+                # Keep the original timestamp instead of triggering onupdate
+                table.update().values(
+                    last_used_at=func.coalesce(latest_usage, func.date(table.c.创建时间)), 更新时间=table.c.更新时间
+                )
+            )
+            DataVersionService.bump(['storage'])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result.rowcount
     
     @staticmethod
     def parse_quantity(quantity_str: str) -> Tuple[float, str]:
         """Parse quantity string like '100g', '50ml', '2kg', '10瓶', '5盒'"""
-        match = re.match(r'([0-9.]+)\s*([a-zA-Zμ\u4e00-\u9fa5]+)', quantity_str.strip())
-        if match:
-            quantity = NumberUtils.safe_float(match.group(1))
-            unit = match.group(2)
-            return quantity, unit
-        raise ValueError(f"Invalid quantity format: {quantity_str}")
+        return NumberUtils.parse_quantity(quantity_str)
     
 
 
@@ -535,6 +801,40 @@ class StorageService:
 
         return None
 
+    @staticmethod
+    def storage_lookup() -> Tuple[Dict[tuple, int], Dict[tuple, int]]:
+        """Whole catalogue as (CAS号, 存放地, 类型) -> id and (产品名, 存放地) -> id, read in one query.
+
+        Used to resolve many rows at once with match_storage_id; the lowest id
+        wins when several items share a key.
+        """
+        by_cas: Dict[tuple, int] = {}
+        by_name: Dict[tuple, int] = {}
+        items = db.session.execute(
+            select(Storage.id, Storage.CAS号, Storage.存放地, Storage.类型, Storage.产品名).order_by(Storage.id)
+        )
+        for storage_id, cas_number, location, type_name, name in items:
+            if cas_number:
+                by_cas.setdefault((cas_number, location, type_name), storage_id)
+            by_name.setdefault((name, location), storage_id)
+        return by_cas, by_name
+
+    @staticmethod
+    def match_storage_id(data: Dict[str, Any], lookup: Tuple[Dict[tuple, int], Dict[tuple, int]]) -> Optional[int]:
+        """Storage id for a usage row from storage_lookup(): CAS号 + 存放地 + 类型 first, then 产品名 + 存放地"""
+        by_cas, by_name = lookup
+        # Cells read as numbers compare as text, like the string columns in SQL
+        cas_number, location, type_name, name = (
+            str(value) if value is not None else None
+            for value in (data.get('CAS号'), data.get('存放地'), data.get('类型'), data.get('产品名'))
+        )
+        storage_id = None
+        if cas_number:
+            storage_id = by_cas.get((cas_number, location, type_name))
+        if storage_id is None:
+            storage_id = by_name.get((name, location))
+        return storage_id
+
     @staticmethod
     def add_quantity_to_storage_item(storage_item: Storage, amount: float, unit: str) -> Storage:
         """Add quantity to an existing storage item. Units must match."""
@@ -554,6 +854,14 @@ class StorageService:
     @staticmethod
     def create_storage_item_with_units(data: Dict[str, Any]) -> Storage:
         """Create new storage item maintaining original units"""
+        storage_item = StorageService.build_storage_item_with_units(data)
+        db.session.add(storage_item)
+        db.session.commit()
+        return storage_item
+    
+    @staticmethod
+    def build_storage_item_with_units(data: Dict[str, Any]) -> Storage:
+        """Validate *data* and return a new, unsaved storage item in its original unit"""
         # Validate data first
         validation_error = StorageService.validate_storage_data(data, is_update=False)
         if validation_error:
@@ -574,43 +882,59 @@ class StorageService:
             当前库存量=quantity,  # Keep in original unit
             单位=unit  # Use original unit
         )
-        
-        db.session.add(storage_item)
-        db.session.commit()
         return storage_item
     
     @staticmethod
-    def get_inventory_dashboard_data() -> Dict[str, Any]:
-        """Get inventory dashboard statistics"""
-        total_items = Storage.query.count()
-        low_stock_items = StorageService.get_low_stock_items()
-        low_stock_count = len(low_stock_items)
-        
-        # Get storage locations count
-        storage_locations = db.session.query(Storage.存放地).distinct().count()
-        
-        # Get type distribution
-        type_distribution = db.session.query(
-            Storage.类型, 
-            db.func.count(Storage.id)
-        ).group_by(Storage.类型).all()
-        
-        # Monthly usage from current month
+    def get_inventory_dashboard_data(threshold_percentage: float = 10.0) -> Dict[str, Any]:
+        """Get inventory dashboard statistics.
+
+        Storage totals, location count, monthly usage and the type distribution
+        come from one UNION ALL query; the low stock list is a second, indexed query.
+        """
         current_month = datetime.now().replace(day=1)
-        monthly_usage = db.session.query(
-            db.func.count(UsageRecord.id)
-        ).filter(
+        monthly_usage = select(
+            func.count(UsageRecord.id)
+        ).where(
             UsageRecord.使用日期 >= current_month.date()
-        ).scalar() or 0
+        ).scalar_subquery()
+        
+        statement = union_all(
+            select(
+                literal('totals').label('section'),
+                null().cast(String).label('key'),
+                func.count(Storage.id).label('value'),
+                func.count(func.distinct(Storage.存放地)).label('locations'),
+                monthly_usage.label('monthly_usage')
+            ),
+            select(
+                literal('type'),
+                Storage.类型,
+                func.count(Storage.id),
+                null().cast(Integer),
+                null().cast(Integer)
+            ).group_by(Storage.类型)
+        )
+        
+        total_items = storage_locations = monthly_usage_count = 0
+        type_distribution = []
+        for section, key, value, locations, monthly in db.session.execute(statement):
+            if section == 'totals':
+                total_items = int(value or 0)
+                storage_locations = int(locations or 0)
+                monthly_usage_count = int(monthly or 0)
+            else:
+                type_distribution.append((key, int(value)))
+        
+        low_stock_items = StorageService.get_low_stock_items(threshold_percentage)
         
         return {
             'total_items': total_items,
-            'low_stock_count': low_stock_count,
+            'low_stock_count': len(low_stock_items),
             'storage_locations': storage_locations,
-            'monthly_usage': monthly_usage,
+            'monthly_usage': monthly_usage_count,
             'inventory_by_type': [
                 {'type': type_name, 'count': count} 
-                for type_name, count in type_distribution
+                for type_name, count in sorted(type_distribution, key=lambda x: x[0] or '')
             ],
             'low_stock_items': [item.to_dict() for item in low_stock_items]
         }
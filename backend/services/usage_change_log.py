@@ -0,0 +1,127 @@
+import logging
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, func, inspect, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import db, DataVersion, UsageRecord, UsageRecordChange
+from services.data_version import DataVersionService
+
+logger = logging.getLogger(__name__)
+
+# data_versions row holding the highest pruned change seq
+PRUNED_VERSION = 'usage_record_changes_pruned'
+
+# Database URLs known to have the usage_record_changes table
+_logged_databases: Set[str] = set()
+
+
+class UsageChangeLog:
+    """Service class for the usage_records change sequence.
+
+    Every insert, update or delete of a usage record appends its id to
+    usage_record_changes in the same transaction.  A reader that remembers the
+    last sequence number it has seen can catch up with one primary-key range
+    scan and then re-read only the changed records; a record id that no longer
+    exists means it was deleted.  ORM writes are logged automatically on flush;
+    Core-level bulk writes must call record() or record_select() themselves.
+
+    Changes are logged by every process whenever the table exists, whatever
+    its own ANALYTICS_COLUMNAR_CACHE setting, since the caches of other
+    processes read them.  Before taking sequence numbers a writer bumps the
+    usage_records data version; that row stays locked until it commits, so
+    sequence numbers are handed out in commit order and no change can later
+    appear below a position a reader has already passed.  A scheduled job
+    prunes all but the newest USAGE_CHANGE_LOG_KEEP changes; a reader whose
+    position was pruned away is told to rebuild (see changes_since).
+    """
+
+    @staticmethod
+    def enabled(connection=None) -> bool:
+        """Whether usage changes are logged in this database (the usage_record_changes table exists)"""
+        connection = connection or db.session.connection()
+        database = str(connection.engine.url)
+        if database not in _logged_databases:
+            if not inspect(connection).has_table(UsageRecordChange.__tablename__):
+                return False
+            _logged_databases.add(database)
+        return True
+
+    @staticmethod
+    def record(usage_ids: Iterable[int], connection=None) -> None:
+        """Append changed usage record ids within the current transaction"""
+        connection = connection or db.session.connection()
+        rows = [{'usage_id': usage_id} for usage_id in usage_ids if usage_id is not None]
+        if rows and UsageChangeLog.enabled(connection):
+            DataVersionService.bump(['usage_records'], connection=connection)
+            connection.execute(insert(UsageRecordChange), rows)
+
+    @staticmethod
+    def record_select(usage_ids, connection=None) -> None:
+        """record() for the usage record ids selected by the query *usage_ids*"""
+        connection = connection or db.session.connection()
+        if UsageChangeLog.enabled(connection):
+            DataVersionService.bump(['usage_records'], connection=connection)
+            connection.execute(insert(UsageRecordChange).from_select(['usage_id'], usage_ids))
+
+    @staticmethod
+    def last_seq() -> int:
+        """Current end of the change sequence (0 if empty)"""
+        return db.session.query(func.max(UsageRecordChange.seq)).scalar() or 0
+
+    @staticmethod
+    def changes_since(seq: int) -> Tuple[int, Optional[List[int]]]:
+        """Return (new last seq, distinct usage ids changed after *seq*).
+
+        The ids are None when changes after *seq* have been pruned; the reader
+        must then rebuild from usage_records.
+        """
+        # Sequence numbers can have gaps (rolled back inserts), so pruning is
+        # tracked explicitly rather than inferred from the lowest seq left
+        pruned_seq = DataVersionService.current([PRUNED_VERSION])[0]
+        if pruned_seq > seq:
+            return seq, None
+        rows = db.session.execute(
+            select(UsageRecordChange.seq, UsageRecordChange.usage_id).where(
+                UsageRecordChange.seq > seq
+            ).order_by(UsageRecordChange.seq)
+        ).all()
+        if not rows:
+            return seq, []
+        return rows[-1][0], list(dict.fromkeys(usage_id for _, usage_id in rows))
+
+    @staticmethod
+    def prune(keep: int) -> int:
+        """Delete all but the newest *keep* changes and commit; returns the number deleted.
+
+        The newest change is always kept, so that the sequence never restarts
+        below a position a reader remembers.
+        """
+        cutoff = UsageChangeLog.last_seq() - max(keep, 1)
+        if cutoff <= 0:
+            return 0
+        try:
+            result = db.session.execute(delete(UsageRecordChange).where(UsageRecordChange.seq <= cutoff))
+            marked = db.session.execute(
+                update(DataVersion).where(DataVersion.name == PRUNED_VERSION, DataVersion.version < cutoff)
+                .values(version=cutoff)
+            ).rowcount
+            if not marked and not DataVersionService.current([PRUNED_VERSION])[0]:
+                db.session.execute(insert(DataVersion).values(name=PRUNED_VERSION, version=cutoff))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result.rowcount
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_usage_changes_on_flush(session, flush_context):
+    """Log usage records written in this flush"""
+    changed = [obj.id for obj in list(session.new) + list(session.deleted) if isinstance(obj, UsageRecord)]
+    changed += [
+        obj.id for obj in session.dirty
+        if isinstance(obj, UsageRecord) and session.is_modified(obj, include_collections=False)
+    ]
+    if changed:
+        UsageChangeLog.record(changed, connection=session.connection())
@@ -0,0 +1,266 @@
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, insert, select
+
+from models import db, UsageRecord
+from services.data_version import DataVersionService
+from services.storage_service import StorageService
+from services.usage_change_log import UsageChangeLog
+from utils.units import to_base
+
+logger = logging.getLogger(__name__)
+
+# Default number of records inserted per transaction
+DEFAULT_CHUNK_SIZE = 5000
+
+# Unmatched (类型, 产品名, 存放地, CAS号) keys listed in an import result
+MAX_UNMATCHED_KEYS = 100
+
+# progress(inserted so far, total records)
+ProgressCallback = Callable[[int, int], None]
+
+
+class UsageImportService:
+    """Service class for bulk-inserting imported usage records.
+
+    Records are written with Core executemany in chunks, each chunk in its own
+    short transaction, instead of one ORM object per row and a single commit.
+    Core inserts skip the ORM hooks, so each chunk fills base_quantity itself
+    and logs its ids and the usage_records data version like a flush would.
+    A failing chunk is rolled back and reported; earlier chunks stay committed.
+
+    Every imported row carries a fingerprint of its content (row_hash, unique).
+    Rows whose fingerprint is already stored are skipped, so re-uploading an
+    overlapping file only inserts the rows that are new.
+    """
+
+    # Fields hashed by row_digest, in hashing order
+    FINGERPRINT_FIELDS = ['类型', '产品名', '数量及数量单位', '存放地', 'CAS号', '使用人',
+                          '使用日期', '使用量', '余量', '单位', '备注']
+
+    @staticmethod
+    def row_digest(row: Dict[str, Any]) -> str:
+        """Hash of the content of a usage row.
+
+        Values are normalized so that a row hashes the same when it is read
+        from a file and when it is read back from usage_records.
+        """
+        parts = []
+        for field in UsageImportService.FINGERPRINT_FIELDS:
+            value = row.get(field)
+            if field == '使用日期':
+                parts.append(value.isoformat() if value else '')
+            elif field in ('使用量', '余量'):
+                parts.append(repr(float(value or 0)))
+            else:
+                parts.append('' if value is None else str(value))
+        return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def row_hash(digest: str, occurrence: int) -> str:
+        """row_hash of the *occurrence*-th (0-based) record with content *digest*"""
+        return f'{digest}:{occurrence}' if occurrence else digest
+
+    @staticmethod
+    def to_row(record_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert parameters of one validated import record"""
+        row = {
+            'storage_id': record_data.get('storage_id'),
+            '类型': record_data.get('类型', ''),
+            '产品名': record_data.get('产品名', ''),
+            '数量及数量单位': record_data.get('数量及数量单位', ''),
+            '存放地': record_data.get('存放地', ''),
+            'CAS号': record_data.get('CAS号'),
+            '使用人': record_data.get('使用人', ''),
+            '使用日期': record_data.get('使用日期'),
+            '使用量': record_data.get('使用量', 0),
+            '余量': record_data.get('余量', 0),
+            '单位': record_data.get('单位', ''),
+            '备注': record_data.get('备注', ''),
+        }
+        unit = UsageRecord.resolve_unit(row['单位'], row['数量及数量单位'])
+        row['base_quantity'], row['base_dimension'] = to_base(row['使用量'], unit)
+        return row
+
+    @staticmethod
+    def insert_chunk(rows: Sequence[Dict[str, Any]],
+                     issues: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Insert the rows of one chunk not already stored and commit.
+
+        Rows linked to a storage item deduct its stock and update the derived
+        usage data in the same transaction; stock issues are collected in
+        *issues* (see StorageService.add_usage_rows).  Returns the rows inserted.
+        """
+        try:
+            table = UsageRecord.__table__
+            connection = db.session.connection()
+            # Anti-join on the unique row_hash index: one lookup for the whole chunk
+            existing = set(connection.execute(
+                select(table.c.row_hash).where(table.c.row_hash.in_([row['row_hash'] for row in rows]))
+            ).scalars())
+            rows = [row for row in rows if row['row_hash'] not in existing]
+            if rows:
+                if not UsageChangeLog.enabled(connection):
+                    connection.execute(insert(table), rows)
+                elif connection.dialect.insert_executemany_returning:
+                    ids = connection.execute(insert(table).returning(table.c.id), rows).scalars().all()
+                    UsageChangeLog.record(ids, connection=connection)
+                else:
+                    # No RETURNING for executemany: read the new ids back through the unique row_hash
+                    connection.execute(insert(table), rows)
+                    ids = connection.execute(
+                        select(table.c.id).where(table.c.row_hash.in_([row['row_hash'] for row in rows]))
+                    ).scalars().all()
+                    UsageChangeLog.record(ids, connection=connection)
+                DataVersionService.bump(['usage_records'])
+                StorageService.add_usage_rows(rows, issues)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return rows
+
+    @staticmethod
+    def insert_records(records: Sequence[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       progress: Optional[ProgressCallback] = None) -> Tuple[int, List[str]]:
+        """Insert validated import records in chunks.
+
+        Returns (number of records inserted, error messages of failed chunks).
+        *progress* is called after every chunk with (inserted so far, total).
+        """
+        total = len(records)
+        chunk_progress = (lambda done, _: progress(done, total)) if progress is not None else None
+        result = UsageImportService.import_chunks([(records, [])], chunk_size, chunk_progress)
+        return result['imported_count'], result['errors']
+
+    @staticmethod
+    def import_chunks(chunks: Iterable[Tuple[Sequence[Dict[str, Any]], List[str]]],
+                      chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      progress: Optional[ProgressCallback] = None,
+                      link_storage: bool = True) -> Dict[str, Any]:
+        """Insert the valid records of (valid records, errors) chunks as they are read.
+
+        When the chunks are streamed from a file the total is not known up
+        front, so *progress* receives the number of valid records read so far
+        as total.
+
+        With *link_storage*, every record is linked to a storage item through
+        one catalogue lookup read up front (see StorageService.storage_lookup);
+        inserted records without a match stay unlinked and are reported by key.
+
+        Identical records are numbered in file order (see row_hash), which
+        keeps one fingerprint per distinct record of the file in memory.
+
+        Returns a dict with imported_count, skipped_count (already imported),
+        total_records (valid records read), linked_count, unmatched_count,
+        unmatched (the most frequent unmatched keys), errors and warnings.
+        """
+        inserted = 0
+        skipped = 0
+        total = 0
+        linked = 0
+        errors: List[str] = []
+        issues: Dict[int, Dict[str, Any]] = {}
+        occurrences: Dict[str, int] = {}
+        unmatched: Dict[tuple, int] = {}
+        lookup = StorageService.storage_lookup() if link_storage else None
+        for valid_records, chunk_errors in chunks:
+            errors.extend(chunk_errors)
+            for start in range(0, len(valid_records), chunk_size):
+                batch = valid_records[start:start + chunk_size]
+                first, last = total + 1, total + len(batch)
+                total = last
+                try:
+                    rows = []
+                    for record_data in batch:
+                        row = UsageImportService.to_row(record_data)
+                        digest = UsageImportService.row_digest(row)
+                        occurrence = occurrences.get(digest, 0)
+                        occurrences[digest] = occurrence + 1
+                        row['row_hash'] = UsageImportService.row_hash(digest, occurrence)
+                        if lookup is not None:
+                            row['storage_id'] = StorageService.match_storage_id(row, lookup)
+                        rows.append(row)
+                    inserted_rows = UsageImportService.insert_chunk(rows, issues)
+                    inserted += len(inserted_rows)
+                    skipped += len(rows) - len(inserted_rows)
+                    if lookup is not None:
+                        for row in inserted_rows:
+                            if row['storage_id']:
+                                linked += 1
+                            else:
+                                key = (row['类型'], row['产品名'], row['存放地'], row['CAS号'])
+                                unmatched[key] = unmatched.get(key, 0) + 1
+                except Exception as e:
+                    logger.error(f"Error importing records {first}-{last}: {str(e)}")
+                    errors.append(f"Records {first}-{last} not imported: {str(e)}")
+                if progress is not None:
+                    progress(inserted, total)
+
+        top_unmatched = sorted(unmatched.items(), key=lambda item: -item[1])[:MAX_UNMATCHED_KEYS]
+        return {
+            'imported_count': inserted,
+            'skipped_count': skipped,
+            'total_records': total,
+            'linked_count': linked,
+            'unmatched_count': sum(unmatched.values()),
+            'unmatched': [
+                {'类型': type_name, '产品名': name, '存放地': location, 'CAS号': cas_number, 'count': count}
+                for (type_name, name, location, cas_number), count in top_unmatched
+            ],
+            'errors': errors,
+            'warnings': StorageService.usage_issue_messages(issues),
+        }
+
+    @staticmethod
+    def summary(result: Dict[str, Any]) -> str:
+        """Result message of an import_chunks result"""
+        message = f"Successfully imported {result['imported_count']} records"
+        if result['skipped_count']:
+            message += f" ({result['skipped_count']} already imported records skipped)"
+        if result['unmatched_count']:
+            message += f"; {result['unmatched_count']} records match no storage item and were not linked"
+        return message
+
+    @staticmethod
+    def backfill_row_hashes(batch_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Fingerprint all existing usage records, so files imported before row_hash existed are recognized.
+
+        Records entered by hand get a fingerprint too, as they cannot be told
+        apart from imported ones.  Records are read in id order and identical
+        ones are numbered in insertion order, as import_chunks does, keeping
+        one counter per distinct record in memory.  Raw columns cannot be
+        compared instead: row_digest treats NULL and '' (and NULL and 0) alike.
+        """
+        table = UsageRecord.__table__
+        content = [table.c[field] for field in UsageImportService.FINGERPRINT_FIELDS]
+        update = table.update().where(table.c.id == bindparam('record_id')).values(
+            # Keep the original timestamp instead of triggering onupdate
+            row_hash=bindparam('hash'), 更新时间=table.c.更新时间
+        )
+        updated_count = 0
+        occurrences: Dict[str, int] = {}
+        batch: List[Dict[str, Any]] = []
+        try:
+            rows = db.session.execute(
+                select(table.c.id, *content).order_by(table.c.id).execution_options(yield_per=batch_size)
+            )
+            for row in rows.mappings():
+                digest = UsageImportService.row_digest(row)
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                batch.append({'record_id': row['id'], 'hash': UsageImportService.row_hash(digest, occurrence)})
+                if len(batch) >= batch_size:
+                    db.session.execute(update, batch)
+                    updated_count += len(batch)
+                    batch = []
+            if batch:
+                db.session.execute(update, batch)
+                updated_count += len(batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return updated_count
@@ -0,0 +1,265 @@
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, tuple_
+
+from models import db, Storage, UsageRecord, UsageDailyRollup
+from utils.number_utils import NumberUtils
+from utils.units import convert, unit_info
+
+logger = logging.getLogger(__name__)
+
+# Bucket keys per lookup query in add_rows
+LOOKUP_BATCH_SIZE = 1000
+# Rollup rows per executemany INSERT in rebuild
+INSERT_BATCH_SIZE = 5000
+
+
+class UsageRollupService:
+    """Service class maintaining the daily usage rollup used by analytics.
+
+    The rollup holds one row per (day, storage_id, 使用人, 产品名, 类型) with the
+    number of usage records and the sums of 使用量 converted to the storage
+    item's unit and of its base-unit quantity (in the item's base_dimension).
+    Usage in a unit that cannot be converted to the item's unit is counted as a
+    record but left out of both sums (see item_quantities).  产品名 and 类型 are
+    the ones recorded on the usage records, so renaming a storage item does not
+    rewrite past analytics.  Write helpers only stage changes on the
+    current session; the caller owns the transaction and commits it together
+    with the usage record change.
+    """
+
+    @staticmethod
+    def item_quantities(amount: Optional[float], unit: Optional[str], base_quantity: Optional[float],
+                        base_dimension: Optional[str], item_unit: Optional[str]) -> Optional[Tuple[float, float]]:
+        """(usage in the item's unit, base quantity) that usage of *amount* in *unit* adds to its storage item.
+
+        None when *unit* cannot be converted to *item_unit*.
+        """
+        usage = convert(amount, unit, item_unit)
+        if usage is None:
+            return None
+        item_dimension = (unit_info(item_unit) or (None,))[0]
+        return usage, (base_quantity or 0.0) if base_dimension == item_dimension else 0.0
+
+    @staticmethod
+    def record_quantities(record: UsageRecord, item: Storage) -> Optional[Tuple[float, float]]:
+        """item_quantities of a usage record of *item*"""
+        base_quantity, base_dimension = record.base_usage()
+        return UsageRollupService.item_quantities(record.使用量, record.usage_unit, base_quantity, base_dimension,
+                                                  item.单位)
+
+    @staticmethod
+    def row_quantities(row: Dict[str, Any], item_unit: Optional[str]) -> Optional[Tuple[float, float]]:
+        """item_quantities of an inserted row (see UsageImportService.to_row)"""
+        unit = UsageRecord.resolve_unit(row['单位'], row['数量及数量单位'])
+        return UsageRollupService.item_quantities(row['使用量'], unit, row['base_quantity'], row['base_dimension'],
+                                                  item_unit)
+
+    @staticmethod
+    def apply(day: date, storage_id: Optional[int], personnel: str, product_name: str, type_name: str,
+              count_delta: int, usage_delta: float, base_delta: Optional[float] = 0.0) -> None:
+        """Add deltas to a single rollup bucket, creating or removing it as needed"""
+        if not storage_id or not day:
+            # Only storage-integrated records are rolled up
+            return
+
+        key = (day, storage_id, personnel, product_name, type_name)
+        row = db.session.get(UsageDailyRollup, key)
+        if row is None:
+            if count_delta <= 0:
+                logger.warning(f"Rollup bucket {key} missing on decrement")
+                return
+            row = UsageDailyRollup(
+                day=day,
+                storage_id=storage_id,
+                使用人=personnel,
+                产品名=product_name,
+                类型=type_name,
+                record_count=0,
+                total_usage=0.0,
+                total_base_quantity=0.0
+            )
+            db.session.add(row)
+
+        row.record_count = (row.record_count or 0) + count_delta
+        row.total_usage = NumberUtils.safe_add(row.total_usage or 0.0, usage_delta)
+        row.total_base_quantity = NumberUtils.safe_add(row.total_base_quantity or 0.0, base_delta or 0.0)
+
+        if row.record_count <= 0:
+            if row in db.session.new:
+                db.session.expunge(row)
+            else:
+                db.session.delete(row)
+
+    @staticmethod
+    def add_record(record: UsageRecord, item: Storage) -> None:
+        """Account for a new usage record of *item*"""
+        quantities = UsageRollupService.record_quantities(record, item)
+        if quantities is None:
+            logger.warning(f"Usage in {record.usage_unit} cannot be converted to {item.单位} "
+                           f"(storage {item.id}); left out of the usage totals")
+        usage, base_quantity = quantities or (0.0, 0.0)
+        UsageRollupService.apply(record.使用日期, record.storage_id, record.使用人, record.产品名, record.类型,
+                                 1, usage, base_quantity)
+
+    @staticmethod
+    def add_rows(rows: Sequence[Dict[str, Any]], quantities: Sequence[Optional[Tuple[float, float]]]) -> None:
+        """add_record for many inserted rows (see UsageImportService.to_row).
+
+        *quantities* holds the row_quantities of each row.  Deltas are summed
+        per bucket and written with two Core executemany statements, an
+        increment of the existing buckets and an insert of the new ones,
+        instead of one ORM object per bucket.
+        """
+        deltas: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        for row, row_quantities in zip(rows, quantities):
+            if not row.get('storage_id') or not row.get('使用日期'):
+                continue
+            usage, base_quantity = row_quantities or (0.0, 0.0)
+            delta = deltas[(row['使用日期'], row['storage_id'], row['使用人'], row['产品名'], row['类型'])]
+            delta[0] += 1
+            delta[1] = NumberUtils.safe_add(delta[1], usage)
+            delta[2] = NumberUtils.safe_add(delta[2], base_quantity)
+        if not deltas:
+            return
+
+        # Existing buckets looked up by key (in slices that stay under SQLite's bound parameter limit)
+        table = UsageDailyRollup.__table__
+        keys = list(deltas)
+        key_columns = (table.c.day, table.c.storage_id, table.c.使用人, table.c.产品名, table.c.类型)
+        existing = set()
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            existing.update(tuple(key) for key in db.session.execute(
+                select(*key_columns).where(
+                    tuple_(*key_columns).in_(keys[start:start + LOOKUP_BATCH_SIZE])
+                )
+            ))
+
+        updates, inserts = [], []
+        for key, (count, usage, base) in deltas.items():
+            day, storage_id, personnel, product_name, type_name = key
+            params = {'bucket_day': day, 'bucket_storage_id': storage_id, 'bucket_user': personnel,
+                      'bucket_product': product_name, 'bucket_type': type_name,
+                      'count': count, 'usage': usage, 'base': base}
+            (updates if key in existing else inserts).append(params)
+        if updates:
+            db.session.execute(
+                table.update().where(
+                    table.c.day == bindparam('bucket_day'),
+                    table.c.storage_id == bindparam('bucket_storage_id'),
+                    table.c.使用人 == bindparam('bucket_user'),
+                    table.c.产品名 == bindparam('bucket_product'),
+                    table.c.类型 == bindparam('bucket_type')
+                ).values(
+                    record_count=table.c.record_count + bindparam('count'),
+                    total_usage=table.c.total_usage + bindparam('usage'),
+                    total_base_quantity=table.c.total_base_quantity + bindparam('base')
+                ),
+                updates
+            )
+        if inserts:
+            db.session.execute(
+                insert(table).values(
+                    day=bindparam('bucket_day'), storage_id=bindparam('bucket_storage_id'),
+                    使用人=bindparam('bucket_user'), 产品名=bindparam('bucket_product'),
+                    类型=bindparam('bucket_type'), record_count=bindparam('count'),
+                    total_usage=bindparam('usage'), total_base_quantity=bindparam('base')
+                ),
+                inserts
+            )
+
+    @staticmethod
+    def remove_record(record: UsageRecord, item: Storage) -> None:
+        """Remove the contribution of a usage record of *item*"""
+        usage, base_quantity = UsageRollupService.record_quantities(record, item) or (0.0, 0.0)
+        UsageRollupService.apply(record.使用日期, record.storage_id, record.使用人, record.产品名, record.类型,
+                                 -1, -usage, -base_quantity)
+
+    @staticmethod
+    def delete_for_storage(storage_id: int) -> None:
+        """Drop all rollup buckets of a storage item (used before deleting the item)"""
+        UsageDailyRollup.query.filter_by(storage_id=storage_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def converted_totals(*key_columns, storage_id: Optional[int] = None) -> Dict[tuple, List[float]]:
+        """[record count, usage in the item's unit, base quantity] of the linked usage records per key.
+
+        Records are grouped in SQL by the key and by what determines their
+        conversion (unit and dimension); each group is then converted with
+        item_quantities, which is linear in the amounts.  *storage_id*
+        restricts the totals to the records of one storage item.
+        """
+        linked = UsageRecord.storage_id.isnot(None) if storage_id is None else UsageRecord.storage_id == storage_id
+        items = select(Storage.id, Storage.单位)
+        if storage_id is not None:
+            items = items.where(Storage.id == storage_id)
+        item_units = dict(db.session.execute(items).all())
+        conversion_columns = (UsageRecord.storage_id, UsageRecord.单位, UsageRecord.数量及数量单位,
+                              UsageRecord.base_dimension)
+        grouped = select(
+            *key_columns, *conversion_columns,
+            func.count(UsageRecord.id),
+            func.coalesce(func.sum(UsageRecord.使用量), 0.0),
+            func.sum(UsageRecord.base_quantity)
+        ).where(linked).group_by(*key_columns, *conversion_columns)
+
+        totals: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        key_length = len(key_columns)
+        for row in db.session.execute(grouped):
+            storage_id, unit, quantity_text, base_dimension, count, usage, base_quantity = row[key_length:]
+            total = totals[tuple(row[:key_length])]
+            total[0] += count
+            quantities = UsageRollupService.item_quantities(
+                usage, UsageRecord.resolve_unit(unit, quantity_text), base_quantity, base_dimension,
+                item_units.get(storage_id)
+            )
+            if quantities is not None:
+                total[1] = NumberUtils.safe_add(total[1], quantities[0])
+                total[2] = NumberUtils.safe_add(total[2], quantities[1])
+        return totals
+
+    @staticmethod
+    def rebuild_buckets(storage_id: Optional[int] = None) -> int:
+        """Rewrite the rollup rows of one storage item (all items if None) from usage_records.
+
+        Used when an item's unit changes, so that its past usage is converted
+        to the new unit and dimension.  Only stages the changes; returns the
+        number of rollup rows written.
+        """
+        delete = UsageDailyRollup.query
+        if storage_id is not None:
+            delete = delete.filter_by(storage_id=storage_id)
+        delete.delete(synchronize_session=False)
+
+        totals = UsageRollupService.converted_totals(
+            UsageRecord.使用日期, UsageRecord.storage_id, UsageRecord.使用人, UsageRecord.产品名, UsageRecord.类型,
+            storage_id=storage_id
+        )
+        rows = [
+            {'day': day, 'storage_id': item_id, '使用人': personnel, '产品名': product_name, '类型': type_name,
+             'record_count': count, 'total_usage': usage, 'total_base_quantity': base_quantity}
+            for (day, item_id, personnel, product_name, type_name), (count, usage, base_quantity)
+            in totals.items()
+        ]
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(insert(UsageDailyRollup), rows[start:start + INSERT_BATCH_SIZE])
+        return len(rows)
+
+    @staticmethod
+    def rebuild() -> int:
+        """Rebuild the whole rollup from usage_records and commit.
+
+        Returns the number of rollup rows written.
+        """
+        try:
+            row_count = UsageRollupService.rebuild_buckets()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"Rebuilt usage_daily_rollup with {row_count} rows")
+        return row_count
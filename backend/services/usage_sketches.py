@@ -0,0 +1,251 @@
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, select
+
+from models import db, Storage, UsageRecord, UsageDailyRollup, UsageDailySketch
+from utils.sketches import HyperLogLog, SpaceSaving
+from utils.time_buckets import bucket_start
+from utils.units import MASS
+
+logger = logging.getLogger(__name__)
+
+# Counters kept per day and dimension
+SKETCH_CAPACITY = 64
+# HyperLogLog precision: 1024 registers per day and dimension, ~3% standard error
+DISTINCT_PRECISION = 10
+
+DIMENSIONS = ('product', 'person')
+
+
+class UsageSketchService:
+    """Service class maintaining per-day sketches of usage.
+
+    Each (day, dimension) row holds a Space-Saving summary of record counts
+    (weighted by the mass used, in mg) and HyperLogLog registers of the distinct keys, by recorded product name or by
+    使用人.  Writes touch two small rows per usage record; top-N and distinct
+    queries merge one row per day of the window instead of scanning usage data.
+    HyperLogLog cannot forget a key, so removals re-derive the day's registers
+    from the rollup.  Like the rollup, write helpers only stage changes on the
+    current session and the caller commits (after updating the rollup).
+    """
+
+    @staticmethod
+    def _keys(record: UsageRecord) -> Dict[str, str]:
+        return {'product': record.产品名, 'person': record.使用人}
+
+    @staticmethod
+    def _weight(record: UsageRecord) -> float:
+        """Counter weight of a record: its mass in mg (other dimensions are not summed)"""
+        base_quantity, dimension = record.base_usage()
+        return base_quantity if dimension == MASS else 0.0
+
+    @staticmethod
+    def _row(day: date, dimension: str, create: bool):
+        row = db.session.get(UsageDailySketch, (day, dimension))
+        if row is None and create:
+            row = UsageDailySketch(day=day, dimension=dimension)
+            db.session.add(row)
+        return row
+
+    @staticmethod
+    def add_record(record: UsageRecord) -> None:
+        """Account for a new usage record"""
+        if not record.storage_id or not record.使用日期:
+            return
+        for dimension, key in UsageSketchService._keys(record).items():
+            row = UsageSketchService._row(record.使用日期, dimension, create=True)
+            summary = SpaceSaving.from_json(SKETCH_CAPACITY, row.top_counters)
+            summary.add(key, UsageSketchService._weight(record))
+            row.top_counters = summary.to_json()
+
+            if key is not None:
+                registers = HyperLogLog.from_bytes(DISTINCT_PRECISION, row.distinct_registers)
+                registers.add(key)
+                row.distinct_registers = registers.to_bytes()
+
+    @staticmethod
+    def add_rows(rows: Iterable[Dict[str, Any]]) -> None:
+        """add_record for many inserted rows (see UsageImportService.to_row), one sketch row update per day"""
+        rows = [row for row in rows if row.get('storage_id') and row.get('使用日期')]
+        if not rows:
+            return
+        days = {row['使用日期'] for row in rows}
+        sketches = {
+            (sketch.day, sketch.dimension): sketch
+            for sketch in UsageDailySketch.query.filter(UsageDailySketch.day.in_(days))
+        }
+        summaries: Dict[tuple, SpaceSaving] = {}
+        registers: Dict[tuple, HyperLogLog] = {}
+        for row in rows:
+            weight = row['base_quantity'] if row['base_dimension'] == MASS else 0.0
+            keys = {'product': row['产品名'], 'person': row['使用人']}
+            for dimension, key in keys.items():
+                sketch_key = (row['使用日期'], dimension)
+                sketch = sketches.get(sketch_key)
+                if sketch is None:
+                    sketch = sketches[sketch_key] = UsageDailySketch(day=row['使用日期'], dimension=dimension)
+                    db.session.add(sketch)
+                if sketch_key not in summaries:
+                    summaries[sketch_key] = SpaceSaving.from_json(SKETCH_CAPACITY, sketch.top_counters)
+                    registers[sketch_key] = HyperLogLog.from_bytes(DISTINCT_PRECISION, sketch.distinct_registers)
+                summaries[sketch_key].add(key, weight)
+                if key is not None:
+                    registers[sketch_key].add(key)
+
+        for sketch_key, summary in summaries.items():
+            sketches[sketch_key].top_counters = summary.to_json()
+            sketches[sketch_key].distinct_registers = registers[sketch_key].to_bytes()
+
+    @staticmethod
+    def remove_record(record: UsageRecord) -> None:
+        """Remove a usage record's contribution (top counters only if its keys are still tracked)"""
+        UsageSketchService.remove_records([record])
+
+    @staticmethod
+    def remove_records(records: Iterable[UsageRecord]) -> None:
+        """Remove several records (used before a cascade delete of their storage item)"""
+        days = set()
+        for record in records:
+            if not record.storage_id or not record.使用日期:
+                continue
+            for dimension, key in UsageSketchService._keys(record).items():
+                row = UsageSketchService._row(record.使用日期, dimension, create=False)
+                if row is None:
+                    continue
+                summary = SpaceSaving.from_json(SKETCH_CAPACITY, row.top_counters)
+                summary.remove(key, UsageSketchService._weight(record))
+                row.top_counters = summary.to_json()
+            days.add(record.使用日期)
+
+        for day in days:
+            UsageSketchService._refresh_distinct(day)
+
+    @staticmethod
+    def _refresh_distinct(day: date) -> None:
+        """Re-derive the distinct-key registers of *day* from the rollup"""
+        keys = db.session.execute(
+            select(UsageDailyRollup.使用人, UsageDailyRollup.产品名).where(UsageDailyRollup.day == day).distinct()
+        ).all()
+
+        registers = {dimension: HyperLogLog(DISTINCT_PRECISION) for dimension in DIMENSIONS}
+        for person, product in keys:
+            if person is not None:
+                registers['person'].add(person)
+            if product is not None:
+                registers['product'].add(product)
+
+        for dimension in DIMENSIONS:
+            row = UsageSketchService._row(day, dimension, create=False)
+            if row is not None:
+                row.distinct_registers = registers[dimension].to_bytes()
+
+    @staticmethod
+    def top(dimension: str, start_date: date, n: int, end_date: Optional[date] = None) -> Dict[str, Any]:
+        """Approximate top-*n* keys of *dimension* from start_date (to end_date, if given).
+
+        Returns {'items': [(key, count, error, weight), ...], 'max_error': bound}
+        where each count overestimates the true count by at most its error, and
+        any key missing from the list occurred at most max_error times.
+        """
+        query = select(UsageDailySketch.top_counters).where(
+            UsageDailySketch.dimension == dimension,
+            UsageDailySketch.day >= start_date
+        )
+        if end_date is not None:
+            query = query.where(UsageDailySketch.day <= end_date)
+        payloads = db.session.execute(query).scalars().all()
+
+        merged = SpaceSaving.merged(
+            SKETCH_CAPACITY, (SpaceSaving.from_json(SKETCH_CAPACITY, payload) for payload in payloads)
+        )
+        return {'items': merged.top(n), 'max_error': merged.min_count()}
+
+    @staticmethod
+    def _distinct_payloads(dimension: str, start_date: Optional[date], end_date: Optional[date] = None):
+        query = select(UsageDailySketch.day, UsageDailySketch.distinct_registers).where(
+            UsageDailySketch.dimension == dimension
+        )
+        if start_date is not None:
+            query = query.where(UsageDailySketch.day >= start_date)
+        if end_date is not None:
+            query = query.where(UsageDailySketch.day <= end_date)
+        return db.session.execute(query).all()
+
+    @staticmethod
+    def distinct(dimension: str, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        """Approximate number of distinct keys of *dimension* in the window (all days by default)"""
+        payloads = UsageSketchService._distinct_payloads(dimension, start_date, end_date)
+        return HyperLogLog.merged(DISTINCT_PRECISION, (payload for _, payload in payloads)).count()
+
+    @staticmethod
+    def distinct_by_bucket(dimension: str, period: str, start_date: date) -> Dict[date, int]:
+        """Approximate distinct keys of *dimension* per day/week/month bucket, keyed by bucket start"""
+        buckets: Dict[date, List[bytes]] = defaultdict(list)
+        for day, payload in UsageSketchService._distinct_payloads(dimension, start_date):
+            buckets[bucket_start(day, period)].append(payload)
+        return {
+            bucket: HyperLogLog.merged(DISTINCT_PRECISION, payloads).count()
+            for bucket, payloads in buckets.items()
+        }
+
+    @staticmethod
+    def rebuild() -> int:
+        """Rebuild all sketches from usage_records and commit.
+
+        Exact per-day counts are grouped in SQL and the largest SKETCH_CAPACITY
+        keys of each day are stored with zero error; the next largest count
+        becomes the day's floor.  Returns the rows written.
+        """
+        try:
+            UsageDailySketch.query.delete(synchronize_session=False)
+
+            columns = {'product': UsageRecord.产品名, 'person': UsageRecord.使用人}
+            row_count = 0
+            for dimension, column in columns.items():
+                grouped = db.session.execute(
+                    select(
+                        UsageRecord.使用日期,
+                        column,
+                        func.count(UsageRecord.id),
+                        func.coalesce(func.sum(
+                            case((UsageRecord.base_dimension == MASS, UsageRecord.base_quantity), else_=0.0)
+                        ), 0.0)
+                    ).join(
+                        Storage, UsageRecord.storage_id == Storage.id
+                    ).group_by(UsageRecord.使用日期, column)
+                )
+
+                per_day: Dict[date, List] = defaultdict(list)
+                for day, key, count, weight in grouped:
+                    per_day[day].append((key, int(count), float(weight)))
+
+                for day, entries in per_day.items():
+                    registers = HyperLogLog(DISTINCT_PRECISION)
+                    for key, _, _ in entries:
+                        if key is not None:
+                            registers.add(key)
+
+                    entries.sort(key=lambda entry: (-entry[1], entry[0] or ''))
+                    summary = SpaceSaving(
+                        SKETCH_CAPACITY,
+                        {key: [count, 0, weight] for key, count, weight in entries[:SKETCH_CAPACITY]},
+                        floor=entries[SKETCH_CAPACITY][1] if len(entries) > SKETCH_CAPACITY else 0
+                    )
+                    db.session.add(UsageDailySketch(
+                        day=day,
+                        dimension=dimension,
+                        top_counters=summary.to_json(),
+                        distinct_registers=registers.to_bytes()
+                    ))
+                    row_count += 1
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"Rebuilt usage_daily_sketches with {row_count} rows")
+        return row_count
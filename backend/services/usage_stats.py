@@ -0,0 +1,268 @@
+import logging
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, bindparam, func, insert, literal, select
+from sqlalchemy.orm.attributes import flag_modified
+
+from models import db, Storage, StorageUsageStats, UsageDailyRollup, UsageRecord
+from services.usage_rollup import UsageRollupService
+from utils.number_utils import NumberUtils
+
+logger = logging.getLogger(__name__)
+
+# Columns written by add_rows
+STATS_COLUMNS = ['usage_count', 'total_usage', 'total_base_quantity', 'first_usage_date',
+                 'last_usage_date', 'top_user', 'top_user_count']
+
+
+class UsageStatsService:
+    """Service class maintaining per-storage usage statistics.
+
+    One storage_usage_stats row per storage item with usage records holds the
+    record count, total 使用量 in the item's unit (and in the base unit, counting
+    only what the rollup counts, see UsageRollupService.item_quantities),
+    first/last 使用日期 and the most frequent 使用人.
+    Like the daily rollup, write helpers only stage changes on the current
+    session.  They must run after the rollup has been updated for the same
+    record, since per-user counts and min/max dates are re-read from it.
+    """
+
+    @staticmethod
+    def add_record(record: UsageRecord, item: Storage) -> None:
+        """Account for a new usage record of *item*"""
+        if not record.storage_id:
+            return
+
+        stats = db.session.get(StorageUsageStats, record.storage_id)
+        if stats is None:
+            stats = StorageUsageStats(
+                storage_id=record.storage_id,
+                usage_count=0,
+                total_usage=0.0,
+                total_base_quantity=0.0,
+                top_user_count=0
+            )
+            db.session.add(stats)
+
+        usage, base_quantity = UsageRollupService.record_quantities(record, item) or (0.0, 0.0)
+        stats.usage_count = (stats.usage_count or 0) + 1
+        stats.total_usage = NumberUtils.safe_add(stats.total_usage or 0.0, usage)
+        stats.total_base_quantity = NumberUtils.safe_add(stats.total_base_quantity or 0.0, base_quantity)
+
+        day = record.使用日期
+        if day:
+            if stats.first_usage_date is None or day < stats.first_usage_date:
+                stats.first_usage_date = day
+            if stats.last_usage_date is None or day > stats.last_usage_date:
+                stats.last_usage_date = day
+
+        # The incumbent keeps the top spot on ties
+        user_count = UsageStatsService._user_count(record.storage_id, record.使用人)
+        if record.使用人 == stats.top_user or user_count > (stats.top_user_count or 0):
+            stats.top_user = record.使用人
+            stats.top_user_count = user_count
+
+    @staticmethod
+    def add_rows(rows: Sequence[Dict[str, Any]], quantities: Sequence[Optional[Tuple[float, float]]]) -> None:
+        """add_record for many inserted rows (see UsageImportService.to_row), per storage item.
+
+        *quantities* holds the UsageRollupService.row_quantities of each row.
+        Must run after UsageRollupService.add_rows for the same rows.  The top
+        user is re-read from the rollup once per item; the incumbent keeps the
+        spot while tied for the most records.
+        """
+        totals: Dict[int, Dict[str, Any]] = {}
+        for row, row_quantities in zip(rows, quantities):
+            storage_id = row.get('storage_id')
+            if not storage_id:
+                continue
+            usage, base_quantity = row_quantities or (0.0, 0.0)
+            total = totals.setdefault(storage_id, {'count': 0, 'usage': 0.0, 'base': 0.0, 'first': None, 'last': None})
+            total['count'] += 1
+            total['usage'] = NumberUtils.safe_add(total['usage'], usage)
+            total['base'] = NumberUtils.safe_add(total['base'], base_quantity)
+            day = row.get('使用日期')
+            if day:
+                if total['first'] is None or day < total['first']:
+                    total['first'] = day
+                if total['last'] is None or day > total['last']:
+                    total['last'] = day
+        if not totals:
+            return
+
+        existing = {
+            stats.storage_id: stats
+            for stats in StorageUsageStats.query.filter(StorageUsageStats.storage_id.in_(totals))
+        }
+        user_counts: Dict[int, Dict[str, int]] = {}
+        for storage_id, personnel, count in db.session.query(
+            UsageDailyRollup.storage_id, UsageDailyRollup.使用人, func.sum(UsageDailyRollup.record_count)
+        ).filter(
+            UsageDailyRollup.storage_id.in_(totals)
+        ).group_by(UsageDailyRollup.storage_id, UsageDailyRollup.使用人):
+            user_counts.setdefault(storage_id, {})[personnel] = int(count or 0)
+
+        for storage_id, total in totals.items():
+            stats = existing.get(storage_id)
+            if stats is None:
+                stats = StorageUsageStats(storage_id=storage_id, usage_count=0, total_usage=0.0,
+                                          total_base_quantity=0.0, top_user_count=0)
+                db.session.add(stats)
+            stats.usage_count = (stats.usage_count or 0) + total['count']
+            stats.total_usage = NumberUtils.safe_add(stats.total_usage or 0.0, total['usage'])
+            stats.total_base_quantity = NumberUtils.safe_add(stats.total_base_quantity or 0.0, total['base'])
+            if total['first'] and (stats.first_usage_date is None or total['first'] < stats.first_usage_date):
+                stats.first_usage_date = total['first']
+            if total['last'] and (stats.last_usage_date is None or total['last'] > stats.last_usage_date):
+                stats.last_usage_date = total['last']
+
+            counts = user_counts.get(storage_id, {})
+            if counts:
+                top_user = min(counts, key=lambda user: (-counts[user], user))
+                if stats.top_user in counts and counts[stats.top_user] == counts[top_user]:
+                    top_user = stats.top_user
+                stats.top_user, stats.top_user_count = top_user, counts[top_user]
+            # Same column list for every row, so the flush sends one executemany UPDATE
+            for column in STATS_COLUMNS:
+                flag_modified(stats, column)
+
+    @staticmethod
+    def remove_record(record: UsageRecord, item: Storage) -> None:
+        """Remove the contribution of a usage record of *item*"""
+        if not record.storage_id:
+            return
+
+        stats = db.session.get(StorageUsageStats, record.storage_id)
+        if stats is None:
+            logger.warning(f"Usage stats for storage {record.storage_id} missing on decrement")
+            return
+
+        stats.usage_count = (stats.usage_count or 0) - 1
+        if stats.usage_count <= 0:
+            if stats in db.session.new:
+                db.session.expunge(stats)
+            else:
+                db.session.delete(stats)
+            return
+
+        usage, base_quantity = UsageRollupService.record_quantities(record, item) or (0.0, 0.0)
+        stats.total_usage = NumberUtils.safe_subtract(stats.total_usage or 0.0, usage)
+        stats.total_base_quantity = NumberUtils.safe_subtract(stats.total_base_quantity or 0.0, base_quantity)
+
+        # Boundary dates and the top user only change when this record defined them
+        if record.使用日期 in (stats.first_usage_date, stats.last_usage_date):
+            stats.first_usage_date, stats.last_usage_date = db.session.query(
+                func.min(UsageDailyRollup.day), func.max(UsageDailyRollup.day)
+            ).filter(UsageDailyRollup.storage_id == record.storage_id).one()
+
+        if record.使用人 == stats.top_user:
+            top = db.session.query(
+                UsageDailyRollup.使用人,
+                func.sum(UsageDailyRollup.record_count).label('count')
+            ).filter(
+                UsageDailyRollup.storage_id == record.storage_id
+            ).group_by(UsageDailyRollup.使用人).order_by(
+                func.sum(UsageDailyRollup.record_count).desc(), UsageDailyRollup.使用人
+            ).first()
+            stats.top_user, stats.top_user_count = (top[0], int(top[1])) if top else (None, 0)
+
+    @staticmethod
+    def _user_count(storage_id: int, personnel: str) -> int:
+        """Number of usage records of *personnel* on a storage item, from the rollup"""
+        count = db.session.query(
+            func.sum(UsageDailyRollup.record_count)
+        ).filter(
+            UsageDailyRollup.storage_id == storage_id,
+            UsageDailyRollup.使用人 == personnel
+        ).scalar()
+        return int(count or 0)
+
+    @staticmethod
+    def delete_for_storage(storage_id: int) -> None:
+        """Drop the statistics of a storage item (used before deleting the item)"""
+        StorageUsageStats.query.filter_by(storage_id=storage_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def refresh_totals(storage_id: Optional[int] = None) -> None:
+        """Recompute the usage totals of one storage item (all items if None) from usage_records.
+
+        Used when an item's unit changes; counts, dates and top users do not
+        depend on it.  Only stages the changes.
+        """
+        usage_totals = [
+            {'stats_storage_id': item_id, 'usage': usage, 'base': base_quantity}
+            for (item_id,), (_, usage, base_quantity)
+            in UsageRollupService.converted_totals(UsageRecord.storage_id, storage_id=storage_id).items()
+        ]
+        if usage_totals:
+            table = StorageUsageStats.__table__
+            db.session.execute(
+                table.update().where(table.c.storage_id == bindparam('stats_storage_id')).values(
+                    total_usage=bindparam('usage'), total_base_quantity=bindparam('base')
+                ),
+                usage_totals
+            )
+
+    @staticmethod
+    def rebuild() -> int:
+        """Rebuild all statistics from usage_records and commit.
+
+        Counts, dates and top users are computed in SQL; the usage totals,
+        which need unit conversion, are written afterwards per item.
+        Returns the number of statistics rows written.
+        """
+        try:
+            StorageUsageStats.query.delete(synchronize_session=False)
+
+            linked = UsageRecord.storage_id.isnot(None)
+            totals = select(
+                UsageRecord.storage_id.label('storage_id'),
+                func.count(UsageRecord.id).label('usage_count'),
+                func.min(UsageRecord.使用日期).label('first_usage_date'),
+                func.max(UsageRecord.使用日期).label('last_usage_date')
+            ).where(linked).group_by(UsageRecord.storage_id).subquery()
+
+            per_user = select(
+                UsageRecord.storage_id.label('storage_id'),
+                UsageRecord.使用人.label('user'),
+                func.count(UsageRecord.id).label('user_count')
+            ).where(linked).group_by(UsageRecord.storage_id, UsageRecord.使用人).subquery()
+
+            ranked = select(
+                per_user,
+                func.row_number().over(
+                    partition_by=per_user.c.storage_id,
+                    order_by=(per_user.c.user_count.desc(), per_user.c.user)
+                ).label('rn')
+            ).subquery()
+
+            source = select(
+                totals.c.storage_id,
+                totals.c.usage_count,
+                literal(0.0),
+                literal(0.0),
+                totals.c.first_usage_date,
+                totals.c.last_usage_date,
+                ranked.c.user,
+                ranked.c.user_count
+            ).join(
+                ranked, and_(ranked.c.storage_id == totals.c.storage_id, ranked.c.rn == 1)
+            )
+
+            db.session.execute(
+                insert(StorageUsageStats).from_select(
+                    ['storage_id', 'usage_count', 'total_usage', 'total_base_quantity', 'first_usage_date',
+                     'last_usage_date', 'top_user', 'top_user_count'],
+                    source
+                )
+            )
+
+            UsageStatsService.refresh_totals()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        row_count = db.session.query(func.count()).select_from(StorageUsageStats).scalar() or 0
+        logger.info(f"Rebuilt storage_usage_stats with {row_count} rows")
+        return row_count
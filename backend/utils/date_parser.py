@@ -1,10 +1,37 @@
 import re
 from datetime import datetime, date
 from dateutil import parser as date_parser
+import numpy as np
+import pandas as pd
 
 class DateParser:
     """Utility class for parsing various date formats, especially Chinese date formats"""
     
+    # Known formats in the order they are tried: (pattern matched at the start, year first)
+    DATE_PATTERNS = [
+        # 2025.04.29 format
+        (r'(\d{4})\.(\d{1,2})\.(\d{1,2})', True),
+        # 2025.0522 format (month and day combined)
+        (r'(\d{4})\.(\d{1,2})(\d{2})', True),
+        # 2025-04-29 format
+        (r'(\d{4})-(\d{1,2})-(\d{1,2})', True),
+        # 2025/04/29 format
+        (r'(\d{4})/(\d{1,2})/(\d{1,2})', True),
+        # 04.29.2025 format
+        (r'(\d{1,2})\.(\d{1,2})\.(\d{4})', False),
+        # 04-29-2025 format
+        (r'(\d{1,2})-(\d{1,2})-(\d{4})', False),
+    ]
+    
+    # All formats as one alternation; the first alternative that matches wins, as in parse_date
+    _COMBINED_PATTERN = '^(?:' + '|'.join(pattern for pattern, _ in DATE_PATTERNS) + ')'
+    
+    # Years pd.to_datetime can represent; other matches are left to parse_date
+    _TIMESTAMP_YEARS = (1700, 2200)
+    
+    # Distinct values kept by a parse_series cache before it is reset
+    CACHE_SIZE = 100000
+    
     @staticmethod
     def parse_date(date_str):
         """
@@ -22,35 +49,19 @@ class DateParser:
         date_str = date_str.strip()
         
         # Handle various Chinese date formats
-        patterns = [
-            # 2025.04.29 format
-            r'(\d{4})\.(\d{1,2})\.(\d{1,2})',
-            # 2025.0522 format (month and day combined)
-            r'(\d{4})\.(\d{1,2})(\d{2})',
-            # 2025-04-29 format
-            r'(\d{4})-(\d{1,2})-(\d{1,2})',
-            # 2025/04/29 format
-            r'(\d{4})/(\d{1,2})/(\d{1,2})',
-            # 04.29.2025 format
-            r'(\d{1,2})\.(\d{1,2})\.(\d{4})',
-            # 04-29-2025 format
-            r'(\d{1,2})-(\d{1,2})-(\d{4})',
-        ]
-        
-        for pattern in patterns:
+        for pattern, year_first in DateParser.DATE_PATTERNS:
             match = re.match(pattern, date_str)
             if match:
                 groups = match.groups()
-                if len(groups) == 3:
-                    try:
-                        if len(groups[0]) == 4:  # Year first format
-                            year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
-                        else:  # Month first format
-                            month, day, year = int(groups[0]), int(groups[1]), int(groups[2])
-                        
-                        return date(year, month, day)
-                    except ValueError:
-                        continue
+                try:
+                    if year_first:
+                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+                    else:
+                        month, day, year = int(groups[0]), int(groups[1]), int(groups[2])
+                    
+                    return date(year, month, day)
+                except ValueError:
+                    continue
         
         # Try standard date parsing as fallback
         try:
@@ -61,6 +72,75 @@ class DateParser:
             
         return None
     
+    @staticmethod
+    def parse_series(values, cache=None):
+        """
+        Vectorized parse_date(str(value)) for a column of cells
+        
+        Distinct strings are parsed once: a single str.extract of all known
+        formats (an alternation tried in parse_date's order) and one bulk
+        pd.to_datetime.  Strings that match no format, or whose first match is
+        not a valid date, fall back to parse_date.
+        
+        Args:
+            values (pd.Series): Cells as read from a file
+            cache (dict): Optional string -> result map shared between calls, so
+                that the chunks of one file parse each distinct value only once
+            
+        Returns:
+            pd.Series: datetime.date objects, None where parsing fails or the cell is empty
+        """
+        result = pd.Series(np.full(len(values), None, dtype=object), index=values.index)
+        present = values.notna()
+        if not present.any():
+            return result
+        
+        # Parse each distinct cell once, keyed like parse_date(str(value))
+        codes, uniques = pd.factorize(values[present])
+        keys = [str(value).strip() for value in uniques]
+        cache = {} if cache is None else cache
+        if len(cache) > DateParser.CACHE_SIZE:
+            cache.clear()
+        new = [key for key in set(keys) if key not in cache]
+        if new:
+            cache.update(zip(new, DateParser._parse_unique(pd.Series(new, dtype=object))))
+        parsed = np.array([cache[key] for key in keys], dtype=object)
+        result[present] = parsed[codes]
+        return result
+    
+    @staticmethod
+    def _parse_unique(text):
+        """parse_date for a Series of distinct stripped strings, as an object array"""
+        parsed = pd.Series(np.full(len(text), None, dtype=object), index=text.index)
+        # pandas cannot convert non-ASCII (e.g. full-width) digits
+        ascii_text = text[text.map(str.isascii)]
+        parts = ascii_text.str.extract(DateParser._COMBINED_PATTERN)
+        
+        year = pd.Series(np.nan, index=parts.index)
+        month = year.copy()
+        day = year.copy()
+        for i, (_, year_first) in enumerate(DateParser.DATE_PATTERNS):
+            group = parts.iloc[:, 3 * i:3 * i + 3]
+            matched = group.iloc[:, 0].notna()
+            if not matched.any():
+                continue
+            first, second, third = (group.iloc[:, j][matched].astype(int) for j in range(3))
+            year[matched], month[matched], day[matched] = (
+                (first, second, third) if year_first else (third, first, second)
+            )
+        
+        # Valid dates outside the Timestamp range and invalid first matches go to parse_date
+        low, high = DateParser._TIMESTAMP_YEARS
+        in_range = year.between(low, high)
+        stamps = pd.to_datetime(
+            pd.DataFrame({'year': year, 'month': month, 'day': day})[in_range], errors='coerce'
+        ).dropna()
+        parsed[stamps.index] = stamps.dt.date
+        
+        residue = ~text.index.isin(stamps.index)
+        parsed[residue] = text[residue].map(DateParser.parse_date)
+        return parsed.to_numpy()
+    
     @staticmethod
     def format_date_for_display(date_obj):
         """
@@ -1,5 +1,6 @@
 import decimal
-from typing import Union, Optional
+import re
+from typing import Union, Optional, Tuple
 
 class NumberUtils:
     """Utility class for handling floating point arithmetic with precision control"""
@@ -7,6 +8,9 @@ class NumberUtils:
     # Default precision for decimal operations
     DEFAULT_PRECISION = 6
     
+    # Quantity strings like '100g', '50ml', '2kg', '10瓶', '5盒'
+    QUANTITY_PATTERN = re.compile(r'([0-9.]+)\s*([a-zA-Zμ\u4e00-\u9fa5]+)')
+    
     @staticmethod
     def safe_float(value: Union[str, float, int, None], precision: int = None) -> float:
         """
@@ -180,3 +184,24 @@ class NumberUtils:
             return NumberUtils.safe_float(value) >= 0
         except:
             return False
+    
+    @staticmethod
+    def parse_quantity(quantity_str: str) -> Tuple[float, str]:
+        """
+        Parse a quantity string like '100g', '50ml', '2kg', '10瓶', '5盒'
+        
+        Args:
+            quantity_str: Quantity with unit
+            
+        Returns:
+            tuple: (quantity, unit)
+            
+        Raises:
+            ValueError: If the string does not start with a number followed by a unit
+        """
+        match = NumberUtils.QUANTITY_PATTERN.match((quantity_str or '').strip())
+        if match:
+            quantity = NumberUtils.safe_float(match.group(1))
+            unit = match.group(2)
+            return quantity, unit
+        raise ValueError(f"Invalid quantity format: {quantity_str}")
@@ -67,6 +67,9 @@ def apply_sort(query: BaseQuery, model, sort_by: str, sort_order: str = "asc"):
     return query
 
 
-def paginate(query: BaseQuery, page: int, per_page: int):
-    """Simple thin wrapper around `query.paginate` that never raises `404`."""
-    return query.paginate(page=page, per_page=per_page, error_out=False)
+def paginate(query: BaseQuery, page: int, per_page: int, max_per_page: Optional[int] = None):
+    """Simple thin wrapper around `query.paginate` that never raises `404`.
+
+    *per_page* is capped at *max_per_page* when given (see `pagination.per_page`).
+    """
+    return query.paginate(page=page, per_page=per_page, max_per_page=max_per_page, error_out=False)
@@ -0,0 +1,83 @@
+"""
+Process pool for parsing the worksheets of a workbook in parallel
+
+Reading, cleaning and validating a sheet is CPU-bound pandas/openpyxl work
+that threads cannot run in parallel, so map_sheets() hands each sheet to a
+worker process.  Workers only parse: they return plain records and messages,
+and the calling process does every database write.
+
+Memory stays bounded by chunks, as with a sequential import: a worker writes
+each parsed chunk of its sheet to a spill file as soon as it is produced, and
+the caller reads the chunks back one at a time.  A sheet is only started
+when a worker is free, so at most *processes* sheets are being parsed besides
+the one being read, and the spill files on disk never hold more than those.
+
+Workers are spawned rather than forked, because the app process runs import
+and scheduler threads and holds database connections that a fork would copy.
+"""
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+
+def _spill_sheet(func: Callable[..., Iterable[Any]], file_path: str, sheet: str, spill_path: str, *args: Any) -> str:
+    """Write the chunks of func(file_path, sheet, *args) to *spill_path* (runs in a worker)"""
+    with open(spill_path, 'wb') as f:
+        for chunk in func(file_path, sheet, *args):
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return spill_path
+
+
+def _read_spill(spill_path: str) -> Iterator[Any]:
+    with open(spill_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def map_sheets(func: Callable[..., Iterable[Any]], file_path: str, sheets: Sequence[str],
+               processes: int, *args: Any) -> Iterator[Any]:
+    """Yield the chunks of func(file_path, sheet, *args) for every sheet, in sheet order.
+
+    *func* yields the parsed chunks of one sheet and must be importable by
+    name (a module-level function or a static method).  The sheets run in a
+    pool of min(*processes*, number of sheets) processes, or in this process
+    when that is 1 or less.  Closing the iterator early drops the sheets not
+    started yet.
+    """
+    processes = min(processes, len(sheets))
+    if processes <= 1:
+        for sheet in sheets:
+            yield from func(file_path, sheet, *args)
+        return
+
+    spill_dir = tempfile.mkdtemp(prefix='lab_tracker_sheets_')
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        pending = deque()
+        remaining = iter(enumerate(sheets))
+
+        def submit_next():
+            for index, sheet in remaining:
+                spill_path = os.path.join(spill_dir, f'{index}.pickle')
+                pending.append(executor.submit(_spill_sheet, func, file_path, sheet, spill_path, *args))
+                return
+
+        for _ in range(processes):
+            submit_next()
+        while pending:
+            spill_path = pending.popleft().result()
+            # The next sheet starts while this one is read back
+            submit_next()
+            yield from _read_spill(spill_path)
+            os.remove(spill_path)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        shutil.rmtree(spill_dir, ignore_errors=True)
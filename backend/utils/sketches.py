@@ -0,0 +1,150 @@
+"""Streaming summaries for approximate analytics.
+
+Pure data structures without database access; services persist them as JSON
+or raw bytes.
+"""
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter summary with at most *capacity* counters.
+
+    Each counter holds [count, error, weight]: count overestimates the item's
+    true frequency by at most error, and weight is the sum of the weights added
+    while the item was tracked (a lower bound of its true total).  floor bounds
+    the frequency of every untracked item; it only grows when a counter is
+    evicted, so removals keep all bounds valid.  Any item whose frequency
+    exceeds total / capacity is guaranteed to be tracked.  Summaries of
+    different buckets (e.g. days) merge into a summary of their union.
+    """
+
+    def __init__(self, capacity: int, counters: Optional[Dict[str, List[float]]] = None,
+                 floor: float = 0):
+        self.capacity = capacity
+        self.counters: Dict[str, List[float]] = counters or {}
+        self.floor = floor
+
+    def add(self, key: str, weight: float = 0.0) -> None:
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+            counter[2] += weight
+            return
+        if len(self.counters) >= self.capacity:
+            # Evict the smallest counter; its item now falls under the floor
+            smallest = min(self.counters, key=lambda k: self.counters[k][0])
+            self.floor = max(self.floor, self.counters.pop(smallest)[0])
+        # The newcomer may have been seen up to floor times before
+        self.counters[key] = [self.floor + 1, self.floor, weight]
+
+    def remove(self, key: str, weight: float = 0.0) -> None:
+        """Undo one add() of *key* if it is still tracked"""
+        counter = self.counters.get(key)
+        if counter is None:
+            return
+        counter[0] -= 1
+        counter[1] = min(counter[1], counter[0])
+        counter[2] -= weight
+        if counter[0] <= 0:
+            del self.counters[key]
+
+    def min_count(self) -> float:
+        """Upper bound of the frequency of any untracked item"""
+        return self.floor
+
+    def merge(self, other: 'SpaceSaving') -> None:
+        """Fold *other* into this summary (mergeable Space-Saving)"""
+        merged: Dict[str, List[float]] = {}
+        for key in set(self.counters) | set(other.counters):
+            mine = self.counters.get(key, [self.floor, self.floor, 0.0])
+            theirs = other.counters.get(key, [other.floor, other.floor, 0.0])
+            merged[key] = [mine[0] + theirs[0], mine[1] + theirs[1], mine[2] + theirs[2]]
+
+        # Keep the largest counters; dropped ones fall under the floor
+        ranked = sorted(merged, key=lambda k: (-merged[k][0], k))
+        floor = self.floor + other.floor
+        if len(ranked) > self.capacity:
+            floor = max(floor, merged[ranked[self.capacity]][0])
+        self.counters = {key: merged[key] for key in ranked[:self.capacity]}
+        self.floor = floor
+
+    def top(self, n: int) -> List[Tuple[str, float, float, float]]:
+        """Top *n* items as (key, count, error, weight), largest count first"""
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(key, count, error, weight) for key, (count, error, weight) in ranked[:n]]
+
+    def to_json(self) -> str:
+        return json.dumps({'floor': self.floor, 'counters': self.counters},
+                          ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, capacity: int, payload: Optional[str]) -> 'SpaceSaving':
+        if not payload:
+            return cls(capacity)
+        data = json.loads(payload)
+        return cls(capacity, data.get('counters') or {}, data.get('floor') or 0)
+
+    @classmethod
+    def merged(cls, capacity: int, summaries: Iterable['SpaceSaving']) -> 'SpaceSaving':
+        result = cls(capacity)
+        for summary in summaries:
+            result.merge(summary)
+        return result
+
+
+class HyperLogLog:
+    """HyperLogLog distinct-count estimator with 2**precision one-byte registers.
+
+    Registers of different buckets merge by element-wise maximum, so per-day
+    sketches answer distinct counts over any union of days.  The relative
+    standard error is about 1.04 / sqrt(2**precision); small cardinalities use
+    linear counting and are close to exact.  Items cannot be removed.
+    """
+
+    def __init__(self, precision: int = 10, registers: Optional[np.ndarray] = None):
+        self.precision = precision
+        size = 1 << precision
+        self.registers = registers if registers is not None else np.zeros(size, dtype=np.uint8)
+
+    def add(self, key: str) -> None:
+        # Stable 64-bit hash (the builtin hash() is salted per process)
+        value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = value >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = value & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * np.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, precision: int, payload: Optional[bytes]) -> 'HyperLogLog':
+        if not payload:
+            return cls(precision)
+        return cls(precision, np.frombuffer(payload, dtype=np.uint8).copy())
+
+    @classmethod
+    def merged(cls, precision: int, payloads: Iterable[Optional[bytes]]) -> 'HyperLogLog':
+        """Union of serialized sketches in one vectorized pass"""
+        arrays = [np.frombuffer(payload, dtype=np.uint8) for payload in payloads if payload]
+        if not arrays:
+            return cls(precision)
+        return cls(precision, np.maximum.reduce(arrays).copy() if len(arrays) > 1 else arrays[0].copy())
@@ -0,0 +1,101 @@
+"""Dialect-portable time buckets for aggregate queries.
+
+``time_bucket(period, column)`` evaluates to the first day of the day / week /
+month containing *column* (weeks start on Monday) and always returns a date:
+
+* PostgreSQL and other dialects: ``CAST(date_trunc('month', col) AS DATE)``
+* SQLite: ``date(col, 'start of month')`` / ``date(col, '-6 days', 'weekday 1')``
+
+Filter on the raw column (``col >= start``) so the query keeps using its index
+for the range scan; the bucket expression is only needed for GROUP BY / ORDER BY.
+Use ``format_bucket()`` to turn the returned date into the API label.
+"""
+from datetime import date, datetime, timedelta
+from typing import Optional, Union
+
+from sqlalchemy import Date, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+PERIODS = ('day', 'week', 'month')
+
+# Query-string values accepted by the trend endpoints
+PERIOD_ALIASES = {
+    'daily': 'day',
+    'weekly': 'week',
+    'monthly': 'month',
+}
+
+# Default API label per period ('%Y-%W' is the Monday-based week number)
+LABEL_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-%W',
+    'month': '%Y-%m',
+}
+
+_SQLITE_MODIFIERS = {
+    'day': (),
+    'week': ("'-6 days'", "'weekday 1'"),
+    'month': ("'start of month'",),
+}
+
+
+class time_bucket(FunctionElement):
+    """Start date of the *period* ('day', 'week' or 'month') containing *column*"""
+    type = Date()
+    name = 'time_bucket'
+    inherit_cache = True
+
+    def __init__(self, period: str, column):
+        if period not in PERIODS:
+            raise ValueError(f"Unsupported time bucket period: {period}")
+        # Rendered inline (not as a bind parameter) so that the SELECT and GROUP BY
+        # expressions are textually identical, as PostgreSQL requires
+        super().__init__(literal_column(f"'{period}'"), column)
+
+    @property
+    def period(self) -> str:
+        return self.clauses.clauses[0].name.strip("'")
+
+
+@compiles(time_bucket)
+def _compile_time_bucket(element, compiler, **kw):
+    period, column = element.clauses.clauses
+    return (
+        f"CAST(date_trunc({compiler.process(period, **kw)}, "
+        f"{compiler.process(column, **kw)}) AS DATE)"
+    )
+
+
+@compiles(time_bucket, 'sqlite')
+def _compile_time_bucket_sqlite(element, compiler, **kw):
+    column = element.clauses.clauses[1]
+    args = [compiler.process(column, **kw), *_SQLITE_MODIFIERS[element.period]]
+    return f"date({', '.join(args)})"
+
+
+def normalize_period(value: Optional[str], default: str = 'month') -> str:
+    """Map a request value ('daily', 'weekly', 'monthly', 'day', ...) to a bucket period"""
+    value = (value or '').lower()
+    if value in PERIODS:
+        return value
+    return PERIOD_ALIASES.get(value, default)
+
+
+def bucket_start(value: date, period: str) -> date:
+    """Python counterpart of time_bucket() for dates that are already loaded"""
+    if period == 'week':
+        return value - timedelta(days=value.weekday())
+    if period == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def format_bucket(value: Union[date, datetime, str, None], period: str,
+                  fmt: Optional[str] = None) -> Optional[str]:
+    """Format a bucket start date as its API label"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.strftime(fmt or LABEL_FORMATS[period])
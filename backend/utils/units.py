@@ -0,0 +1,114 @@
+"""Unit registry for normalizing quantities to a base unit per dimension.
+
+Quantities are stored in whatever unit the storage item uses.  Converting them
+to a base unit (mass in mg, volume in µL, counts as-is) at write time lets SQL
+aggregate across items: ``SUM(base_quantity)`` grouped by ``base_dimension``.
+Unknown units have no dimension and are left out of base-unit totals.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func
+
+MASS, VOLUME, COUNT = 'mass', 'volume', 'count'
+DIMENSIONS = (MASS, VOLUME, COUNT)
+
+# Base unit of each dimension
+BASE_UNITS = {
+    MASS: 'mg',
+    VOLUME: 'µL',
+    COUNT: 'count',
+}
+
+# API field name of each dimension's base-unit total
+TOTAL_FIELDS = {
+    MASS: 'mass_mg',
+    VOLUME: 'volume_ul',
+    COUNT: 'count',
+}
+
+# Normalized unit -> (dimension, base units per unit).  Keys are lower-case with
+# the micro sign spelled 'u' (see _normalize).
+UNITS: Dict[str, Tuple[str, float]] = {
+    # Mass (mg)
+    'ug': (MASS, 0.001),
+    'mg': (MASS, 1.0),
+    'g': (MASS, 1000.0),
+    'kg': (MASS, 1000000.0),
+    '微克': (MASS, 0.001),
+    '毫克': (MASS, 1.0),
+    '克': (MASS, 1000.0),
+    '千克': (MASS, 1000000.0),
+    '公斤': (MASS, 1000000.0),
+    # Volume (µL)
+    'ul': (VOLUME, 1.0),
+    'ml': (VOLUME, 1000.0),
+    'l': (VOLUME, 1000000.0),
+    '微升': (VOLUME, 1.0),
+    '毫升': (VOLUME, 1000.0),
+    '升': (VOLUME, 1000000.0),
+    # Counts
+    '瓶': (COUNT, 1.0),
+    '盒': (COUNT, 1.0),
+    '个': (COUNT, 1.0),
+    '支': (COUNT, 1.0),
+    '袋': (COUNT, 1.0),
+    '包': (COUNT, 1.0),
+    '桶': (COUNT, 1.0),
+    '罐': (COUNT, 1.0),
+    '片': (COUNT, 1.0),
+    '粒': (COUNT, 1.0),
+    '只': (COUNT, 1.0),
+    '套': (COUNT, 1.0),
+    'pcs': (COUNT, 1.0),
+    'pc': (COUNT, 1.0),
+}
+
+
+def _normalize(unit: str) -> str:
+    return unit.strip().replace('µ', 'u').replace('μ', 'u').lower()
+
+
+def unit_info(unit: Optional[str]) -> Optional[Tuple[str, float]]:
+    """(dimension, factor to the base unit) of *unit*, or None if unknown"""
+    if not unit:
+        return None
+    return UNITS.get(_normalize(unit))
+
+
+def to_base(amount: Optional[float], unit: Optional[str]) -> Tuple[Optional[float], Optional[str]]:
+    """Convert *amount* in *unit* to (base quantity, dimension); (None, None) if the unit is unknown"""
+    info = unit_info(unit)
+    if info is None:
+        return None, None
+    dimension, factor = info
+    # Rounded so that e.g. 0.1 g is stored as 100 mg, not 100.00000000000001
+    return round((amount or 0.0) * factor, 6), dimension
+
+
+def convert(amount: Optional[float], unit: Optional[str], target_unit: Optional[str]) -> Optional[float]:
+    """*amount* in *unit* expressed in *target_unit*; None if the units are unknown or of different dimensions"""
+    if unit == target_unit:
+        return amount or 0.0
+    source, target = unit_info(unit), unit_info(target_unit)
+    if source is None or target is None or source[0] != target[0]:
+        return None
+    return round((amount or 0.0) * source[1] / target[1], 6)
+
+
+def dimension_sums(quantity, dimension) -> List:
+    """SQL SUM of *quantity* per dimension, labelled like TOTAL_FIELDS"""
+    return [
+        func.coalesce(func.sum(case((dimension == name, quantity), else_=0.0)), 0.0).label(TOTAL_FIELDS[name])
+        for name in DIMENSIONS
+    ]
+
+
+def dimension_totals(row) -> Dict[str, float]:
+    """API dict of the dimension_sums() columns of a result row"""
+    mapping = row._mapping
+    return {field: float(mapping[field] or 0.0) for field in TOTAL_FIELDS.values()}
+
+
+def mass_in_grams(totals: Dict[str, float]) -> float:
+    """Mass total of a dimension_totals() dict in grams"""
+    return totals[TOTAL_FIELDS[MASS]] / 1000.0
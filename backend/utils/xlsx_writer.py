@@ -0,0 +1,52 @@
+"""
+Streaming XLSX writer for large exports
+
+Rows are written through an openpyxl write-only workbook, so memory stays
+bounded by the rows buffered for column sizing rather than the whole export.
+A write-only sheet emits its column widths before any cell data, so widths are
+measured on the header and the first WIDTH_SAMPLE_ROWS rows; later rows are
+written straight through.
+"""
+from itertools import islice
+from typing import Any, Iterable, List, Sequence
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+# Rows buffered to size the columns before streaming the rest
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 50
+
+
+def _cell_width(value: Any) -> int:
+    return len(str(value)) if value is not None else 0
+
+
+def write_xlsx(file_path: str, sheet_name: str, headers: Sequence[str], rows: Iterable[Sequence[Any]],
+               width_sample: int = WIDTH_SAMPLE_ROWS, max_width: int = MAX_COLUMN_WIDTH) -> int:
+    """Write *headers* and *rows* to a single-sheet workbook; returns the number of data rows"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+
+    rows = iter(rows)
+    sample: List[Sequence[Any]] = list(islice(rows, width_sample))
+
+    widths = [_cell_width(header) for header in headers]
+    for row in sample:
+        for index, value in enumerate(row):
+            widths[index] = max(widths[index], _cell_width(value))
+    for index, width in enumerate(widths, 1):
+        worksheet.column_dimensions[get_column_letter(index)].width = min(width + 2, max_width)
+
+    worksheet.append(list(headers))
+    row_count = 0
+    for row in sample:
+        worksheet.append(list(row))
+        row_count += 1
+    del sample
+    for row in rows:
+        worksheet.append(list(row))
+        row_count += 1
+
+    workbook.save(file_path)
+    return row_count